@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja.sampler import BlockShuffleSampler
+
+
+def make_samples(n, rng):
+    lengths = rng.integers(256, 4096, size=n)
+    return (rng.standard_normal(length).astype(np.float32) for length in lengths)
+
+
+def drop_page_cache(path):
+    # Evicts the file from the page cache without root, so that every run starts cold.
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def time_it(out_dir, order):
+    drop_page_cache(out_dir / "data.ninja")
+    ragged = RaggedMmap(out_dir)
+    start_t = perf_counter()
+    nbytes = 0
+    for idx in order.tolist():
+        nbytes += ragged[idx].nbytes
+    elapsed = perf_counter() - start_t
+    return elapsed, nbytes / elapsed / 2**20
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    block_nbytes = int(sys.argv[2]) if len(sys.argv) > 2 else 4 * 2**20
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory(dir=os.environ.get("BENCHMARK_DIR")) as tmp_dir:
+        out_dir = Path(tmp_dir) / "ragged"
+        RaggedMmap.from_generator(out_dir, make_samples(n, rng), batch_size=4096)
+        ragged = RaggedMmap(out_dir)
+        orders = {
+            "np.random.permutation": np.random.permutation(n),
+            "BlockShuffleSampler": BlockShuffleSampler(ragged, block_nbytes=block_nbytes).indices(),
+            "sequential": np.arange(n),
+        }
+
+        print("| Order | Time (s) | Throughput (MiB/s) |")
+        print("|:------|---------:|-------------------:|")
+        for name, order in orders.items():
+            elapsed, throughput = time_it(out_dir, order)
+            print(f"| {name} | {elapsed:.3f} | {throughput:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
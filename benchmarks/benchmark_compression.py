@@ -0,0 +1,57 @@
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from mmap_ninja import compression
+from mmap_ninja.ragged import RaggedMmap
+
+
+def make_samples(n, rng):
+    # Smooth, low-entropy samples, which compress roughly like images.
+    lengths = rng.integers(1024, 16384, size=n)
+    return [np.cumsum(rng.integers(-2, 3, size=length)).astype(np.int16) for length in lengths]
+
+
+def read_all(ragged, order):
+    start_t = perf_counter()
+    nbytes = 0
+    for idx in order.tolist():
+        nbytes += ragged[idx].nbytes
+    return nbytes / (perf_counter() - start_t) / 2**20
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    block_nbytes = int(sys.argv[2]) if len(sys.argv) > 2 else compression.DEFAULT_BLOCK_NBYTES
+    rng = np.random.default_rng(0)
+    samples = make_samples(n, rng)
+    random_order = rng.permutation(n)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_dir = Path(tmp_dir) / "raw"
+        raw = RaggedMmap.from_lists(raw_dir, samples)
+        raw_nbytes = raw.memmap.nbytes
+
+        print("| Codec | Ratio | Compress (MiB/s) | Sequential read (MiB/s) | Random read (MiB/s) |")
+        print("|:------|------:|-----------------:|------------------------:|--------------------:|")
+        print(f"| none | 1.00 | - | {read_all(raw, np.arange(n)):.1f} | {read_all(raw, random_order):.1f} |")
+        for codec in compression.CODECS:
+            out_dir = Path(tmp_dir) / codec
+            shutil.copytree(raw_dir, out_dir)
+            start_t = perf_counter()
+            compression.compress(out_dir, codec=codec, block_nbytes=block_nbytes)
+            compress_speed = raw_nbytes / (perf_counter() - start_t) / 2**20
+            ragged = RaggedMmap(out_dir)
+            ratio = raw_nbytes / ragged.memmap.compressed_nbytes
+            sequential = read_all(ragged, np.arange(n))
+            # Reopen, so that the random reads start with an empty block cache.
+            random = read_all(RaggedMmap(out_dir), random_order)
+            print(f"| {codec} | {ratio:.2f} | {compress_speed:.1f} | {sequential:.1f} | {random:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from mmap_ninja.ragged import RaggedMmap
+
+
+def make_samples(n, rng):
+    lengths = rng.integers(1, 512, size=n)
+    return [rng.standard_normal(length).astype(np.float32) for length in lengths]
+
+
+def time_it(fn, batches):
+    start_t = perf_counter()
+    for batch in batches:
+        fn(batch)
+    return perf_counter() - start_t
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    n_batches = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ragged = RaggedMmap.from_lists(Path(tmp_dir) / "ragged", make_samples(n, rng))
+        random_batches = [rng.integers(0, n, size=batch_size) for _ in range(n_batches)]
+        sequential_batches = [np.arange(i, i + batch_size) % n for i in range(0, n_batches * batch_size, batch_size)]
+
+        print("| Access pattern | List comprehension (s) | get_multiple (s) | Speedup |")
+        print("|:---------------|-----------------------:|-----------------:|--------:|")
+        for name, batches in [("random", random_batches), ("sequential", sequential_batches)]:
+            baseline = time_it(lambda batch: [ragged[i] for i in batch], batches)
+            batched = time_it(ragged.get_multiple, batches)
+            print(f"| {name} | {baseline:.6f} | {batched:.6f} | {baseline / batched:.2f}x |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+"""
+A self-contained benchmark suite, which writes machine-readable results, so that they can be compared across commits.
+
+Every container type (numpy, ragged and strings) is benchmarked on synthetic datasets with different distributions
+of the sample sizes, against ``np.load``, ``pickle`` and ``sqlite3`` baselines. Read benchmarks run both with a cold
+page cache (the files are evicted with ``posix_fadvise`` before every repetition) and with a warm one.
+
+Usage::
+
+    python benchmarks/benchmark_suite.py --scale small --output results.json
+    python benchmarks/benchmark_suite.py --compare before.json after.json
+"""
+import argparse
+import gc
+import json
+import os
+import pickle
+import platform
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+import numpy as np
+
+import mmap_ninja
+from mmap_ninja import numpy as np_ninja
+from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja.string import StringsMmap
+
+SCALES = {"small": 10_000, "medium": 100_000, "large": 1_000_000}
+BATCH_SIZE = 64
+N_RANDOM_READS = 5_000
+N_APPENDS = 1_000
+
+
+# Synthetic datasets. Every generator returns the samples of one dataset, deterministically for a given seed.
+
+
+def numpy_fixed(n, rng):
+    return rng.standard_normal((n, 64)).astype(np.float32)
+
+
+def ragged_lengths(n, rng, distribution):
+    if distribution == "fixed":
+        return np.full(n, 256)
+    if distribution == "uniform":
+        return rng.integers(16, 1024, size=n)
+    # Heavy tailed, like the lengths of documents or audio clips.
+    return np.clip(rng.lognormal(mean=5.0, sigma=1.0, size=n), 1, 65536).astype(np.int64)
+
+
+def ragged_samples(n, rng, distribution):
+    return [rng.standard_normal(length).astype(np.float32) for length in ragged_lengths(n, rng, distribution)]
+
+
+def image_samples(n, rng):
+    heights, widths = rng.integers(16, 64, size=(2, n))
+    return [rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8) for h, w in zip(heights, widths)]
+
+
+def string_samples(n, rng, distribution):
+    if distribution == "unicode":
+        alphabet = np.array(list("abcdefghij ÄÖÜäöüßжщ€✓"))
+        lengths = rng.integers(8, 256, size=n)
+    else:
+        alphabet = np.array(list("abcdefghijklmnopqrstuvwxyz0123456789 "))
+        lengths = rng.integers(8, 32, size=n) if distribution == "short" else rng.integers(256, 4096, size=n)
+    return ["".join(rng.choice(alphabet, size=length)) for length in lengths]
+
+
+DATASETS = {
+    "numpy/fixed": ("numpy", numpy_fixed),
+    "ragged/fixed": ("ragged", lambda n, rng: ragged_samples(n, rng, "fixed")),
+    "ragged/uniform": ("ragged", lambda n, rng: ragged_samples(n, rng, "uniform")),
+    "ragged/lognormal": ("ragged", lambda n, rng: ragged_samples(n, rng, "lognormal")),
+    "ragged/images": ("ragged", image_samples),
+    "strings/short": ("strings", lambda n, rng: string_samples(n, rng, "short")),
+    "strings/long": ("strings", lambda n, rng: string_samples(n, rng, "long")),
+    "strings/unicode": ("strings", lambda n, rng: string_samples(n, rng, "unicode")),
+}
+
+
+# Backends. ``build`` persists the samples into a directory and ``open`` returns an object with ``get``,
+# ``get_batch`` and ``close``, so that every backend is read in the same way.
+
+
+class MmapNinjaReader:
+    def __init__(self, container):
+        self.container = container
+        self.get = container.__getitem__
+        self.get_batch = container.__getitem__
+
+    def close(self):
+        if hasattr(self.container, "close"):
+            self.container.close()
+
+
+class MmapNinjaBackend:
+    name = "mmap_ninja"
+    kinds = ("numpy", "ragged", "strings")
+
+    @staticmethod
+    def build(out_dir, kind, samples):
+        if kind == "numpy":
+            np_ninja.from_ndarray(out_dir, samples)
+        elif kind == "ragged":
+            RaggedMmap.from_lists(out_dir, samples)
+        else:
+            StringsMmap.from_strings(out_dir, samples)
+
+    @staticmethod
+    def open(out_dir, kind):
+        if kind == "numpy":
+            return MmapNinjaReader(np_ninja.open_existing(out_dir))
+        if kind == "ragged":
+            return MmapNinjaReader(RaggedMmap(out_dir))
+        return MmapNinjaReader(StringsMmap(out_dir))
+
+
+class ListReader:
+    def __init__(self, samples):
+        self.samples = samples
+
+    def get(self, idx):
+        return self.samples[idx]
+
+    def get_batch(self, indices):
+        if isinstance(self.samples, np.ndarray):
+            return self.samples[indices]
+        return [self.samples[i] for i in indices.tolist()]
+
+    def close(self):
+        self.samples = None
+
+
+class NpLoadBackend:
+    name = "np.load"
+    kinds = ("numpy",)
+
+    @staticmethod
+    def build(out_dir, kind, samples):
+        out_dir.mkdir()
+        np.save(out_dir / "data.npy", samples)
+
+    @staticmethod
+    def open(out_dir, kind):
+        return ListReader(np.load(out_dir / "data.npy"))
+
+
+class PickleBackend:
+    name = "pickle"
+    kinds = ("numpy", "ragged", "strings")
+
+    @staticmethod
+    def build(out_dir, kind, samples):
+        out_dir.mkdir()
+        with open(out_dir / "data.pkl", "wb") as out_file:
+            pickle.dump(samples, out_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def open(out_dir, kind):
+        with open(out_dir / "data.pkl", "rb") as in_file:
+            return ListReader(pickle.load(in_file))
+
+
+class SqliteReader:
+    def __init__(self, path, kind):
+        self.connection = sqlite3.connect(path)
+        self.kind = kind
+        self.dtype = None
+        if kind != "strings":
+            self.dtype = np.dtype(self.connection.execute("SELECT dtype FROM meta").fetchone()[0])
+
+    def _decode(self, shape, data):
+        if self.kind == "strings":
+            return data
+        return np.frombuffer(data, dtype=self.dtype).reshape(np.frombuffer(shape, dtype=np.int64))
+
+    def get(self, idx):
+        row = self.connection.execute("SELECT shape, data FROM samples WHERE id = ?", (idx,)).fetchone()
+        return self._decode(*row)
+
+    def get_batch(self, indices):
+        indices = indices.tolist()
+        placeholders = ",".join("?" * len(indices))
+        query = f"SELECT id, shape, data FROM samples WHERE id IN ({placeholders})"
+        rows = {idx: (shape, data) for idx, shape, data in self.connection.execute(query, indices)}
+        return [self._decode(*rows[idx]) for idx in indices]
+
+    def close(self):
+        self.connection.close()
+
+
+class SqliteBackend:
+    name = "sqlite"
+    kinds = ("numpy", "ragged", "strings")
+
+    @staticmethod
+    def build(out_dir, kind, samples):
+        out_dir.mkdir()
+        with sqlite3.connect(out_dir / "data.sqlite") as connection:
+            connection.execute("CREATE TABLE samples (id INTEGER PRIMARY KEY, shape BLOB, data)")
+            if kind == "strings":
+                rows = ((i, None, sample) for i, sample in enumerate(samples))
+            else:
+                connection.execute("CREATE TABLE meta (dtype TEXT)")
+                connection.execute("INSERT INTO meta VALUES (?)", (np.asarray(samples[0]).dtype.str,))
+                rows = (
+                    (i, np.array(sample.shape, dtype=np.int64).tobytes(), sample.tobytes())
+                    for i, sample in enumerate(samples)
+                )
+            connection.executemany("INSERT INTO samples VALUES (?, ?, ?)", rows)
+        connection.close()
+
+    @staticmethod
+    def open(out_dir, kind):
+        return SqliteReader(out_dir / "data.sqlite", kind)
+
+
+BACKENDS = [MmapNinjaBackend, NpLoadBackend, PickleBackend, SqliteBackend]
+
+
+# Measurement.
+
+
+def drop_page_cache(path):
+    """
+    Evicts every file under ``path`` from the page cache (without root), so that the next read starts cold.
+    """
+    for file_path in [path] if path.is_file() else path.rglob("*"):
+        if not file_path.is_file():
+            continue
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def measure(fn, repeat, cold_path=None):
+    """
+    Runs ``fn`` ``repeat`` times and returns the durations. With ``cold_path``, its files are evicted from the page
+    cache before every run, otherwise ``fn`` runs once before the measurement to warm the cache up.
+    """
+    if cold_path is None:
+        fn()
+    durations = []
+    for _ in range(repeat):
+        # Release the mappings of the previous run, otherwise their pages cannot be evicted.
+        gc.collect()
+        if cold_path is not None:
+            drop_page_cache(cold_path)
+        start_t = perf_counter()
+        fn()
+        durations.append(perf_counter() - start_t)
+    return durations
+
+
+def read_workloads(backend, out_dir, kind, n, rng):
+    """
+    The read benchmarks. Every workload opens the container itself, so that a cold run includes the first page faults.
+    """
+    random_indices = rng.integers(0, n, size=min(n, N_RANDOM_READS))
+    batches = [rng.integers(0, n, size=BATCH_SIZE) for _ in range(max(len(random_indices) // BATCH_SIZE, 1))]
+
+    def run(body):
+        def workload():
+            reader = backend.open(out_dir, kind)
+            try:
+                body(reader)
+            finally:
+                reader.close()
+
+        return workload
+
+    def sequential(reader):
+        for i in range(n):
+            reader.get(i)
+
+    def random(reader):
+        for i in random_indices.tolist():
+            reader.get(i)
+
+    def batch(reader):
+        for indices in batches:
+            reader.get_batch(indices)
+
+    return {
+        "open": (run(lambda reader: reader.get(0)), 1),
+        "sequential_read": (run(sequential), n),
+        "random_read": (run(random), len(random_indices)),
+        "batch_read": (run(batch), len(batches) * BATCH_SIZE),
+    }
+
+
+def write_workloads(tmp_dir, kind, samples):
+    """
+    The write benchmarks of mmap_ninja, which are compared across commits, but not against the baselines.
+    """
+    out_dir = tmp_dir / "write"
+    half = len(samples) // 2
+    appended = samples[half : half + N_APPENDS]
+    batches = [samples[i : i + BATCH_SIZE] for i in range(half, len(samples), BATCH_SIZE)]
+
+    def fresh(build_first_half):
+        shutil.rmtree(out_dir, ignore_errors=True)
+        return build_first_half(out_dir, samples[:half])
+
+    if kind == "numpy":
+
+        def extend():
+            fresh(np_ninja.from_ndarray)
+            growable = np_ninja.GrowableMmap(out_dir)
+            for batch in batches:
+                growable.extend(batch)
+            growable.close(trim=True)
+
+        def append():
+            fresh(np_ninja.from_ndarray)
+            growable = np_ninja.GrowableMmap(out_dir)
+            for sample in appended:
+                growable.append(sample)
+            growable.close(trim=True)
+
+        def from_generator():
+            shutil.rmtree(out_dir, ignore_errors=True)
+            np_ninja.from_generator(out_dir, iter(samples), batch_size=1024)
+
+        return {
+            "extend": (extend, len(samples) - half),
+            "append": (append, len(appended)),
+            "from_generator": (from_generator, len(samples)),
+        }
+
+    cls, ctor = (RaggedMmap, RaggedMmap.from_lists) if kind == "ragged" else (StringsMmap, StringsMmap.from_strings)
+
+    def extend():
+        container = fresh(ctor)
+        for batch in batches:
+            container.extend(batch)
+
+    def append():
+        container = fresh(ctor)
+        for sample in appended:
+            container.append(sample)
+
+    def from_generator():
+        shutil.rmtree(out_dir, ignore_errors=True)
+        cls.from_generator(out_dir, iter(samples), batch_size=1024)
+
+    workloads = {
+        "extend": (extend, len(samples) - half),
+        "append": (append, len(appended)),
+        "from_generator": (from_generator, len(samples)),
+    }
+    if kind == "ragged":
+
+        def from_indexable():
+            shutil.rmtree(out_dir, ignore_errors=True)
+            RaggedMmap.from_indexable(out_dir, samples, batch_size=1024)
+
+        workloads["from_indexable"] = (from_indexable, len(samples))
+    return workloads
+
+
+def result(dataset, backend, operation, cache, durations, n_items):
+    seconds = median(durations)
+    return {
+        "dataset": dataset,
+        "backend": backend,
+        "operation": operation,
+        "cache": cache,
+        "n_items": n_items,
+        "seconds": durations,
+        "median_seconds": seconds,
+        "items_per_second": n_items / seconds if seconds > 0 else None,
+    }
+
+
+def run_dataset(dataset, n, repeat, seed, tmp_dir, cache_modes):
+    kind, generate = DATASETS[dataset]
+    rng = np.random.default_rng(seed)
+    samples = generate(n, rng)
+    results = []
+    for backend in BACKENDS:
+        if kind not in backend.kinds:
+            continue
+        out_dir = tmp_dir / backend.name
+        start_t = perf_counter()
+        backend.build(out_dir, kind, samples)
+        results.append(result(dataset, backend.name, "build", "n/a", [perf_counter() - start_t], n))
+        workloads = read_workloads(backend, out_dir, kind, n, np.random.default_rng(seed))
+        for operation, (fn, n_items) in workloads.items():
+            for cache in cache_modes:
+                durations = measure(fn, repeat, cold_path=out_dir if cache == "cold" else None)
+                results.append(result(dataset, backend.name, operation, cache, durations, n_items))
+        shutil.rmtree(out_dir)
+    for operation, (fn, n_items) in write_workloads(tmp_dir, kind, samples).items():
+        results.append(result(dataset, "mmap_ninja", operation, "n/a", measure(fn, repeat), n_items))
+    shutil.rmtree(tmp_dir / "write", ignore_errors=True)
+    return results
+
+
+def metadata(args, n):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "mmap_ninja": mmap_ninja.__version__,
+        "numpy": np.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "n_samples": n,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+
+
+def compare(before_path, after_path):
+    """
+    Prints the ratio of the median durations of every benchmark, which is present in both result files.
+    """
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+
+    def key(entry):
+        return entry["dataset"], entry["backend"], entry["operation"], entry["cache"]
+
+    before_results = {key(entry): entry for entry in before["results"]}
+    print(f"Before: {before['metadata']['commit']}, after: {after['metadata']['commit']}")
+    print("| Dataset | Backend | Operation | Cache | Before (s) | After (s) | Speedup |")
+    print("|:--------|:--------|:----------|:------|-----------:|----------:|--------:|")
+    for entry in after["results"]:
+        old = before_results.get(key(entry))
+        if old is None:
+            continue
+        speedup = old["median_seconds"] / entry["median_seconds"] if entry["median_seconds"] > 0 else float("nan")
+        print(
+            f"| {' | '.join(key(entry))} | {old['median_seconds']:.6f} | {entry['median_seconds']:.6f} "
+            f"| {speedup:.2f}x |"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="small", help="The number of samples of every dataset.")
+    parser.add_argument("--datasets", nargs="*", choices=DATASETS, default=list(DATASETS))
+    parser.add_argument("--repeat", type=int, default=3, help="The number of repetitions of every benchmark.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-cold", action="store_true", help="Skip the cold page cache runs.")
+    parser.add_argument("--output", type=Path, help="Where to write the JSON results (defaults to stdout).")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("BEFORE", "AFTER"), help="Compare two results.")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    n = SCALES[args.scale]
+    # Evicting files from the page cache needs posix_fadvise, which is not available on every platform.
+    cache_modes = ["warm"] if args.no_cold or not hasattr(os, "posix_fadvise") else ["cold", "warm"]
+    results = []
+    with tempfile.TemporaryDirectory(dir=os.environ.get("BENCHMARK_DIR")) as tmp_dir:
+        for dataset in args.datasets:
+            dataset_dir = Path(tmp_dir) / dataset.replace("/", "_")
+            dataset_dir.mkdir()
+            results.extend(run_dataset(dataset, n, args.repeat, args.seed, dataset_dir, cache_modes))
+    report = json.dumps({"metadata": metadata(args, n), "results": results}, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        args.output.write_text(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,19 @@ from .numpy import (
     open_existing as np_open_existing,
     extend_dir as np_extend_dir,
     extend as np_extend,
-    append as np_append
+    append as np_append,
+    advise as np_advise,
+    willneed as np_willneed,
+    GrowableMmap,
+)
+from .tombstones import (
+    live_rows as np_live_rows,
+    delete_rows as np_delete_rows,
+    compact_array as np_compact,
 )
 
 from .generic import open_existing
 from .ragged import RaggedMmap
 from .string import StringsMmap
+from .dictionary import DictionaryStringsMmap
+from .prefetch import prefetch
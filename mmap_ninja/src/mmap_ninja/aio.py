@@ -0,0 +1,191 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Set, Sequence, Tuple
+
+import numpy as np
+
+from mmap_ninja import numpy as np_ninja
+
+# Coalesced reads stop growing once they span this many bytes, so that one request does not serialize the rest.
+_MAX_READ_NBYTES = 4 * 1024 * 1024
+
+
+def _preadv(fd: int, buffers: Sequence, offset: int) -> None:
+    """
+    Fills ``buffers`` with consecutive bytes of ``fd``, starting at ``offset``, without moving the file position.
+    """
+    buffers = [memoryview(buffer) for buffer in buffers if len(buffer) > 0]
+    while buffers:
+        if hasattr(os, "preadv"):
+            n_read = os.preadv(fd, buffers[: np_ninja._IOV_MAX], offset)
+        else:
+            data = os.pread(fd, len(buffers[0]), offset)
+            buffers[0][: len(data)] = data
+            n_read = len(data)
+        if n_read == 0:
+            raise EOFError(f"Expected {sum(len(buffer) for buffer in buffers)} more bytes at offset {offset}!")
+        offset += n_read
+        # Drop the buffers which were filled completely and keep the rest of a partially filled one.
+        while buffers and n_read >= len(buffers[0]):
+            n_read -= len(buffers[0])
+            buffers = buffers[1:]
+        if n_read > 0:
+            buffers[0] = buffers[0][n_read:]
+
+
+def _coalesce(starts: Sequence[int], ends: Sequence[int], max_gap: int) -> List[Tuple[int, int]]:
+    """
+    Splits the sorted, non-overlapping ranges into groups, which are read with one call each.
+    Two neighbouring ranges are read together if at most ``max_gap`` bytes separate them.
+
+    :return: The ``(first, last)`` (exclusive) positions of the ranges of every group.
+    """
+    groups = []
+    first = 0
+    for i in range(1, len(starts)):
+        gap = starts[i] - ends[i - 1]
+        too_big = ends[i] - starts[first] > _MAX_READ_NBYTES or 2 * (i - first) >= np_ninja._IOV_MAX
+        if gap < 0 or gap > max_gap or too_big:
+            groups.append((first, i))
+            first = i
+    if len(starts) > 0:
+        groups.append((first, len(starts)))
+    return groups
+
+
+class AsyncReader:
+    """
+    Serves the samples of a ``RaggedMmap`` or a ``StringsMmap`` to ``asyncio`` code, without blocking the event loop.
+
+    The index lookups and the reads run in a thread pool of ``max_concurrency`` threads, and the data is read with
+    ``os.preadv`` instead of through the memory map, so a cold page fault never stalls the event loop.
+    All requests which are made during the same iteration of the event loop are served together: their byte ranges
+    are sorted, and ranges which are at most ``coalesce_gap`` bytes apart are read with a single call.
+
+    The samples are the same as the ones returned by ``__getitem__``, except that they are copies instead of views
+    into the memory map. Compressed containers are read through ``__getitem__`` in the thread pool.
+    """
+
+    def __init__(self, container, max_concurrency: int = 8, coalesce_gap: int = 64 * 1024):
+        """
+        :param container: The ``RaggedMmap`` or ``StringsMmap`` to read from.
+        :param max_concurrency: The maximum number of index lookups and reads which run at the same time.
+        :param coalesce_gap: The maximum number of unused bytes between two ranges, which are read together.
+        """
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency should be at least 1, got {max_concurrency}!")
+        if coalesce_gap < 0:
+            raise ValueError(f"coalesce_gap should not be negative, got {coalesce_gap}!")
+        self.container = container
+        self.max_concurrency = max_concurrency
+        self.coalesce_gap = coalesce_gap
+        self.n_reads = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="mmap_ninja_aio")
+        self._file = None
+        self._data_offset = 0
+        self._pending: List[Tuple[np.ndarray, asyncio.Future]] = []
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def aget(self, item):
+        """
+        The asynchronous counterpart of ``container[item]``.
+
+        :param item: An index, a slice, a sequence of indices or a boolean mask.
+        :return: A sample if ``item`` is a scalar, otherwise a list of samples.
+        """
+        if np.isscalar(item):
+            return (await self._request(np_ninja._normalize_indices([item], len(self.container))))[0]
+        return await self._request(np_ninja._normalize_indices(item, len(self.container)))
+
+    async def aget_many(self, indices) -> list:
+        """
+        The asynchronous counterpart of ``container.get_multiple(indices)``.
+
+        :param indices: A slice, a sequence of indices or a boolean mask.
+        :return: The list of samples.
+        """
+        return await self._request(np_ninja._normalize_indices(indices, len(self.container)))
+
+    def _request(self, indices: np.ndarray) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if len(indices) == 0:
+            future.set_result([])
+            return future
+        if not self._pending:
+            # Serve everything which is requested until the event loop gets back to the scheduled callback.
+            loop.call_soon(self._dispatch)
+        self._pending.append((indices, future))
+        return future
+
+    def _dispatch(self):
+        requests, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._serve(requests))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _serve(self, requests: List[Tuple[np.ndarray, asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        indices = np.concatenate([indices for indices, _ in requests])
+        try:
+            plan = await loop.run_in_executor(self._executor, self.container._read_plan, indices)
+            if plan is None:
+                samples = await loop.run_in_executor(self._executor, self.container.get_multiple, indices)
+            else:
+                starts, ends, decode = plan
+                buffers = await self._read_ranges(np.asarray(starts), np.asarray(ends))
+                samples = [decode(k, buffer) for k, buffer in enumerate(buffers)]
+        except Exception as e:
+            for _, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        position = 0
+        for request_indices, future in requests:
+            if not future.done():
+                future.set_result(samples[position : position + len(request_indices)])
+            position += len(request_indices)
+
+    async def _read_ranges(self, starts: np.ndarray, ends: np.ndarray) -> List[bytearray]:
+        """
+        Reads the byte ranges of the data file and returns one buffer per range (ranges which are requested
+        more than once share the buffer).
+        """
+        if self._file is None:
+            self._file, self._data_offset, _ = self.container._store.open_file()
+        ranges, inverse = np.unique(np.stack([starts, ends], axis=1), axis=0, return_inverse=True)
+        buffers = [bytearray(end - start) for start, end in ranges.tolist()]
+        loop = asyncio.get_running_loop()
+        reads = [
+            loop.run_in_executor(self._executor, self._read_group, ranges[first:last], buffers[first:last])
+            for first, last in _coalesce(ranges[:, 0].tolist(), ranges[:, 1].tolist(), self.coalesce_gap)
+        ]
+        self.n_reads += len(reads)
+        await asyncio.gather(*reads)
+        return [buffers[i] for i in inverse.ravel().tolist()]
+
+    def _read_group(self, ranges: np.ndarray, buffers: List[bytearray]) -> None:
+        # The bytes between the ranges are read into a scratch buffer and thrown away.
+        scratch = memoryview(bytearray(self.coalesce_gap))
+        iov = [buffers[0]]
+        for (start, _), (_, previous_end), buffer in zip(ranges[1:].tolist(), ranges[:-1].tolist(), buffers[1:]):
+            if start > previous_end:
+                iov.append(scratch[: start - previous_end])
+            iov.append(buffer)
+        _preadv(self._file.fileno(), iov, self._data_offset + int(ranges[0, 0]))
+
+    def close(self):
+        """
+        Shuts down the thread pool and closes the data file.
+        """
+        self._executor.shutdown(wait=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,10 +1,18 @@
+import itertools
+import os
 import struct
+import weakref
 from copy import copy
 from dataclasses import dataclass
+from functools import cached_property, wraps
 from pathlib import Path
-from typing import Union, Sequence, List
+from time import perf_counter_ns
+from typing import Union, Sequence, List, Tuple, Optional, Iterable, Iterator
+
+import numpy as np
 
 from .parallel import ParallelBatchCollector
+from .stats import AccessStats, _nbytes
 
 
 def _bytes_to_int(inp: bytes, fmt: str = "<i") -> int:
@@ -158,34 +166,100 @@ def _file_to_shape(file: Union[str, Path]) -> Sequence[int]:
         return _bytes_to_shape(out_file.read())
 
 
+# The number of strings which are encoded together by ``_sequence_of_strings_to_bytes``.
+_ENCODE_CHUNK = 65536
+
+
 @dataclass
 class BytesSlices:
-    buffer: bytes
-    starts: List[int]
-    ends: List[int]
+    chunks: List[bytes]
+    starts: np.ndarray
+    ends: np.ndarray
+    # The number of strings in every chunk.
+    chunk_counts: List[int]
+
+    @property
+    def buffer(self) -> bytes:
+        return b"".join(self.chunks)
+
+    def encoded(self) -> Iterator[bytes]:
+        """
+        Yields every encoded string, sliced out of its chunk (without joining the chunks).
+        """
+        first = 0
+        chunk_start = 0
+        for chunk, count in zip(self.chunks, self.chunk_counts):
+            starts = self.starts[first : first + count].tolist()
+            ends = self.ends[first : first + count].tolist()
+            for start, end in zip(starts, ends):
+                yield chunk[start - chunk_start : end - chunk_start]
+            first += count
+            chunk_start += len(chunk)
+
+
+def _encode_chunk(strings: List[str]) -> Tuple[bytes, np.ndarray]:
+    """
+    Encodes a chunk of strings as UTF-8.
+
+    :param strings: The strings.
+    :return: The encoded strings, joined together, and the number of bytes of every string.
+    """
+    joined = "".join(strings)
+    if joined.isascii():
+        # Every character is a single byte, so the whole chunk can be encoded at once.
+        return joined.encode("ascii"), np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+    encoded = [_str_to_bytes(string) for string in strings]
+    return b"".join(encoded), np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
 
 
-def _sequence_of_strings_to_bytes(strings: Sequence[str], verbose=False) -> BytesSlices:
+def _sequence_of_strings_to_bytes(strings: Union[Iterable[str], np.ndarray], verbose=False) -> BytesSlices:
     """
-    Converts a sequence of strings to a bytes array
+    Converts a sequence of strings to bytes, encoding them in large chunks.
 
-    :param strings: A sequence of strings.
+    :param strings: A sequence of strings, a numpy array of strings (of dtype ``str`` or ``object``),
+        or any other iterable of strings (e.g. a generator).
     :param verbose: whether a tqdm progressbar should be shown.
     :return: the bytes slices
     """
-    buffer = bytearray()
-    starts = []
-    ends = []
+    if isinstance(strings, np.ndarray):
+        strings = strings.ravel()
+    progress = None
     if verbose:
         from tqdm import tqdm
 
-        strings = tqdm(strings)
-    for string in strings:
-        arr = _str_to_bytes(string)
-        starts.append(len(buffer))
-        ends.append(len(buffer) + len(arr))
-        buffer.extend(arr)
-    return BytesSlices(bytes(buffer), starts, ends)
+        progress = tqdm(total=len(strings) if hasattr(strings, "__len__") else None)
+    chunks = []
+    lengths = []
+    for chunk in _string_chunks(strings):
+        encoded, chunk_lengths = _encode_chunk(chunk)
+        chunks.append(encoded)
+        lengths.append(chunk_lengths)
+        if progress is not None:
+            progress.update(len(chunk))
+    if progress is not None:
+        progress.close()
+    chunk_counts = [len(chunk_lengths) for chunk_lengths in lengths]
+    lengths = np.concatenate(lengths) if lengths else np.empty(0, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    return BytesSlices(chunks, ends - lengths, ends, chunk_counts)
+
+
+def _string_chunks(strings: Union[Iterable[str], np.ndarray]) -> Iterator[List[str]]:
+    """
+    Splits the strings into lists of ``_ENCODE_CHUNK`` strings. Sequences are sliced, other iterables are consumed
+    one chunk at a time.
+    """
+    if hasattr(strings, "__len__") and hasattr(strings, "__getitem__"):
+        for chunk_start in range(0, len(strings), _ENCODE_CHUNK):
+            chunk = strings[chunk_start : chunk_start + _ENCODE_CHUNK]
+            yield chunk.tolist() if isinstance(chunk, np.ndarray) else list(chunk)
+        return
+    iterator = iter(strings)
+    while True:
+        chunk = list(itertools.islice(iterator, _ENCODE_CHUNK))
+        if not chunk:
+            return
+        yield chunk
 
 
 def from_generator_base(out_dir, sample_generator, batch_size, batch_ctor, extend_fn=None, **kwargs):
@@ -228,10 +302,22 @@ def from_generator_base(out_dir, sample_generator, batch_size, batch_ctor, exten
                 extend_fn(memmap, samples)
             else:
                 memmap.extend(samples)
+    _release_capacity(memmap)
     return memmap
 
 
-def from_indexable_base(out_dir, indexable, batch_size, batch_ctor, extend_fn=None, n_jobs=None, verbose=False, **kwargs):
+def _release_capacity(memmap) -> None:
+    """
+    Closes a container after a bulk build, so that the unused capacity, which appending reserves for
+    the next batches (see ``numpy.GrowableMmap``), is released. The container reopens its files lazily.
+    """
+    if memmap is not None and not isinstance(memmap, np.memmap) and hasattr(memmap, "close"):
+        memmap.close()
+
+
+def from_indexable_base(
+    out_dir, indexable, batch_size, batch_ctor, extend_fn=None, n_jobs=None, verbose=False, queue_depth=0, **kwargs
+):
     """
     Creates an output from an indexable object, flushing every batch to disk. Can be done in parallel.
     indexable[i] (or indexable(i)) will become memmap[i].
@@ -243,6 +329,8 @@ def from_indexable_base(out_dir, indexable, batch_size, batch_ctor, extend_fn=No
     :param extend_fn: Functon to call when doing .extend. By default, this will call memmap.extend(samples).
     :param n_jobs: number of jobs to iterate through indexable with. Default=None corresponds to no parallelization.
     :param verbose: whether to print progress meter.
+    :param queue_depth: The number of batches which can be produced ahead, while the previous batch is written to disk.
+        Default=0 corresponds to no pipelining.
     :param kwargs: Additional keyword arguments to be passed when initializing the output.
     :return:
     """
@@ -250,7 +338,7 @@ def from_indexable_base(out_dir, indexable, batch_size, batch_ctor, extend_fn=No
     out_dir.mkdir(exist_ok=True)
     memmap = None
 
-    batch_collector = ParallelBatchCollector(indexable, batch_size, n_jobs, verbose)
+    batch_collector = ParallelBatchCollector(indexable, batch_size, n_jobs, verbose, queue_depth=queue_depth)
 
     for samples in batch_collector.batches():
         if memmap is None:
@@ -261,6 +349,7 @@ def from_indexable_base(out_dir, indexable, batch_size, batch_ctor, extend_fn=No
             else:
                 memmap.extend(samples)
 
+    _release_capacity(memmap)
     return memmap
 
 
@@ -269,12 +358,96 @@ class Wrapped:
         self.data = data
         self.wrapper_fn = wrapper_fn
         self.copy_before_wrapper_fn = copy_before_wrapper_fn
+        self._recorder = None
 
     def __getitem__(self, item):
+        if self._recorder is not None:
+            return self._get_timed(item)
         sample = self.data[item]
         if self.copy_before_wrapper_fn:
             sample = copy(sample)
         return self.wrapper_fn(sample)
 
+    def enable_stats(self, callback=None, report_every: int = 1000, residency_every: int = 100) -> AccessStats:
+        """
+        Starts recording the reads (see ``stats.AccessStats``), with their latency split into reading from ``data``
+        and ``wrapper_fn``. Enable the stats of ``data`` as well, to split the first phase further.
+
+        :param callback: Called with a snapshot of the statistics every ``report_every`` calls.
+        :param report_every: How often (in calls) ``callback`` is called.
+        :param residency_every: How often (in calls) the page residency is sampled with ``mincore``.
+        :return: The ``AccessStats``.
+        """
+        self._recorder = AccessStats(callback=callback, report_every=report_every, residency_every=residency_every)
+        return self._recorder
+
+    def disable_stats(self):
+        self._recorder = None
+
+    def stats(self) -> Optional[dict]:
+        """
+        :return: A snapshot of the statistics (see ``stats.AccessStats.snapshot``), or ``None`` if they are disabled.
+        """
+        return None if self._recorder is None else self._recorder.snapshot()
+
+    def __getstate__(self):
+        # The statistics stay in the process which recorded them.
+        return {**self.__dict__, "_recorder": None}
+
+    def _get_timed(self, item):
+        recorder = self._recorder
+        start_t = perf_counter_ns()
+        sample = self.data[item]
+        data_t = perf_counter_ns()
+        if recorder.sample_residency() and isinstance(sample, np.ndarray) and sample.nbytes > 0:
+            recorder.record_residency(sample.ctypes.data, sample.nbytes)
+        n_bytes = _nbytes(sample)
+        if self.copy_before_wrapper_fn:
+            sample = copy(sample)
+        sample = self.wrapper_fn(sample)
+        phases = (("data", data_t - start_t), ("wrapper_fn", perf_counter_ns() - data_t))
+        recorder.record("__getitem__", 1, n_bytes, phases)
+        return sample
+
     def __len__(self):
         return len(self.data)
+
+
+# The containers which are alive in this process, so that a forked child can drop the mappings, the open files
+# and the thread pools which it inherited from the parent, and reopen them lazily on first use.
+_open_containers = weakref.WeakSet()
+
+
+def _snapshot_field(func):
+    """
+    A ``cached_property`` for the persisted fields of a container. The first access of any of them opens all of them
+    (with ``container._open_all()``), so that a reader maps a single version of the container, even if it is compacted
+    (i.e. swapped with a new version) between two of its reads.
+    """
+    name = func.__name__
+
+    @wraps(func)
+    def getter(self):
+        self._open_all()
+        if name in self.__dict__:
+            # It was opened by ``_open_all``.
+            return self.__dict__[name]
+        return func(self)
+
+    return cached_property(getter)
+
+
+def _register_for_fork(container) -> None:
+    """
+    Makes ``container._reset_after_fork()`` run in the child after every ``os.fork``.
+    """
+    _open_containers.add(container)
+
+
+def _reset_after_fork() -> None:
+    for container in list(_open_containers):
+        container._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
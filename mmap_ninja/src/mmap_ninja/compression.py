@@ -0,0 +1,345 @@
+"""
+Block-compressed storage of the data of ``RaggedMmap`` and ``StringsMmap`` containers.
+
+The data file is split into blocks of ``block_size`` elements, which are compressed independently and stored one after
+another in ``compressed/blocks.ninja``. The offsets of the blocks are stored in ``compressed/offsets``, so reading
+any range of elements only decompresses the blocks which overlap it. Decompressed blocks are kept in an LRU cache
+with a memory budget. The ``starts``/``ends`` index of the container is not touched.
+
+Use ``compress`` and ``decompress`` to convert a container in place.
+"""
+import bz2
+import lzma
+import mmap
+import os
+import shutil
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Union, Optional, Callable, Dict, Sequence, Tuple
+
+import numpy as np
+
+from mmap_ninja import base, numpy as np_ninja, storage
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSED_DIR = "compressed"
+DEFAULT_BLOCK_NBYTES = 256 * 1024
+DEFAULT_CACHE_NBYTES = 64 * 1024 * 1024
+
+
+def _zlib_compress(data, level):
+    return zlib.compress(data, 6 if level is None else level)
+
+
+def _lzma_compress(data, level):
+    return lzma.compress(data, preset=level)
+
+
+def _bz2_compress(data, level):
+    return bz2.compress(data, 9 if level is None else level)
+
+
+# Maps the name of a codec to its compress function (which takes the data and the level) and decompress function.
+CODECS: Dict[str, Tuple[Callable, Callable]] = {
+    "zlib": (_zlib_compress, zlib.decompress),
+    "lzma": (_lzma_compress, lzma.decompress),
+    "bz2": (_bz2_compress, bz2.decompress),
+}
+
+if lz4_frame is not None:
+    CODECS["lz4"] = (lambda data, level: lz4_frame.compress(data, compression_level=level or 0), lz4_frame.decompress)
+
+if zstandard is not None:
+    CODECS["zstd"] = (
+        lambda data, level: zstandard.ZstdCompressor(level=3 if level is None else level).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+
+
+def _get_codec(codec: str) -> Tuple[Callable, Callable]:
+    try:
+        return CODECS[codec]
+    except KeyError:
+        raise ValueError(f'Unknown codec "{codec}", expected one of: {", ".join(CODECS)}!') from None
+
+
+def is_compressed(out_dir: Union[str, Path]) -> bool:
+    """
+    :param out_dir: The directory of the container.
+    :return: Whether the data of the container is compressed.
+    """
+    return (Path(out_dir) / COMPRESSED_DIR / "codec.ninja").exists()
+
+
+class CompressedArray:
+    """
+    A one-dimensional array, stored compressed in fixed-size blocks, which supports reading ranges of elements
+    (``arr[start:end]``) and appending (``extend``). Slices are numpy arrays, which must not be modified.
+    """
+
+    def __init__(self, out_dir: Union[str, Path], cache_nbytes: int = DEFAULT_CACHE_NBYTES):
+        """
+        :param out_dir: The directory of the container (which contains the ``compressed`` directory).
+        :param cache_nbytes: The maximal number of bytes of decompressed blocks to keep in memory.
+        """
+        self.out_dir = Path(out_dir) / COMPRESSED_DIR
+        self.codec = base._file_to_str(self.out_dir / "codec.ninja")
+        self._compress, self._decompress = _get_codec(self.codec)
+        self.block_size = base._file_to_int(self.out_dir / "block_size.ninja", fmt="<Q")
+        self.dtype = np.dtype(base._file_to_str(self.out_dir / "dtype.ninja"))
+        self.length = base._file_to_shape(self.out_dir / "shape.ninja")[0]
+        self.cache_nbytes = cache_nbytes
+        self.blocks_file = self.out_dir / "blocks.ninja"
+        self._offsets = np.array(np_ninja.open_existing(self.out_dir / "offsets"))
+        self._cache = OrderedDict()
+        self._cached_nbytes = 0
+        self._lock = threading.Lock()
+        self._blocks = None
+        self._map_blocks()
+
+    def _map_blocks(self):
+        if self._blocks is not None:
+            self._blocks.close()
+            self._blocks = None
+        if self._offsets[-1] == 0:
+            return
+        with open(self.blocks_file, "rb") as blocks_file:
+            self._blocks = mmap.mmap(blocks_file.fileno(), int(self._offsets[-1]), access=mmap.ACCESS_READ)
+
+    @property
+    def n_blocks(self) -> int:
+        return len(self._offsets) - 1
+
+    @property
+    def shape(self) -> Tuple[int]:
+        return (self.length,)
+
+    @property
+    def compressed_nbytes(self) -> int:
+        return int(self._offsets[-1])
+
+    @property
+    def nbytes(self) -> int:
+        return self.length * self.dtype.itemsize
+
+    def _block(self, block_idx: int) -> np.ndarray:
+        with self._lock:
+            block = self._cache.get(block_idx)
+            if block is not None:
+                self._cache.move_to_end(block_idx)
+                return block
+        start, end = self._offsets[block_idx : block_idx + 2].tolist()
+        block = np.frombuffer(self._decompress(self._blocks[start:end]), dtype=self.dtype)
+        with self._lock:
+            if block_idx not in self._cache:
+                self._cache[block_idx] = block
+                self._cached_nbytes += block.nbytes
+            while self._cached_nbytes > self.cache_nbytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_nbytes -= evicted.nbytes
+        return block
+
+    def _read(self, start: int, end: int) -> np.ndarray:
+        if start >= end:
+            return np.empty(0, dtype=self.dtype)
+        first_block = start // self.block_size
+        last_block = (end - 1) // self.block_size
+        if first_block == last_block:
+            offset = first_block * self.block_size
+            return self._block(first_block)[start - offset : end - offset]
+        res = np.empty(end - start, dtype=self.dtype)
+        position = 0
+        for block_idx in range(first_block, last_block + 1):
+            offset = block_idx * self.block_size
+            block = self._block(block_idx)[max(start - offset, 0) : end - offset]
+            res[position : position + len(block)] = block
+            position += len(block)
+        return res
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, end, step = item.indices(self.length)
+            if step != 1:
+                raise IndexError("CompressedArray supports only slices with a step of 1!")
+            return self._read(start, end)
+        if not np.isscalar(item):
+            raise IndexError("CompressedArray supports only integers and slices as indices!")
+        idx = int(item)
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError(f"Index {item} is out of range for a CompressedArray of length {self.length}!")
+        return self._read(idx, idx + 1)[0]
+
+    def __setitem__(self, key, value):
+        raise ValueError(f'"{self.out_dir.parent}" is compressed and read-only, decompress it first!')
+
+    def __len__(self):
+        return self.length
+
+    def extend(self, arr: Union[np.ndarray, Sequence[np.ndarray]]) -> None:
+        """
+        Appends new elements. The last block, if it is not full, is decompressed and compressed again.
+
+        :param arr: The new elements, or a list of chunks of new elements, which are compressed one after the other
+            (so they are never joined into a single array).
+        """
+        chunks = [arr] if isinstance(arr, np.ndarray) else list(arr)
+        chunks = [np.ascontiguousarray(chunk, dtype=self.dtype).ravel() for chunk in chunks]
+        n_new = sum(len(chunk) for chunk in chunks)
+        if n_new == 0:
+            return
+        tail = self.length % self.block_size
+        offsets = self._offsets
+        pending = []
+        if tail > 0:
+            pending.append(self._read(self.length - tail, self.length))
+            offsets = offsets[:-1]
+            with self._lock:
+                evicted = self._cache.pop(len(offsets) - 1, None)
+                if evicted is not None:
+                    self._cached_nbytes -= evicted.nbytes
+        new_offsets = [offsets]
+        offset = int(offsets[-1])
+        with open(self.blocks_file, "r+b") as blocks_file:
+            blocks_file.truncate(offset)
+            blocks_file.seek(offset)
+            n_pending = tail
+            for i, chunk in enumerate(chunks):
+                pending.append(chunk)
+                n_pending += len(chunk)
+                last = i == len(chunks) - 1
+                if n_pending < self.block_size and not last:
+                    continue
+                # Only whole blocks are written, the rest is carried over to the next chunk.
+                joined = np.concatenate(pending) if len(pending) > 1 else pending[0]
+                n_written = len(joined) if last else len(joined) // self.block_size * self.block_size
+                ends = _write_blocks(blocks_file, joined[:n_written], self.block_size, self._compress, None, offset)
+                if len(ends) > 0:
+                    offset = int(ends[-1])
+                    new_offsets.append(ends)
+                pending = [joined[n_written:]]
+                n_pending = len(joined) - n_written
+        self._offsets = np.concatenate(new_offsets)
+        self.length += n_new
+        np_ninja.from_ndarray(self.out_dir / "offsets", self._offsets)
+        base._shape_to_file((self.length,), self.out_dir / "shape.ninja")
+        self._map_blocks()
+
+    def close(self) -> None:
+        if self._blocks is not None:
+            self._blocks.close()
+            self._blocks = None
+        self._cache.clear()
+        self._cached_nbytes = 0
+
+    def __repr__(self):
+        base_repr = super().__repr__()
+        return f"{base_repr} of length: {self.length}, codec: {self.codec} and {self.n_blocks} blocks"
+
+
+class CompressedBuffer(CompressedArray):
+    """
+    A ``CompressedArray`` of bytes, which returns slices as ``bytes``, like ``mmap.mmap``.
+    """
+
+    def __getitem__(self, item):
+        res = super().__getitem__(item)
+        return res.tobytes() if isinstance(item, slice) else int(res)
+
+
+def _write_blocks(out_file, arr: np.ndarray, block_size: int, compress: Callable, level, offset: int) -> np.ndarray:
+    """
+    Compresses ``arr`` in blocks of ``block_size`` elements and writes them to ``out_file``.
+
+    :return: The end offsets of the written blocks.
+    """
+    ends = []
+    for start in range(0, len(arr), block_size):
+        compressed = compress(arr[start : start + block_size].tobytes(), level)
+        out_file.write(compressed)
+        offset += len(compressed)
+        ends.append(offset)
+    return np.array(ends, dtype=np.int64)
+
+
+def _read_data(out_dir: Path) -> np.ndarray:
+    if (out_dir / "dtype.ninja").exists():
+        return np_ninja.open_existing(out_dir)
+    # The data of a StringsMmap is a plain file of bytes.
+    if (out_dir / "data.ninja").stat().st_size == 0:
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(out_dir / "data.ninja", mode="r", dtype=np.uint8)
+
+
+def compress(
+    out_dir: Union[str, Path],
+    codec: str = "zlib",
+    block_nbytes: int = DEFAULT_BLOCK_NBYTES,
+    level: Optional[int] = None,
+) -> None:
+    """
+    Compresses the data of a ``RaggedMmap`` or a ``StringsMmap`` in place.
+    The container can still be read as usual, and extended, but its samples cannot be modified in place.
+
+    :param out_dir: The directory of the container.
+    :param codec: One of ``"zlib"``, ``"lzma"``, ``"bz2"``, and ``"lz4"`` or ``"zstd"`` if they are installed.
+    :param block_nbytes: The approximate number of (uncompressed) bytes in a block. Smaller blocks make random
+        access cheaper, larger blocks compress better.
+    :param level: The compression level (the default of the codec if ``None``).
+    """
+    out_dir = Path(out_dir)
+    compress_fn, _ = _get_codec(codec)
+    if is_compressed(out_dir):
+        raise ValueError(f'"{out_dir}" is already compressed!')
+    if (out_dir / storage.PACKED_FILE).exists():
+        raise ValueError(f'"{out_dir}" is packed, unpack it first!')
+    data = _read_data(out_dir)
+    block_size = max(block_nbytes // data.dtype.itemsize, 1)
+    tmp_dir = out_dir / f"{COMPRESSED_DIR}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+    with open(tmp_dir / "blocks.ninja", "wb") as blocks_file:
+        ends = _write_blocks(blocks_file, np.asarray(data).ravel(), block_size, compress_fn, level, 0)
+    np_ninja.from_ndarray(tmp_dir / "offsets", np.concatenate([[0], ends]).astype(np.int64))
+    base._str_to_file(codec, tmp_dir / "codec.ninja")
+    base._int_to_file(block_size, tmp_dir / "block_size.ninja", fmt="<Q")
+    base._str_to_file(data.dtype.str, tmp_dir / "dtype.ninja")
+    base._shape_to_file((len(data),), tmp_dir / "shape.ninja")
+    del data
+    # The compressed directory takes precedence once it exists, so the data file can be removed afterwards.
+    os.replace(tmp_dir, out_dir / COMPRESSED_DIR)
+    (out_dir / "data.ninja").unlink()
+
+
+def decompress(out_dir: Union[str, Path]) -> None:
+    """
+    Converts a container compressed with ``compress`` back to uncompressed storage, in place.
+
+    :param out_dir: The directory of the container.
+    """
+    out_dir = Path(out_dir)
+    if not is_compressed(out_dir):
+        raise ValueError(f'"{out_dir}" is not compressed!')
+    arr = CompressedArray(out_dir, cache_nbytes=0)
+    tmp_file = out_dir / "data.ninja.tmp"
+    with open(tmp_file, "wb") as data_file:
+        for block_idx in range(arr.n_blocks):
+            data_file.write(arr._block(block_idx).data)
+    arr.close()
+    os.replace(tmp_file, out_dir / "data.ninja")
+    if (out_dir / "dtype.ninja").exists():
+        base._shape_to_file((arr.length,), out_dir / "shape.ninja")
+    shutil.rmtree(out_dir / COMPRESSED_DIR)
+
@@ -0,0 +1,200 @@
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Sequence, Union
+
+import numpy as np
+
+from mmap_ninja import base, numpy
+from mmap_ninja.string import StringsMmap
+
+# The codes are processed in chunks of this many rows, so that no temporary array is as long as the container.
+_CHUNK_SIZE = 1 << 22
+# The codes are ``int32``.
+_MAX_DISTINCT = int(np.iinfo(np.int32).max)
+
+
+class DictionaryStringsMmap:
+    """
+    A dictionary-encoded (deduplicated) sequence of strings, for columns with a lot of repetition.
+
+    Every distinct string is stored once, in the inner ``StringsMmap`` ``values`` (which has a hash index),
+    and every row is an ``int32`` code into ``values``, in the numpy memory map ``codes``.
+    The strings are decoded only when they are accessed, ``value_counts``, ``equals`` and ``isin`` work on the codes.
+    """
+
+    def __init__(self, out_dir: Union[str, Path], mode="r+b"):
+        """
+        :param out_dir: The directory of the container.
+        :param mode: The mode with which to open the values (see ``StringsMmap``).
+        """
+        self.out_dir = Path(out_dir)
+        self.mode = mode
+
+    def __getstate__(self):
+        return dict(out_dir=str(self.out_dir), mode=self.mode)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @cached_property
+    def values(self) -> StringsMmap:
+        """
+        The distinct strings, in the order in which they were first seen.
+        """
+        return StringsMmap(self.out_dir / "values", mode=self.mode)
+
+    @cached_property
+    def _codes(self) -> numpy.GrowableMmap:
+        return numpy.GrowableMmap(self.out_dir / "codes", mode="r")
+
+    @property
+    def codes(self) -> np.ndarray:
+        """
+        The code of every row, i.e. the index of its string in ``values``.
+        """
+        return self._codes.array
+
+    def __len__(self):
+        return self._codes.length
+
+    def __getitem__(self, item):
+        if np.isscalar(item):
+            return self.values[int(self.codes[item])]
+        return self.get_multiple(item)
+
+    def get_multiple(self, item):
+        indices = numpy._normalize_indices(item, len(self))
+        if len(indices) == 0:
+            return []
+        # Every distinct string is decoded once, no matter how many times it occurs.
+        codes, inverse = np.unique(self.codes[indices], return_inverse=True)
+        strings = self.values.get_multiple(codes)
+        return [strings[i] for i in inverse.ravel().tolist()]
+
+    def code_of(self, string: str) -> int:
+        """
+        :return: The code of ``string``, or ``-1`` if it does not occur.
+        """
+        return int(self.values.index_of_many([string])[0])
+
+    def value_counts(self) -> np.ndarray:
+        """
+        :return: The number of occurrences of every string in ``values`` (aligned with ``values``).
+        """
+        counts = np.zeros(len(self.values), dtype=np.int64)
+        codes = self.codes
+        for start in range(0, len(codes), _CHUNK_SIZE):
+            counts += np.bincount(codes[start : start + _CHUNK_SIZE], minlength=len(counts))
+        return counts
+
+    def value_counts_dict(self) -> Dict[str, int]:
+        """
+        :return: The number of occurrences of every distinct string (only the strings are decoded, once each).
+        """
+        return dict(zip(self.values[:], self.value_counts().tolist()))
+
+    def equals(self, string: str) -> np.ndarray:
+        """
+        :return: The indices of the rows which are equal to ``string``.
+        """
+        return self.isin([string])
+
+    def isin(self, strings: Sequence[str]) -> np.ndarray:
+        """
+        :return: The indices of the rows which are equal to any of ``strings``.
+        """
+        wanted = self.values.index_of_many(strings)
+        wanted = wanted[wanted >= 0]
+        if len(wanted) == 0:
+            return np.empty(0, dtype=np.int64)
+        codes = self.codes
+        matches = [
+            start + np.flatnonzero(np.isin(codes[start : start + _CHUNK_SIZE], wanted))
+            for start in range(0, len(codes), _CHUNK_SIZE)
+        ]
+        return np.concatenate(matches).astype(np.int64)
+
+    def _encode(self, strings: Sequence[str]) -> np.ndarray:
+        """
+        Returns the codes of ``strings`` and appends the strings which were not seen before to ``values``.
+        The batch is deduplicated with a dictionary, and the distinct strings are looked up in the hash index.
+        """
+        batch_codes: Dict[str, int] = {}
+        inverse = [batch_codes.setdefault(string, len(batch_codes)) for string in strings]
+        distinct = list(batch_codes)
+        codes = self.values.index_of_many(distinct)
+        missing = np.flatnonzero(codes < 0)
+        # Checked before anything is persisted, so that a failed batch leaves the dictionary unchanged.
+        if len(self.values) + len(missing) > _MAX_DISTINCT:
+            raise ValueError(f"A DictionaryStringsMmap supports at most {_MAX_DISTINCT} distinct strings!")
+        if len(missing) > 0:
+            codes[missing] = len(self.values) + np.arange(len(missing))
+            self.values.extend([distinct[i] for i in missing.tolist()])
+        return codes[inverse].astype(np.int32)
+
+    def extend(self, strings: Sequence[str]) -> None:
+        if len(strings) == 0:
+            return
+        self._codes.extend(self._encode(strings))
+
+    def append(self, string: str) -> None:
+        self.extend([string])
+
+    def close(self) -> None:
+        values = self.__dict__.pop("values", None)
+        if values is not None:
+            values.close()
+        codes = self.__dict__.pop("_codes", None)
+        if codes is not None:
+            codes.close(trim=True)
+
+    def __repr__(self):
+        base_repr = super().__repr__()
+        return f"{base_repr} of length: {len(self)}"
+
+    @classmethod
+    def from_strings(
+        cls,
+        out_dir: Union[str, Path],
+        strings: Sequence[str],
+        mode="r+b",
+        batch_size: int = 65536,
+        verbose=False,
+    ) -> "DictionaryStringsMmap":
+        """
+        Creates a ``DictionaryStringsMmap`` in a single streaming pass over ``strings``,
+        ``batch_size`` strings at a time.
+
+        :param out_dir: The output directory.
+        :param strings: A sequence of strings.
+        :param batch_size: The number of strings which are encoded at once.
+        :param verbose: Whether to show a progress bar.
+        :return: The ``DictionaryStringsMmap``.
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(exist_ok=True)
+        StringsMmap.from_strings(out_dir / "values", [], hash_index=True)
+        numpy.GrowableMmap.empty(out_dir / "codes", np.int32).close()
+        base._str_to_file("dictionary", out_dir / "type.ninja")
+        memmap = cls(out_dir, mode=mode)
+        starts = range(0, len(strings), batch_size)
+        if verbose:
+            from tqdm.auto import tqdm
+
+            starts = tqdm(starts)
+        for start in starts:
+            memmap.extend(strings[start : start + batch_size])
+        # Releases the unused capacity of the codes and of the values, which grow geometrically while appending.
+        memmap.close()
+        return memmap
+
+    @classmethod
+    def from_generator(cls, out_dir: Union[str, Path], sample_generator, batch_size: int, verbose=False, **kwargs):
+        return base.from_generator_base(
+            out_dir=out_dir,
+            sample_generator=sample_generator,
+            batch_size=batch_size,
+            verbose=verbose,
+            batch_ctor=cls.from_strings,
+            **kwargs,
+        )
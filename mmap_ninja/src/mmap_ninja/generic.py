@@ -1,5 +1,6 @@
-from mmap_ninja import base, numpy as np_ninja
+from mmap_ninja import base, storage
 from mmap_ninja.base import Wrapped
+from mmap_ninja.dictionary import DictionaryStringsMmap
 from mmap_ninja.string import StringsMmap
 from mmap_ninja.ragged import RaggedMmap
 from pathlib import Path
@@ -7,18 +8,23 @@ from typing import Union, Callable, Optional
 
 
 def open_existing(out_dir: Union[str, Path], wrapper_fn: Optional[Callable] = None, mode="r+b"):
-    out_dir = Path(out_dir)
-    type_str = base._file_to_str(out_dir / "type.ninja")
+    store = storage.open_store(out_dir)
+    type_str = base._bytes_to_str(store.read_bytes("type.ninja"))
     if type_str == "numpy":
-        memmap = np_ninja.open_existing(out_dir)
+        memmap = store.open_array()
         if wrapper_fn is not None:
             return Wrapped(memmap, wrapper_fn)
         return memmap
     if type_str == "ragged":
-        return RaggedMmap(out_dir, wrapper_fn=wrapper_fn)
+        return RaggedMmap(store, wrapper_fn=wrapper_fn)
     if type_str == "string":
-        memmap = StringsMmap(out_dir, mode=mode)
+        memmap = StringsMmap(store, mode=mode)
         if wrapper_fn is not None:
             return Wrapped(memmap, wrapper_fn)
         return memmap
-    raise ValueError(f'Unknown type "{type_str}" while trying to open "{out_dir}" !')
+    if type_str == "dictionary":
+        memmap = DictionaryStringsMmap(store.out_dir, mode=mode)
+        if wrapper_fn is not None:
+            return Wrapped(memmap, wrapper_fn)
+        return memmap
+    raise ValueError(f'Unknown type "{type_str}" while trying to open "{store.out_dir}" !')
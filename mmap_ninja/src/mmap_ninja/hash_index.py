@@ -0,0 +1,278 @@
+import hashlib
+from pathlib import Path
+from typing import Callable, Optional, Sequence, Union
+
+import numpy as np
+
+from mmap_ninja import numpy as np_ninja
+from mmap_ninja.parallel import ParallelBatchCollector, delayed
+
+# The key of the hash index of a ``StringsMmap``, which holds the ``table`` and the ``hashes`` arrays.
+HASH_INDEX_KEY = "hash_index"
+_EMPTY = -1
+# The table is grown (and rebuilt) when more than this fraction of its slots is in use.
+_MAX_LOAD = 0.5
+_MIN_CAPACITY = 16
+
+
+def _hash_bytes(encoded: Sequence[bytes]) -> np.ndarray:
+    """
+    Hashes every (encoded) string into an unsigned 64-bit integer, which does not depend on the process.
+    """
+    digests = b"".join(hashlib.blake2b(string, digest_size=8).digest() for string in encoded)
+    return np.frombuffer(digests, dtype=np.uint64)
+
+
+def _hash_range(strings, start: int, stop: int) -> np.ndarray:
+    """
+    Hashes the strings ``start:stop`` of a ``StringsMmap`` (a job of the parallel build).
+    """
+    starts, ends = strings._ranges(np.arange(start, stop))
+    buffer = strings.buffer
+    return _hash_bytes([buffer[s:e] for s, e in zip(starts.tolist(), ends.tolist())])
+
+
+def _capacity(n: int) -> int:
+    capacity = _MIN_CAPACITY
+    while n > capacity * _MAX_LOAD:
+        capacity *= 2
+    return capacity
+
+
+def _insert(table: np.ndarray, hashes: np.ndarray, indices: np.ndarray) -> None:
+    """
+    Inserts the strings at ``indices`` into the open-addressing (linear probing) table, all of them at once:
+    in every round, every string which is still pending probes one slot.
+
+    Equal strings are all inserted, so that any of them can be removed on its own (see ``_remove``).
+    """
+    mask = len(table) - 1
+    indices = np.asarray(indices, dtype=np.int64)
+    positions = (hashes[indices] & np.uint64(mask)).astype(np.int64)
+    while len(indices) > 0:
+        empty = table[positions] == _EMPTY
+        claimed, first = np.unique(positions[empty], return_index=True)
+        winners = np.flatnonzero(empty)[first]
+        table[claimed] = indices[winners]
+        keep = np.ones(len(indices), dtype=bool)
+        keep[winners] = False
+        # The losers of a race for an empty slot probe it again, and see the winner in the next round.
+        positions = np.where(empty, positions, (positions + 1) & mask)
+        indices, positions = indices[keep], positions[keep]
+
+
+def _remove(table: np.ndarray, hashes: np.ndarray, indices: np.ndarray) -> None:
+    """
+    Removes the strings at ``indices`` from the table with backward-shift deletion: the strings after a freed slot
+    in its run are moved back into it, when it is not before their home slot, so that no delete markers are needed.
+    Only the slots of the run after every removed string are written.
+
+    :param hashes: The hashes with which the strings were inserted.
+    """
+    mask = len(table) - 1
+    for index in np.asarray(indices, dtype=np.int64).tolist():
+        hole = int(hashes[index] & np.uint64(mask))
+        while table[hole] != index:
+            if table[hole] == _EMPTY:
+                break
+            hole = (hole + 1) & mask
+        if table[hole] != index:
+            continue
+        position = (hole + 1) & mask
+        while table[position] != _EMPTY:
+            home = int(hashes[table[position]] & np.uint64(mask))
+            # The string can move back to the hole, unless its home slot is after the hole (cyclically).
+            if (position - home) & mask >= (position - hole) & mask:
+                table[hole] = table[position]
+                hole = position
+            position = (position + 1) & mask
+        table[hole] = _EMPTY
+
+
+def _lookup(
+    table: np.ndarray,
+    hashes: np.ndarray,
+    query_hashes: np.ndarray,
+    queries: Sequence[bytes],
+    get_bytes: Callable[[int], bytes],
+) -> np.ndarray:
+    """
+    Looks up all of the (encoded) ``queries`` at once, with the same probing as ``_insert``. Every query probes
+    until an empty slot, since equal strings may follow each other in any order.
+
+    :return: The lowest index of every query, or ``-1`` if it is not in the table.
+    """
+    mask = len(table) - 1
+    result = np.full(len(queries), _EMPTY, dtype=np.int64)
+    pending = np.arange(len(queries))
+    positions = (query_hashes & np.uint64(mask)).astype(np.int64)
+    while len(pending) > 0:
+        occupants = table[positions]
+        go_on = occupants != _EMPTY
+        candidates = np.flatnonzero(go_on)
+        candidates = candidates[hashes[occupants[candidates]] == query_hashes[pending[candidates]]]
+        # Only the occupants which would improve on the match found so far have to be compared.
+        found = result[pending[candidates]]
+        candidates = candidates[(found == _EMPTY) | (occupants[candidates] < found)]
+        for i in candidates.tolist():
+            if get_bytes(int(occupants[i])) == queries[pending[i]]:
+                result[pending[i]] = occupants[i]
+        pending, positions = pending[go_on], (positions[go_on] + 1) & mask
+    return result
+
+
+def _build_table(hashes: np.ndarray, live: Optional[np.ndarray]) -> np.ndarray:
+    """
+    Builds a table which holds the strings at ``live`` (all of them if ``None``).
+    """
+    indices = np.arange(len(hashes)) if live is None else live
+    table = np.full(_capacity(len(indices)), _EMPTY, dtype=np.int64)
+    _insert(table, hashes, indices)
+    return table
+
+
+class HashIndex:
+    """
+    A persisted hash index over the encoded strings of a ``StringsMmap``, which finds the index of a string
+    in O(1) expected time.
+
+    It consists of the 64-bit hash of every string (``hashes``) and of an open-addressing table with linear probing
+    (``table``), whose slots hold the index of a string or ``-1``. The table is at most half full.
+    """
+
+    def __init__(self, table: np.ndarray, hashes: np.ndarray, out_dir: Optional[Path] = None):
+        """
+        :param table: The slots of the table.
+        :param hashes: The hash of every string.
+        :param out_dir: The directory of the index (``None`` if it is read-only, e.g. packed).
+        """
+        self.table = table
+        self.hashes = hashes
+        self.out_dir = out_dir
+        self._hashes_growable = None
+
+    @classmethod
+    def open(cls, store) -> Optional["HashIndex"]:
+        """
+        Opens the hash index of a container, or returns ``None`` if it does not have one.
+        """
+        if not store.exists(f"{HASH_INDEX_KEY}/table/dtype.ninja"):
+            return None
+        table = store.open_array(f"{HASH_INDEX_KEY}/table")
+        hashes = store.open_array(f"{HASH_INDEX_KEY}/hashes")
+        return cls(table, hashes, out_dir=None if store.packed else store.out_dir / HASH_INDEX_KEY)
+
+    @classmethod
+    def build(cls, out_dir: Union[str, Path], strings, n_jobs=None, batch_size: int = 65536) -> "HashIndex":
+        """
+        Builds the hash index of a ``StringsMmap``. The strings are hashed in parallel batches.
+
+        :param out_dir: The directory of the index.
+        :param strings: The ``StringsMmap``.
+        :param n_jobs: The number of jobs which hash the strings. ``None`` means no parallelization.
+        :param batch_size: The number of strings which are hashed by one job.
+        :return: The ``HashIndex``.
+        """
+        out_dir = Path(out_dir)
+        # Every string is hashed, including the deleted ones (which are left out of the table),
+        # since the table holds physical indices.
+        n = 0 if strings.starts is None else len(strings.starts)
+        jobs = [(strings, start, min(start + batch_size, n)) for start in range(0, n, batch_size)]
+        parallel = ParallelBatchCollector.begin(n_jobs)
+        try:
+            if parallel is None:
+                batches = [_hash_range(*job) for job in jobs]
+            else:
+                batches = parallel(delayed(_hash_range)(*job) for job in jobs)
+        finally:
+            if parallel is not None:
+                parallel.__exit__(None, None, None)
+        hashes = np.concatenate(batches) if batches else np.empty(0, dtype=np.uint64)
+        table = _build_table(hashes, strings._live)
+        np_ninja.from_ndarray(out_dir / "hashes", hashes)
+        np_ninja.from_ndarray(out_dir / "table", table)
+        return cls(np_ninja.open_existing(out_dir / "table"), np_ninja.open_existing(out_dir / "hashes"), out_dir)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def lookup(self, queries: Sequence[bytes], get_bytes: Callable[[int], bytes]) -> np.ndarray:
+        """
+        :param queries: The encoded strings to look up.
+        :param get_bytes: Returns the encoded string at an index.
+        :return: The index of the first occurrence of every query, or ``-1`` if it is not in the index.
+        """
+        return _lookup(self.table, self.hashes, _hash_bytes(queries), queries, get_bytes)
+
+    def _writable_table(self) -> np.ndarray:
+        if self.out_dir is None:
+            raise ValueError("The hash index is read-only!")
+        if not self.table.flags.writeable:
+            self.table = np_ninja.open_existing(self.out_dir / "table", mode="r+")
+        return self.table
+
+    def insert(self, encoded: Sequence[bytes], live: Optional[np.ndarray] = None) -> None:
+        """
+        Adds strings, which were appended to the container, to the index.
+        The table is updated in place, unless it has to grow.
+
+        :param encoded: The new encoded strings.
+        :param live: The indices of the strings which are not deleted, including the new ones
+            (``None`` if no string is deleted).
+        """
+        table = self._writable_table()
+        if self._hashes_growable is None:
+            self._hashes_growable = np_ninja.GrowableMmap(self.out_dir / "hashes")
+        n_old = len(self.hashes)
+        self._hashes_growable.extend(_hash_bytes(encoded))
+        self.hashes = self._hashes_growable.array
+        if len(self.hashes) > len(table) * _MAX_LOAD:
+            self.rebuild_table(live)
+            return
+        _insert(table, self.hashes, np.arange(n_old, len(self.hashes)))
+        table.flush()
+
+    def update(self, indices: np.ndarray, encoded: Sequence[bytes]) -> None:
+        """
+        Replaces strings which were updated: their old values are removed from the table, their new hashes
+        are written and they are inserted again. Only the slots around them are written.
+
+        :param indices: The indices of the updated strings (not deleted, without repetitions).
+        :param encoded: Their new encoded values.
+        """
+        table = self._writable_table()
+        _remove(table, self.hashes, indices)
+        self.close()
+        self.hashes = None
+        np_ninja._write_rows(self.out_dir / "hashes", indices, _hash_bytes(encoded))
+        self.hashes = np_ninja.open_existing(self.out_dir / "hashes")
+        _insert(table, self.hashes, indices)
+        table.flush()
+
+    def remove(self, indices: np.ndarray) -> None:
+        """
+        Removes strings, which were deleted, from the table. Only the slots around them are written.
+
+        :param indices: The indices of the deleted strings.
+        """
+        table = self._writable_table()
+        _remove(table, self.hashes, indices)
+        table.flush()
+
+    def rebuild_table(self, live: Optional[np.ndarray] = None) -> None:
+        """
+        Rebuilds the table from the stored hashes (e.g. when it grows), without rehashing the strings.
+
+        :param live: The indices of the strings which are not deleted (``None`` if no string is deleted).
+        """
+        if self.out_dir is None:
+            raise ValueError("The hash index is read-only!")
+        table = _build_table(self.hashes, live)
+        self.table = None
+        np_ninja.from_ndarray(self.out_dir / "table", table)
+        self.table = np_ninja.open_existing(self.out_dir / "table")
+
+    def close(self) -> None:
+        if self._hashes_growable is not None:
+            self._hashes_growable.close(trim=True)
+            self._hashes_growable = None
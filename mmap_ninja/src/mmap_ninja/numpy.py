@@ -1,10 +1,12 @@
+import itertools
+import mmap
+import os
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Union, List, Tuple, Sequence, Optional, Dict
 
 # See: https://numpy.org/doc/stable/reference/generated/numpy.memmap.html
 import numpy as np
-from mmap_ninja.base import from_generator_base
 
 from mmap_ninja import base
 
@@ -95,20 +97,47 @@ def from_generator(out_dir: Union[str, Path], sample_generator, batch_size: int,
     """
     Create a numpy memory-map from a sample generator.
 
+    The samples are streamed straight to the data file with vectored writes, so memory usage does not depend
+    on ``batch_size``. The dtype and the shape of the memory map are the ones of the first sample, and the later
+    samples are cast to that dtype, unless the cast would change the kind of their values (e.g. float to int),
+    which raises a ``ValueError``.
+
     :param sample_generator: A generator of the samples
     :param out_dir: The output directory
-    :param batch_size: How often to flush to disk
+    :param batch_size: How often to flush the shape of the memory map to disk
     :param verbose: Whether to show the progress bar.
     :return:
     """
-    return from_generator_base(
-        out_dir=out_dir,
-        sample_generator=sample_generator,
-        batch_size=batch_size,
-        batch_ctor=from_ndarray,
-        extend_fn=extend,
-        verbose=verbose,
-    )
+    out_dir = _create_if_not_exists(out_dir)
+    if verbose:
+        from tqdm.auto import tqdm
+
+        sample_generator = tqdm(sample_generator)
+    samples = iter(sample_generator)
+    first = next(samples, None)
+    if first is None:
+        return None
+    first = np.asarray(first)
+    dtype = first.dtype
+    sample_shape = first.shape
+    _save_mmap_kwargs(out_dir, dtype, (0, *sample_shape), "C")
+    length = 0
+    with _VectoredWriter(out_dir / "data.ninja", truncate=True) as writer:
+        for sample in itertools.chain([first], samples):
+            sample = np.asarray(sample)
+            if sample.dtype != dtype and not np.can_cast(sample.dtype, dtype, casting="same_kind"):
+                raise ValueError(f"Cannot cast a sample of dtype {sample.dtype} to {dtype} of the first sample!")
+            sample = sample.astype(dtype, copy=False)
+            assert sample.shape == sample_shape, (
+                f"Trying to append samples with incorrect shape: {sample.shape}, expected: {sample_shape}"
+            )
+            writer.write(sample)
+            length += 1
+            if length % batch_size == 0:
+                writer.flush()
+                base._shape_to_file((length, *sample_shape), out_dir / "shape.ninja")
+    base._shape_to_file((length, *sample_shape), out_dir / "shape.ninja")
+    return open_existing(out_dir)
 
 
 def open_existing(out_dir: Union[str, Path], mode="r") -> np.memmap:
@@ -120,11 +149,48 @@ def open_existing(out_dir: Union[str, Path], mode="r") -> np.memmap:
     :return: The ``np.memmap`` object.
     """
     out_dir = Path(out_dir)
-    kwargs = _read_mmap_kwargs(out_dir)
-    memmap = np.memmap(str(out_dir / "data.ninja"), mode=mode, **kwargs)
+    try:
+        kwargs = _read_mmap_kwargs(out_dir)
+    except FileNotFoundError:
+        from mmap_ninja.storage import PackedStore
+
+        packed_store = PackedStore.open(out_dir)
+        if packed_store is None:
+            raise
+        memmap = packed_store.open_array(mode=mode)
+    else:
+        memmap = np.memmap(str(out_dir / "data.ninja"), mode=mode, **kwargs)
+    return _reopenable(memmap, open_existing, str(out_dir), mode=mode)
+
+
+def _reopenable(memmap: np.memmap, reopen_fn, *args, mode: str) -> np.memmap:
+    """
+    Makes ``memmap`` pickle as ``reopen_fn(*args, mode)`` instead of its contents.
+    """
+    memmap = memmap.view(_ReopenableMemmap)
+    # Reopening with "w+" would truncate the file, so the unpickled copy maps it with "r+".
+    memmap._reopen = (reopen_fn, (*args, "r+" if mode == "w+" else mode))
     return memmap
 
 
+class _ReopenableMemmap(np.memmap):
+    """
+    The ``np.memmap`` returned by ``open_existing`` (and by the stores), which pickles as the function
+    and the arguments which reopen it, instead of its contents. Views into it pickle as regular arrays.
+    """
+
+    _reopen = None
+
+    def __array_finalize__(self, obj):
+        super().__array_finalize__(obj)
+        self._reopen = None
+
+    def __reduce__(self):
+        if self._reopen is None:
+            return super().__reduce__()
+        return self._reopen
+
+
 def extend_dir(out_dir: Union[str, Path], arr: np.ndarray) -> None:
     """
     Extend an already existing memory map by adding new samples
@@ -142,7 +208,9 @@ def extend_dir(out_dir: Union[str, Path], arr: np.ndarray) -> None:
     assert shape[1:] == arr.shape[1:], (
         f"Trying to append samples with incorrect shape: {arr.shape[1:]}, " f"expected: {shape[1:]}"
     )
-    with open(out_dir / "data.ninja", "ab") as data_file:
+    # The data file may be larger than the logical shape (see ``GrowableMmap``), so write right after the last sample.
+    with open(out_dir / "data.ninja", "r+b") as data_file:
+        data_file.seek(shape[0] * _sample_nbytes(dtype, shape[1:]))
         data_file.write(arr.astype(dtype).tobytes(order=order))
         data_file.flush()
     new_shape = (shape[0] + arr.shape[0], *shape[1:])
@@ -170,6 +238,249 @@ def append(np_mmap: np.memmap, arr: np.ndarray) -> None:
     extend(np_mmap, np.expand_dims(np.asarray(arr), axis=0))
 
 
+def _sample_nbytes(dtype: Union[str, np.dtype], sample_shape: Sequence[int]) -> int:
+    """
+    Returns the number of bytes occupied by a single sample (i.e. a row along the first axis).
+    """
+    return int(np.dtype(dtype).itemsize * np.prod(sample_shape, dtype=np.int64))
+
+
+# Upper bounds for the number of bytes and buffers which ``_VectoredWriter`` holds before writing them.
+_WRITE_CHUNK = 4 * 1024 * 1024
+_IOV_MAX = min(os.sysconf("SC_IOV_MAX"), 1024) if hasattr(os, "sysconf") and "SC_IOV_MAX" in os.sysconf_names else 1024
+
+
+class _VectoredWriter:
+    """
+    Appends the bytes of many small arrays to a file, without concatenating them first.
+
+    The arrays are collected (as views, not copies) until ``_WRITE_CHUNK`` bytes or ``_IOV_MAX`` arrays
+    are pending, and then they are written with a single ``os.pwritev`` call (where available).
+    """
+
+    def __init__(self, path: Union[str, Path], offset: int = 0, truncate: bool = False):
+        """
+        :param path: The file to write to. It is created if it does not exist.
+        :param offset: The position at which to start writing.
+        :param truncate: Whether to discard the current contents of the file.
+        """
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0) | (os.O_TRUNC if truncate else 0)
+        self.fd = os.open(path, flags)
+        self.offset = offset
+        self._pending = []
+        self._pending_nbytes = 0
+
+    def write(self, arr: np.ndarray) -> None:
+        buffer = memoryview(np.ascontiguousarray(arr)).cast("B")
+        if len(buffer) == 0:
+            return
+        self._pending.append(buffer)
+        self._pending_nbytes += len(buffer)
+        if self._pending_nbytes >= _WRITE_CHUNK or len(self._pending) >= _IOV_MAX:
+            self.flush()
+
+    def flush(self) -> None:
+        buffers = self._pending
+        while buffers:
+            if hasattr(os, "pwritev"):
+                written = os.pwritev(self.fd, buffers, self.offset)
+            else:
+                os.lseek(self.fd, self.offset, os.SEEK_SET)
+                written = os.write(self.fd, buffers[0])
+            self.offset += written
+            # Drop the buffers which were written completely and keep the rest of a partially written one.
+            while buffers and written >= len(buffers[0]):
+                written -= len(buffers[0])
+                buffers = buffers[1:]
+            if written > 0:
+                buffers[0] = buffers[0][written:]
+        self._pending = []
+        self._pending_nbytes = 0
+
+    def close(self) -> None:
+        self.flush()
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class GrowableMmap:
+    """
+    A numpy memory map, which supports appending samples in amortized O(1).
+
+    The capacity of the data file grows geometrically, while the logical number of samples is tracked separately
+    (and persisted in ``shape.ninja``, so that ``open_existing`` sees only the valid samples).
+    The file is remapped only when the capacity is exceeded, so the object stays valid across appends.
+    """
+
+    def __init__(self, out_dir: Union[str, Path], mode="r+", growth_factor: float = 2.0, min_capacity: int = 1024):
+        """
+        Opens an already existing numpy memory map for appending.
+
+        :param out_dir: The directory, in which the memory-mapped array is stored.
+        :param mode: The mode with which to map the data file (``"r"`` or ``"r+"``). Appends go through the file,
+            so they work with a read-only mapping, too.
+        :param growth_factor: The factor by which the capacity is multiplied whenever it is exceeded.
+        :param min_capacity: The minimal number of samples to allocate when growing.
+        """
+        self.out_dir = Path(out_dir)
+        self.mode = mode
+        self.growth_factor = growth_factor
+        self.min_capacity = min_capacity
+        kwargs = _read_mmap_kwargs(self.out_dir)
+        self.dtype = np.dtype(kwargs["dtype"])
+        self.order = kwargs["order"]
+        shape = kwargs["shape"]
+        if self.order == "F" and len(shape) > 1:
+            raise ValueError(f"Cannot grow a Fortran-ordered array with shape {shape} along its first axis!")
+        self.sample_shape = tuple(shape[1:])
+        self.length = shape[0]
+        self.data_file = self.out_dir / "data.ninja"
+        self.sample_nbytes = _sample_nbytes(self.dtype, self.sample_shape)
+        file_nbytes = self.data_file.stat().st_size
+        self.capacity = file_nbytes // self.sample_nbytes if self.sample_nbytes > 0 else self.length
+        self._file = None
+        self._shape_file = None
+        self._mapped = None
+        self.advice = None
+        self._remap()
+
+    @classmethod
+    def empty(
+        cls, out_dir: Union[str, Path], dtype: Union[str, np.dtype], sample_shape: Sequence[int] = (), **kwargs
+    ) -> "GrowableMmap":
+        """
+        Creates a new memory map without any samples.
+
+        :param out_dir: The directory in which the memory map will be persisted.
+        :param dtype: The dtype of the samples.
+        :param sample_shape: The shape of a single sample.
+        :param kwargs: Additional keyword arguments passed to the constructor.
+        :return: The ``GrowableMmap``.
+        """
+        out_dir = _create_if_not_exists(out_dir)
+        _save_mmap_kwargs(out_dir, dtype, (0, *sample_shape), "C")
+        open(out_dir / "data.ninja", "wb").close()
+        return cls(out_dir, **kwargs)
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        The valid samples, as a view into the current mapping.
+        """
+        if self._mapped is None:
+            return np.empty((0, *self.sample_shape), dtype=self.dtype)
+        return self._mapped[: self.length]
+
+    def _remap(self):
+        if self.capacity == 0:
+            self._mapped = None
+            return
+        self._mapped = np.memmap(
+            str(self.data_file),
+            mode=self.mode,
+            dtype=self.dtype,
+            shape=(self.capacity, *self.sample_shape),
+            order=self.order,
+        )
+        if self.advice is not None:
+            advise(self._mapped, self.advice)
+
+    def advise(self, pattern: str) -> None:
+        """
+        Tells the kernel how the samples will be accessed (see ``advise``). The advice is reapplied after remapping.
+
+        :param pattern: The access pattern.
+        """
+        _madvise_flag(pattern)
+        self.advice = pattern
+        if self._mapped is not None:
+            advise(self._mapped, pattern)
+
+    def _open_files(self):
+        if self._file is None:
+            self._file = open(self.data_file, "r+b")
+            self._shape_file = open(self.out_dir / "shape.ninja", "r+b")
+
+    def reserve(self, capacity: int) -> None:
+        """
+        Makes sure that the data file can hold at least ``capacity`` samples, growing it geometrically if needed.
+
+        :param capacity: The required number of samples.
+        """
+        if capacity <= self.capacity:
+            return
+        self._open_files()
+        new_capacity = max(capacity, int(self.capacity * self.growth_factor), self.min_capacity)
+        self._file.truncate(new_capacity * self.sample_nbytes)
+        self.capacity = new_capacity
+        self._remap()
+
+    def extend(self, arr: np.ndarray) -> None:
+        """
+        Appends new samples.
+
+        :param arr: The numpy array of new samples.
+        """
+        arr = np.asarray(arr)
+        assert self.sample_shape == arr.shape[1:], (
+            f"Trying to append samples with incorrect shape: {arr.shape[1:]}, " f"expected: {self.sample_shape}"
+        )
+        if len(arr) == 0:
+            return
+        self.reserve(self.length + len(arr))
+        self._open_files()
+        self._file.seek(self.length * self.sample_nbytes)
+        self._file.write(np.ascontiguousarray(arr, dtype=self.dtype).data)
+        self._file.flush()
+        self.length += len(arr)
+        self._shape_file.seek(0)
+        self._shape_file.write(base._shape_to_bytes((self.length, *self.sample_shape)))
+        self._shape_file.flush()
+
+    def append(self, sample: np.ndarray) -> None:
+        """
+        Appends a single sample.
+
+        :param sample: The new sample.
+        """
+        self.extend(np.expand_dims(np.asarray(sample), axis=0))
+
+    def close(self, trim: bool = False) -> None:
+        """
+        Closes the underlying files.
+
+        :param trim: Whether to release the unused capacity of the data file.
+        """
+        self._mapped = None
+        if trim and self.capacity > self.length:
+            with open(self.data_file, "r+b") as data_file:
+                data_file.truncate(self.length * self.sample_nbytes)
+            self.capacity = self.length
+        if self._file is not None:
+            self._file.close()
+            self._shape_file.close()
+            self._file = None
+            self._shape_file = None
+
+    def __getitem__(self, item):
+        return self.array[item]
+
+    def __setitem__(self, key, value):
+        self.array[key] = value
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        base_repr = super().__repr__()
+        return f"{base_repr} of length: {self.length} and capacity: {self.capacity}"
+
+
 @dataclass
 class NumpyBytesSlices:
     buffer: np.ndarray
@@ -208,3 +519,189 @@ def _lists_of_ndarrays_to_bytes(lists: Sequence[np.ndarray], dtype) -> NumpyByte
         offset += len(flattened)
     buffer = np.concatenate(arrs)
     return NumpyBytesSlices(buffer, starts, ends, flattened_shapes, shapes)
+
+
+def _write_rows(out_dir: Union[str, Path], indices: np.ndarray, values: np.ndarray) -> None:
+    """
+    Overwrites some rows of a persisted array through a temporary writable mapping. The other mappings
+    of the same file (which may be read-only) see the new values, since all of them are shared.
+
+    :param out_dir: The directory of the array.
+    :param indices: The indices of the rows.
+    :param values: The new rows.
+    """
+    if len(indices) == 0:
+        return
+    arr = open_existing(out_dir, mode="r+")
+    arr[indices] = values
+    arr.flush()
+
+
+def _normalize_indices(item, length: int) -> np.ndarray:
+    """
+    Converts a slice, a boolean mask or a sequence of (possibly negative) integers into non-negative indices,
+    without materializing an ``np.arange(length)``.
+
+    :param item: The slice, mask or integer indices.
+    :param length: The number of samples.
+    :return: The indices as an ``int64`` array.
+    """
+    if isinstance(item, slice):
+        return np.arange(*item.indices(length), dtype=np.int64)
+    indices = np.asarray(item)
+    if indices.dtype == bool:
+        if indices.shape != (length,):
+            raise IndexError(f"Boolean index of shape {indices.shape} does not match {length} samples!")
+        return np.flatnonzero(indices)
+    if indices.size == 0:
+        return indices.astype(np.int64)
+    if indices.dtype.kind not in "iu":
+        raise IndexError(f"Only integers, slices and boolean masks are valid indices, got {indices.dtype}!")
+    indices = indices.astype(np.int64)
+    if indices.min() < -length or indices.max() >= length:
+        raise IndexError(f"Index out of range for {length} samples!")
+    indices[indices < 0] += length
+    return indices
+
+
+def _merge_ranges(
+    starts: np.ndarray, ends: np.ndarray, max_gap: int = 0
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sorts ``[start, end)`` ranges and merges the ones which overlap, touch or are at most ``max_gap`` apart into runs.
+
+    :param starts: The (inclusive) start of every range.
+    :param ends: The (exclusive) end of every range.
+    :param max_gap: The largest gap between two ranges which still merges them.
+    :return: The order which sorts the ranges by their start, the run of every sorted range,
+        and the starts and the ends of the runs.
+    """
+    order = np.argsort(starts, kind="stable")
+    sorted_starts = starts[order]
+    sorted_ends = ends[order]
+    reach = np.maximum.accumulate(sorted_ends)
+    is_run_start = np.empty(len(starts), dtype=bool)
+    is_run_start[0] = True
+    is_run_start[1:] = sorted_starts[1:] > reach[:-1] + max_gap
+    run_ids = np.cumsum(is_run_start) - 1
+    run_starts = sorted_starts[is_run_start]
+    run_ends = np.maximum.reduceat(sorted_ends, np.flatnonzero(is_run_start))
+    return order, run_ids, run_starts, run_ends
+
+
+def _gather_ranges(arr: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Copies the ranges ``arr[starts[i]:ends[i]]`` into one preallocated buffer.
+    Ranges which are adjacent or overlapping are merged, so that every run is read from ``arr`` exactly once.
+
+    :param arr: The one-dimensional array (usually a ``np.memmap``) to gather from.
+    :param starts: The (inclusive) start of every range.
+    :param ends: The (exclusive) end of every range.
+    :return: The buffer and the position at which every range begins inside of it.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        return np.empty(0, dtype=arr.dtype), np.empty(0, dtype=np.int64)
+    order, run_ids, run_starts, run_ends = _merge_ranges(starts, ends)
+    run_lengths = run_ends - run_starts
+    run_offsets = np.zeros(len(run_starts), dtype=np.int64)
+    np.cumsum(run_lengths[:-1], out=run_offsets[1:])
+
+    # Indexing a plain ndarray is faster than indexing a ``np.memmap``, other array-likes are sliced as they are.
+    source = np.asarray(arr) if isinstance(arr, np.ndarray) else arr
+    buffer = np.empty(int(run_lengths.sum()), dtype=arr.dtype)
+    for run_start, run_end, run_offset in zip(run_starts.tolist(), run_ends.tolist(), run_offsets.tolist()):
+        buffer[run_offset : run_offset + run_end - run_start] = source[run_start:run_end]
+
+    positions = np.empty(len(starts), dtype=np.int64)
+    positions[order] = run_offsets[run_ids] + starts[order] - run_starts[run_ids]
+    return buffer, positions
+
+
+# Maps the names accepted by ``advise`` to the names of the ``madvise`` constants in the ``mmap`` module.
+ACCESS_PATTERNS = {
+    "normal": "MADV_NORMAL",
+    "sequential": "MADV_SEQUENTIAL",
+    "random": "MADV_RANDOM",
+    "willneed": "MADV_WILLNEED",
+    "dontneed": "MADV_DONTNEED",
+    "hugepage": "MADV_HUGEPAGE",
+}
+
+
+def _madvise_flag(pattern: str) -> Optional[int]:
+    """
+    Returns the ``madvise`` flag for an access pattern, or ``None`` if the platform does not support it.
+    """
+    if pattern not in ACCESS_PATTERNS:
+        raise ValueError(f'Unknown access pattern "{pattern}", expected one of: {", ".join(ACCESS_PATTERNS)}!')
+    if not hasattr(mmap.mmap, "madvise"):
+        return None
+    return getattr(mmap, ACCESS_PATTERNS[pattern], None)
+
+
+def _madvise_ranges(mm: mmap.mmap, starts: np.ndarray, ends: np.ndarray, flag: int) -> None:
+    """
+    Calls ``madvise`` once for every run of merged byte ranges (relative to the start of ``mm``).
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    non_empty = ends > starts
+    starts = starts[non_empty] // mmap.PAGESIZE * mmap.PAGESIZE
+    ends = ends[non_empty]
+    if len(starts) == 0:
+        return
+    _, _, run_starts, run_ends = _merge_ranges(starts, ends)
+    for run_start, run_end in zip(run_starts.tolist(), run_ends.tolist()):
+        mm.madvise(flag, run_start, run_end - run_start)
+
+
+def _mmap_position(arr: np.ndarray) -> Tuple[Optional[mmap.mmap], int]:
+    """
+    Returns the ``mmap.mmap`` which backs a ``np.memmap`` (or a view of it) and the offset of the array inside of it.
+    """
+    mm = getattr(arr, "_mmap", None)
+    if mm is None or mm.closed:
+        return None, 0
+    mm_address = np.frombuffer(mm, dtype=np.uint8).ctypes.data
+    return mm, arr.ctypes.data - mm_address
+
+
+def advise(np_mmap: Union[np.memmap, mmap.mmap], pattern: str) -> None:
+    """
+    Tells the kernel how a numpy memory map will be accessed, using ``madvise``.
+    Does nothing if the platform does not support the pattern (e.g. ``"hugepage"`` outside of Linux).
+
+    :param np_mmap: The numpy memory map object (a plain ``mmap.mmap`` works, too).
+    :param pattern: One of ``"normal"``, ``"sequential"``, ``"random"``, ``"willneed"``, ``"dontneed"``
+        or ``"hugepage"``.
+    """
+    flag = _madvise_flag(pattern)
+    mm = np_mmap if isinstance(np_mmap, mmap.mmap) else getattr(np_mmap, "_mmap", None)
+    if flag is None or mm is None or mm.closed:
+        return
+    mm.madvise(flag)
+
+
+def _willneed_bytes(arr: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> None:
+    """
+    Asks the kernel to prefetch byte ranges of a numpy memory map (relative to the start of ``arr``).
+    """
+    flag = _madvise_flag("willneed")
+    mm, position = _mmap_position(arr)
+    if flag is None or mm is None:
+        return
+    _madvise_ranges(mm, position + np.asarray(starts), position + np.asarray(ends), flag)
+
+
+def willneed(np_mmap: np.memmap, indices) -> None:
+    """
+    Asks the kernel to prefetch the samples of a numpy memory map, which will be accessed soon.
+
+    :param np_mmap: The numpy memory map object.
+    :param indices: The indices (along the first axis) of the samples.
+    """
+    indices = _normalize_indices(indices, len(np_mmap))
+    sample_nbytes = _sample_nbytes(np_mmap.dtype, np_mmap.shape[1:])
+    _willneed_bytes(np_mmap, indices * sample_nbytes, (indices + 1) * sample_nbytes)
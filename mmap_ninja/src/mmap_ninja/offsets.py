@@ -0,0 +1,330 @@
+import shutil
+from pathlib import Path
+from typing import Tuple, Optional, Union
+
+import numpy as np
+
+from mmap_ninja import base
+from mmap_ninja import numpy as np_ninja
+
+
+class InMemoryOffsets:
+    """
+    The ``starts``/``ends`` index of a ragged container, loaded once into RAM as a single contiguous offsets array
+    of ``n + 1`` elements, where sample ``i`` spans ``offsets[i]:offsets[i + 1]``.
+
+    Scalar lookups go through ``memoryview`` objects, which return plain Python ints and are several times faster
+    than indexing an ``np.memmap``. Vectorized lookups index the offsets array directly.
+
+    Once length-changing updates have moved samples (see ``_plan_updates``), the samples are no longer contiguous,
+    and the starts and the ends are kept as two separate arrays instead (``offsets`` is ``None`` then).
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray):
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if np.array_equal(starts[1:], ends[:-1]):
+            offsets = np.empty(len(starts) + 1, dtype=np.int64)
+            offsets[:-1] = starts
+            offsets[-1] = ends[-1] if len(ends) > 0 else 0
+            self.offsets = offsets
+            self._starts, self._ends = offsets[:-1], offsets[1:]
+        else:
+            self.offsets = None
+            self._starts, self._ends = np.array(starts), np.array(ends)
+        self.starts = memoryview(self._starts)
+        self.ends = memoryview(self._ends)
+
+    def lookup(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized lookup of the starts and ends of many samples.
+
+        :param indices: Non-negative sample indices.
+        :return: The starts and the ends of the samples.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.offsets is None:
+            return self._starts[indices], self._ends[indices]
+        return self.offsets[indices], self.offsets[indices + 1]
+
+    @property
+    def nbytes(self) -> int:
+        if self.offsets is None:
+            return self._starts.nbytes + self._ends.nbytes
+        return self.offsets.nbytes
+
+    def __len__(self):
+        return len(self._starts)
+
+
+# The number of bytes of the data, which no longer belong to any sample after length-changing updates.
+DEAD_NBYTES_FILE = "dead_nbytes.ninja"
+
+
+def read_dead_nbytes(store) -> int:
+    """
+    :param store: The store of the container.
+    :return: The number of bytes of its data which are no longer used by any sample.
+    """
+    if not store.exists(DEAD_NBYTES_FILE):
+        return 0
+    return base._bytes_to_int(store.read_bytes(DEAD_NBYTES_FILE), fmt="<q")
+
+
+def _add_dead_nbytes(store, nbytes: int) -> None:
+    if nbytes != 0:
+        base._int_to_file(read_dead_nbytes(store) + nbytes, store.out_dir / DEAD_NBYTES_FILE, fmt="<q")
+
+
+def _plan_updates(
+    starts: np.ndarray, ends: np.ndarray, lengths: np.ndarray, tail: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Decides where the new values of updated samples go: a value which fits into the slot of the old one
+    is written in place (and the end of the sample moves), any other value is appended after ``tail``.
+
+    :param starts: The current starts of the updated samples.
+    :param ends: The current ends of the updated samples.
+    :param lengths: The lengths of the new values.
+    :param tail: The end of the data, where the values which do not fit are appended.
+    :return: The new starts and ends, a mask of the appended values and the number of bytes (or elements)
+        which no longer belong to any sample.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    old_lengths = np.asarray(ends, dtype=np.int64) - starts
+    lengths = np.asarray(lengths, dtype=np.int64)
+    moved = lengths > old_lengths
+    appended = np.where(moved, lengths, 0)
+    new_starts = np.where(moved, tail + np.cumsum(appended) - appended, starts)
+    dead = int(np.where(moved, old_lengths, old_lengths - lengths).sum())
+    return new_starts, new_starts + lengths, moved, dead
+
+
+def _last_occurrences(indices: np.ndarray) -> np.ndarray:
+    """
+    :return: The positions of the last occurrence of every distinct index (a later update of a sample wins).
+    """
+    _, first_from_end = np.unique(np.asarray(indices)[::-1], return_index=True)
+    return np.sort(len(indices) - 1 - first_from_end)
+
+
+# The key of the single offsets array of containers created with ``compact_index=True``.
+OFFSETS_KEY = "offsets"
+# The block-delta encoding stores one base offset for every block of 2 ** _BLOCK_SHIFT offsets.
+_BLOCK_SHIFT = 16
+_UINT32_LIMIT = 2**32
+
+
+def _block_deltas(
+    values: np.ndarray, first_index: int, bases: np.ndarray
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Encodes the offsets ``values``, which start at index ``first_index``, as ``uint32`` deltas to the base offset
+    of their block. At most the last of the existing ``bases`` is read, since all previous blocks are full.
+
+    :param bases: The bases of the existing blocks.
+    :return: The deltas and the bases of the new blocks, or ``None`` if some delta does not fit into ``uint32``.
+    """
+    indices = first_index + np.arange(len(values), dtype=np.int64)
+    first_block = first_index >> _BLOCK_SHIFT
+    blocks = (indices >> _BLOCK_SHIFT) - first_block
+    new_bases = values[indices % (1 << _BLOCK_SHIFT) == 0]
+    all_bases = np.concatenate([np.asarray(bases[first_block:]), new_bases]).astype(np.int64)
+    deltas = values - all_bases[blocks]
+    if len(deltas) > 0 and (deltas.min() < 0 or deltas.max() >= _UINT32_LIMIT):
+        return None
+    return deltas.astype(np.uint32), new_bases
+
+
+class CompactOffsets:
+    """
+    The ``n + 1`` offsets of a ragged container, where sample ``i`` spans ``offsets[i]:offsets[i + 1]``,
+    persisted as a single array in the narrowest encoding which fits: ``uint32`` if all offsets are below ``2 ** 32``,
+    otherwise ``uint32`` deltas to a base offset for every block of ``2 ** 16`` offsets, otherwise ``int64``.
+    Lookups are O(1) in every encoding and always return ``int64``.
+    """
+
+    def __init__(self, values: np.ndarray, bases: Optional[np.ndarray] = None, out_dir: Optional[Path] = None):
+        """
+        :param values: The offsets, or their deltas if ``bases`` is provided.
+        :param bases: The base offset of every block, for the block-delta encoding.
+        :param out_dir: The directory in which the offsets are persisted (needed only for ``extend``).
+        """
+        self.values = values
+        self.bases = bases
+        self.out_dir = out_dir
+        self._growables = {}
+
+    @classmethod
+    def save(cls, out_dir: Union[str, Path], offsets: np.ndarray) -> None:
+        """
+        Persists the offsets in ``out_dir`` in the narrowest encoding which fits.
+
+        :param out_dir: The directory of the offsets.
+        :param offsets: The ``n + 1`` offsets.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        out_dir = Path(out_dir)
+        shutil.rmtree(out_dir / "bases", ignore_errors=True)
+        if len(offsets) == 0 or offsets[-1] < _UINT32_LIMIT:
+            np_ninja.from_ndarray(out_dir, offsets.astype(np.uint32))
+            return
+        encoded = _block_deltas(offsets, 0, np.empty(0, dtype=np.int64))
+        if encoded is None:
+            np_ninja.from_ndarray(out_dir, offsets)
+            return
+        deltas, bases = encoded
+        np_ninja.from_ndarray(out_dir, deltas)
+        np_ninja.from_ndarray(out_dir / "bases", bases)
+
+    @classmethod
+    def open(cls, store, key: str = OFFSETS_KEY) -> "CompactOffsets":
+        """
+        :param store: The store of the container (see ``storage.open_store``).
+        :param key: The key of the offsets in the store.
+        """
+        bases_key = f"{key}/bases"
+        bases = store.open_array(bases_key) if store.exists(f"{bases_key}/dtype.ninja") else None
+        out_dir = None if store.packed else store.out_dir / key
+        return cls(store.open_array(key), bases, out_dir)
+
+    def _get(self, indices):
+        values = self.values[indices]
+        if self.bases is None:
+            return values.astype(np.int64) if isinstance(values, np.ndarray) else int(values)
+        if isinstance(values, np.ndarray):
+            indices = np.arange(len(self))[indices] if isinstance(indices, slice) else np.asarray(indices)
+            return self.bases[indices >> _BLOCK_SHIFT] + values.astype(np.int64)
+        return int(self.bases[indices >> _BLOCK_SHIFT]) + int(values)
+
+    def __getitem__(self, item):
+        if np.isscalar(item):
+            item = int(item)
+            if item < 0:
+                item += len(self)
+        return self._get(item)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + (0 if self.bases is None else self.bases.nbytes)
+
+    def extend(self, offsets: np.ndarray) -> None:
+        """
+        Appends offsets. If they do not fit into the current encoding, all offsets are encoded again.
+
+        :param offsets: The new offsets.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if len(offsets) == 0:
+            return
+        if self.out_dir is None:
+            raise ValueError("The offsets are read-only!")
+        if self.bases is None:
+            fits = self.values.dtype == np.int64 or offsets[-1] < _UINT32_LIMIT
+            encoded = (offsets.astype(self.values.dtype), None) if fits else None
+        else:
+            encoded = _block_deltas(offsets, len(self), self.bases)
+        if encoded is None:
+            all_offsets = np.concatenate([self[:], offsets])
+            self.close()
+            CompactOffsets.save(self.out_dir, all_offsets)
+            self.values = np_ninja.open_existing(self.out_dir)
+            has_bases = (self.out_dir / "bases").exists()
+            self.bases = np_ninja.open_existing(self.out_dir / "bases") if has_bases else None
+            return
+        values, bases = encoded
+        self.values = self._extend_array("", values)
+        if bases is not None and len(bases) > 0:
+            self.bases = self._extend_array("bases", bases)
+
+    def _extend_array(self, key: str, arr: np.ndarray) -> np.ndarray:
+        growable = self._growables.get(key)
+        if growable is None:
+            growable = np_ninja.GrowableMmap(self.out_dir / key, mode="r")
+            self._growables[key] = growable
+        growable.extend(arr)
+        return growable.array
+
+    def close(self, trim: bool = False) -> None:
+        """
+        :param trim: Whether to release the unused capacity of the files (see ``numpy.GrowableMmap.close``).
+        """
+        for growable in self._growables.values():
+            growable.close(trim=trim)
+        self._growables = {}
+
+
+class OffsetsView:
+    """
+    The starts, the ends or the lengths of the samples, computed from ``CompactOffsets``.
+    Supports the same indexing as a one-dimensional ``int64`` array (integers, slices, integer and boolean arrays).
+    """
+
+    dtype = np.dtype(np.int64)
+    ndim = 1
+
+    def __init__(self, offsets: CompactOffsets, kind: str):
+        """
+        :param offsets: The offsets.
+        :param kind: One of ``"starts"``, ``"ends"`` or ``"lengths"``.
+        """
+        assert kind in ("starts", "ends", "lengths"), kind
+        self.offsets = offsets
+        self.kind = kind
+
+    def __len__(self):
+        return max(len(self.offsets) - 1, 0)
+
+    @property
+    def shape(self) -> Tuple[int]:
+        return (len(self),)
+
+    def __getitem__(self, item):
+        n = len(self)
+        if isinstance(item, slice):
+            start, stop, step = item.indices(n)
+            if step == 1:
+                stop = max(start, stop)
+                starts = self.offsets[start:stop]
+                if self.kind == "starts":
+                    return starts
+                ends = self.offsets[start + 1 : stop + 1]
+                return ends if self.kind == "ends" else ends - starts
+            indices = np.arange(start, stop, step)
+        elif np.isscalar(item):
+            idx = int(item)
+            if idx < 0:
+                idx += n
+            if not 0 <= idx < n:
+                raise IndexError(f"index {item} is out of bounds for axis 0 with size {n}")
+            if self.kind == "starts":
+                return self.offsets[idx]
+            if self.kind == "ends":
+                return self.offsets[idx + 1]
+            return self.offsets[idx + 1] - self.offsets[idx]
+        else:
+            indices = np.asarray(item)
+            if indices.dtype == bool:
+                if indices.shape != (n,):
+                    raise IndexError(f"boolean index has shape {indices.shape}, expected ({n},)")
+                indices = np.flatnonzero(indices)
+            indices = np.where(indices < 0, indices + n, indices)
+            if len(indices) > 0 and (indices.min() < 0 or indices.max() >= n):
+                raise IndexError(f"index is out of bounds for axis 0 with size {n}")
+        if self.kind == "starts":
+            return self.offsets[indices]
+        if self.kind == "ends":
+            return self.offsets[indices + 1]
+        return self.offsets[indices + 1] - self.offsets[indices]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def __iter__(self):
+        return iter(self[:].tolist())
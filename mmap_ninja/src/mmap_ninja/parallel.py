@@ -1,3 +1,5 @@
+import queue
+import threading
 from enum import Enum
 from functools import partial
 from tqdm.auto import tqdm
@@ -18,12 +20,27 @@ class _Exhausted(Enum):
 EXHAUSTED = _Exhausted.exhausted
 
 
+class _ProducerError:
+    def __init__(self, error):
+        self.error = error
+
+
 class ParallelBatchCollector:
     _parallel: Parallel = None
 
-    def __init__(self, indexable, batch_size, n_jobs=None, verbose=False, **kwargs):
+    def __init__(self, indexable, batch_size, n_jobs=None, verbose=False, queue_depth=0, **kwargs):
+        """
+        :param indexable: An object that supports __getitem__ or a function that takes one integer argument.
+        :param batch_size: The number of samples in a batch.
+        :param n_jobs: The number of joblib jobs. None (or 1) means no parallelization.
+        :param verbose: Whether to show a progress bar.
+        :param queue_depth: If positive, ``batches()`` produces up to ``queue_depth`` batches in a background thread,
+            while the consumer is still processing the previous ones. 0 means that the batches are produced on demand.
+        :param kwargs: Additional keyword arguments to be passed to ``joblib.Parallel``.
+        """
         self.indexable, self._obj_length, self._num_batches = self.verify(indexable, batch_size)
         self.batch_size = batch_size
+        self.queue_depth = queue_depth
 
         self._pbar = self._init_pbar(verbose)
         self._parallel = self.begin(n_jobs, **kwargs)
@@ -64,9 +81,49 @@ class ParallelBatchCollector:
         return _parallel
 
     def batches(self):
+        if self.queue_depth > 0:
+            yield from self._pipelined_batches()
+            return
         while not self.exhausted():
             yield self.collect_batch()
 
+    def _pipelined_batches(self):
+        # The producer thread collects batch k + 1 while the consumer writes batch k.
+        # The queue is bounded, so at most queue_depth batches are held in memory.
+        batches = queue.Queue(maxsize=self.queue_depth)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def produce():
+            try:
+                while not stop.is_set() and not self.exhausted():
+                    put(self.collect_batch())
+            except BaseException as e:
+                put(_ProducerError(e))
+            finally:
+                put(EXHAUSTED)
+
+        producer = threading.Thread(target=produce, name="mmap_ninja_batch_producer", daemon=True)
+        producer.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is EXHAUSTED:
+                    return
+                if isinstance(batch, _ProducerError):
+                    raise batch.error
+                yield batch
+        finally:
+            stop.set()
+            producer.join()
+
     def collect_batch(self):
         if self._parallel is None:
             batch = self._collect_no_parallel_batch()
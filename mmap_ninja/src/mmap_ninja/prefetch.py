@@ -0,0 +1,118 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Sequence, Deque
+
+import numpy as np
+
+
+@dataclass
+class PrefetchStats:
+    """
+    ``hits`` counts the samples which were already loaded when the consumer asked for them,
+    ``stalls`` the ones the consumer had to wait for, and ``stall_seconds`` the total time spent waiting.
+    """
+
+    hits: int = 0
+    stalls: int = 0
+    stall_seconds: float = 0.0
+
+
+def _load(container, idx):
+    sample = container[idx]
+    if isinstance(sample, np.ndarray):
+        # Copying out of the memory map page-faults in the worker thread (numpy releases the GIL for the copy),
+        # so the consumer gets a sample which is already in RAM.
+        sample = np.array(sample)
+    return sample
+
+
+class Prefetcher:
+    """
+    Iterates over ``container[i]`` for every ``i`` in ``indices``, while a small thread pool loads up to ``lookahead``
+    of the next samples in the background. Works with ``RaggedMmap``, ``StringsMmap`` and Numpy memmaps
+    (or anything else which supports ``__getitem__`` with an integer).
+
+    The samples are yielded in the order of ``indices``.
+    Samples which are numpy arrays are copied out of the memory map.
+    """
+
+    def __init__(self, container, indices: Sequence[int], lookahead: int = 32, n_workers: int = 2):
+        """
+        :param container: The container to read from.
+        :param indices: The indices of the samples, in the order in which they will be consumed.
+        :param lookahead: The maximum number of samples which are loaded ahead of the consumer.
+        :param n_workers: The number of threads which load the samples.
+        """
+        if lookahead < 1:
+            raise ValueError(f"lookahead should be at least 1, got {lookahead}!")
+        self.container = container
+        self.indices = indices
+        self.lookahead = lookahead
+        self.stats = PrefetchStats()
+        # Map all lazily opened fields before the workers start, so that they do not race to open them.
+        for name in getattr(container, "_lazy_fields", ()):
+            getattr(container, name)
+        self._indices = iter(indices)
+        self._pending: Deque[Future] = deque()
+        self._executor = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="mmap_ninja_prefetch")
+        self._fill()
+
+    def _fill(self):
+        while len(self._pending) < self.lookahead:
+            try:
+                idx = next(self._indices)
+            except StopIteration:
+                return
+            self._pending.append(self._executor.submit(_load, self.container, idx))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._pending:
+            self.close()
+            raise StopIteration
+        future = self._pending.popleft()
+        if future.done():
+            self.stats.hits += 1
+        else:
+            self.stats.stalls += 1
+            start_t = perf_counter()
+            future.result()
+            self.stats.stall_seconds += perf_counter() - start_t
+        self._fill()
+        return future.result()
+
+    def __len__(self):
+        return len(self.indices)
+
+    def close(self):
+        """
+        Cancels the pending loads and shuts down the thread pool.
+        """
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def prefetch(container, indices: Sequence[int], lookahead: int = 32, n_workers: int = 2) -> Prefetcher:
+    """
+    Iterates over the samples of ``container`` at ``indices``, loading up to ``lookahead`` samples in the background.
+
+    :param container: A ``RaggedMmap``, ``StringsMmap`` or a Numpy memmap.
+    :param indices: The indices of the samples, in the order in which they will be consumed (e.g. the permutation
+        of the current epoch).
+    :param lookahead: The maximum number of samples which are loaded ahead of the consumer.
+    :param n_workers: The number of threads which load the samples.
+    :return: An iterator over the samples, with ``.stats`` for the number of hits and stalls.
+    """
+    return Prefetcher(container, indices, lookahead=lookahead, n_workers=n_workers)
@@ -1,18 +1,19 @@
+import itertools
+import os
+import shutil
 from copy import copy
+from functools import cached_property
 from pathlib import Path
-from typing import Union, Sequence
+from time import perf_counter_ns
+from typing import Optional, Tuple, Union, Sequence
 
 import numpy as np
 
-from mmap_ninja import base, numpy
-
-
-def _np_shape_extend(shapes, arr):
-    numpy.extend(shapes, arr)
-
-
-def _ragged_shape_extend(shapes, arr):
-    shapes.extend(arr)
+from mmap_ninja import aio, base, compression, numpy, storage, tombstones
+from mmap_ninja.offsets import InMemoryOffsets, CompactOffsets, OffsetsView, OFFSETS_KEY
+from mmap_ninja.offsets import _add_dead_nbytes, _last_occurrences, _plan_updates, read_dead_nbytes
+from mmap_ninja.parallel import ParallelBatchCollector, delayed
+from mmap_ninja.stats import AccessStats
 
 
 class RaggedMmap:
@@ -26,9 +27,12 @@ class RaggedMmap:
         shapes_key="shapes",
         flattened_shapes_key="flattened_shapes",
         copy_before_wrapper_fn=True,
+        in_memory_index=False,
     ):
-        out_dir = Path(out_dir)
-        out_dir.mkdir(exist_ok=True)
+        self._store = storage.open_store(out_dir)
+        out_dir = self._store.out_dir
+        if not self._store.packed:
+            out_dir.mkdir(exist_ok=True)
 
         self.starts_key = starts_key
         self.ends_key = ends_key
@@ -41,50 +45,439 @@ class RaggedMmap:
         self.out_dir = out_dir
         self.wrapper_fn = wrapper_fn
         self.mode = mode
+        self.in_memory_index = in_memory_index
+        self.copy_before_wrapper_fn = copy_before_wrapper_fn
 
-        self.shapes_are_flat = None
-        self.shapes_ctor = None
-        self.memmap = None
-        self.starts = None
-        self.ends = None
-        self.shapes = None
-        self.flattened_shapes = None
-        self.range = None
-        self.n = None
-        self.range = None
-        self.shapes_extension_fn = None
-
-        if (self.out_dir / "shapes_are_flat.ninja").exists():
-            self._reload_fields()
+        self.advice = None
+        self._data = None
+        self._flat_shapes = None
+        self._shapes = None
+        self._growables = {}
+        self._async_reader = None
+        self._recorder = None
+        self._opening = False
+        base._register_for_fork(self)
 
-        self.copy_before_wrapper_fn = copy_before_wrapper_fn
+    def __getstate__(self):
+        # Only the arguments of the constructor are pickled, the files are reopened lazily after unpickling.
+        return dict(
+            out_dir=str(self.out_dir),
+            wrapper_fn=self.wrapper_fn,
+            mode=self.mode,
+            starts_key=self.starts_key,
+            ends_key=self.ends_key,
+            shapes_key=self.shapes_key,
+            flattened_shapes_key=self.flattened_shapes_key,
+            copy_before_wrapper_fn=self.copy_before_wrapper_fn,
+            in_memory_index=self.in_memory_index,
+            advice=self.advice,
+        )
+
+    def __setstate__(self, state):
+        state = dict(state)
+        advice = state.pop("advice")
+        self.__init__(**state)
+        if advice is not None:
+            self.advise(advice)
+
+    # The persisted arrays are mapped lazily on first use (and are ``None`` while the RaggedMmap is empty),
+    # so that opening a RaggedMmap costs the same regardless of the number of samples.
+    _lazy_fields = (
+        "shapes_are_flat",
+        "memmap",
+        "compact_offsets",
+        "starts",
+        "ends",
+        "shapes",
+        "flattened_shapes",
+        "offsets",
+        "_live",
+    )
+
+    def _open_all(self):
+        """
+        Opens all of the persisted fields together, on the first use of any of them (see ``base._snapshot_field``).
+        The in-memory index is loaded later, from the opened fields.
+        """
+        if self._opening:
+            return
+        self._opening = True
+        try:
+            for name in ("shapes_are_flat", "memmap", "compact_offsets", "starts", "ends", "flattened_shapes", "_live"):
+                getattr(self, name)
+            if isinstance(self.shapes, RaggedMmap):
+                self.shapes._open_all()
+        finally:
+            self._opening = False
+
+    @base._snapshot_field
+    def shapes_are_flat(self):
+        if not self._store.exists("shapes_are_flat.ninja"):
+            return None
+        return bool(base._bytes_to_int(self._store.read_bytes("shapes_are_flat.ninja")))
+
+    def _open_field(self, key):
+        if self.shapes_are_flat is None:
+            return None
+        arr = self._store.open_array(key, mode=self.mode)
+        if self.advice is not None:
+            numpy.advise(arr, self.advice)
+        return arr
+
+    @base._snapshot_field
+    def memmap(self):
+        if self.shapes_are_flat is not None and not self._store.packed and compression.is_compressed(self.out_dir):
+            return compression.CompressedArray(self.out_dir)
+        return self._open_field("")
+
+    @base._snapshot_field
+    def compact_offsets(self):
+        """
+        The single offsets array of a RaggedMmap created with ``compact_index=True`` (``None`` otherwise).
+        """
+        if not self._store.exists(f"{OFFSETS_KEY}/dtype.ninja"):
+            return None
+        return CompactOffsets.open(self._store, OFFSETS_KEY)
+
+    @base._snapshot_field
+    def starts(self):
+        if self.compact_offsets is not None:
+            return OffsetsView(self.compact_offsets, "starts")
+        return self._open_field(self.starts_key)
+
+    @base._snapshot_field
+    def ends(self):
+        if self.compact_offsets is not None:
+            return OffsetsView(self.compact_offsets, "ends")
+        return self._open_field(self.ends_key)
+
+    @base._snapshot_field
+    def flattened_shapes(self):
+        if self.compact_offsets is not None:
+            return OffsetsView(self.compact_offsets, "lengths")
+        return self._open_field(self.flattened_shapes_key)
+
+    @base._snapshot_field
+    def shapes(self):
+        if self.shapes_are_flat is None or self.shapes_are_flat:
+            return self._open_field(self.shapes_key)
+        if base._bytes_to_str(self._store.read_bytes(f"{self.shapes_key}/type.ninja")) == "numpy":
+            return ShapesTable(self._open_field(self.shapes_key))
+        # Containers created before the shapes table store the shapes as a nested RaggedMmap.
+        shapes_store = self._store.child(self.shapes_key)
+        shapes = RaggedMmap(shapes_store, mode=self.mode, in_memory_index=self.in_memory_index)
+        if self.advice is not None:
+            shapes.advise(self.advice)
+        return shapes
+
+    @cached_property
+    def offsets(self):
+        """
+        The in-memory index (only if ``in_memory_index=True``). Loading it also loads the shapes into RAM,
+        so that scalar lookups do not have to go through ``np.memmap.__getitem__``.
+        """
+        if not self.in_memory_index or self.starts is None:
+            return None
+        self._data = self.memmap if isinstance(self.memmap, compression.CompressedArray) else np.asarray(self.memmap)
+        if self.shapes_are_flat:
+            self._flat_shapes = memoryview(np.ascontiguousarray(self.shapes[:, 0], dtype=np.int64))
+        elif isinstance(self.shapes, ShapesTable):
+            self._shapes = ShapesTable(np.array(self.shapes.table))
+        else:
+            self._shapes = self.shapes
+        return InMemoryOffsets(self.starts, self.ends)
+
+    @base._snapshot_field
+    def _live(self) -> Optional[np.ndarray]:
+        """
+        The (physical) indices of the samples which are not deleted, or ``None`` if no sample is deleted.
+        The public methods take the position of a sample among the live ones, and map it with ``_physical``.
+        """
+        if self.starts is None:
+            return None
+        return tombstones._live_rows(self._store, len(self.starts))
+
+    def _physical(self, indices: np.ndarray) -> np.ndarray:
+        return indices if self._live is None else self._live[indices]
+
+    @property
+    def n(self):
+        return len(self)
 
     def _reload_fields(self):
-        self.shapes_are_flat = bool(base._file_to_int(self.out_dir / "shapes_are_flat.ninja"))
-        self.shapes_ctor = numpy.open_existing if self.shapes_are_flat else RaggedMmap
-        self.memmap = numpy.open_existing(self.out_dir, mode=self.mode)
-        self.starts = numpy.open_existing(self.out_dir / self.starts_key, mode=self.mode)
-        self.ends = numpy.open_existing(self.out_dir / self.ends_key, mode=self.mode)
-        self.shapes = self.shapes_ctor(self.out_dir / self.shapes_key, mode=self.mode)
-        self.flattened_shapes = numpy.open_existing(self.out_dir / self.flattened_shapes_key, mode=self.mode)
-        self.range = np.arange(len(self.starts), dtype=np.int64)
-        self.n = len(self.shapes)
-        self.range = np.arange(self.n)
-        self.shapes_extension_fn = _np_shape_extend if self.shapes_are_flat else _ragged_shape_extend
+        self._close_growables()
+        for name in self._lazy_fields:
+            self.__dict__.pop(name, None)
+
+    def _reset_after_fork(self):
+        # The thread pool of the async reader does not survive a fork, and the mappings and the open files
+        # are reopened lazily, so that the child does not share them with the parent.
+        self._async_reader = None
+        self._reload_fields()
+
+    def _extend_field(self, key, arr):
+        """
+        Appends to one of the persisted arrays (``key=""`` is the data itself) and returns a view of its valid part.
+        The ``GrowableMmap`` objects are kept open, so that repeated extends do not reopen and remap every array.
+        """
+        growable = self._growables.get(key)
+        if growable is None:
+            growable = numpy.GrowableMmap(self.out_dir / key, mode=self.mode)
+            if self.advice is not None:
+                growable.advise(self.advice)
+            self._growables[key] = growable
+        growable.extend(arr)
+        return growable.array
+
+    def _close_growables(self, trim: bool = False):
+        for growable in self._growables.values():
+            growable.close(trim=trim)
+        self._growables = {}
+        compact_offsets = self.__dict__.get("compact_offsets")
+        if compact_offsets is not None:
+            compact_offsets.close(trim=trim)
+
+    def close(self):
+        """
+        Closes the files which were opened for appending and releases their unused capacity (the data
+        and the index arrays grow geometrically while samples are appended, see ``numpy.GrowableMmap``).
+        The files are reopened lazily, when the container is used again.
+        """
+        if self._async_reader is not None:
+            self._async_reader.close()
+            self._async_reader = None
+        self._close_growables(trim=True)
+        self._reload_fields()
+
+    def advise(self, pattern: str):
+        """
+        Tells the kernel how the samples will be accessed (see ``numpy.advise``).
+        The advice applies to the data and to the index arrays, including the ones which are mapped later on.
+
+        :param pattern: One of ``"normal"``, ``"sequential"``, ``"random"``, ``"willneed"``, ``"dontneed"``
+            or ``"hugepage"``.
+        """
+        numpy._madvise_flag(pattern)
+        self.advice = pattern
+        for name in ("memmap", "starts", "ends", "flattened_shapes", "shapes"):
+            field = self.__dict__.get(name)
+            if isinstance(field, RaggedMmap):
+                field.advise(pattern)
+            elif isinstance(field, ShapesTable):
+                numpy.advise(field.table, pattern)
+            elif field is not None:
+                numpy.advise(field, pattern)
+        for growable in self._growables.values():
+            growable.advise(pattern)
+
+    def willneed(self, indices):
+        """
+        Asks the kernel to prefetch the samples, which will be accessed soon.
+
+        :param indices: The indices of the samples (anything that ``__getitem__`` accepts, except for scalars).
+        """
+        indices = self._physical(numpy._normalize_indices(indices, len(self)))
+        if len(indices) == 0:
+            return
+        starts, ends = self._ranges(indices)
+        itemsize = self.memmap.dtype.itemsize
+        numpy._willneed_bytes(self.memmap, starts * itemsize, ends * itemsize)
+        if isinstance(self.shapes, ShapesTable):
+            numpy.willneed(self.shapes.table, indices)
+        elif not self.shapes_are_flat:
+            self.shapes.willneed(indices)
+
+    def _ranges(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized lookup of the starts and the ends of the samples at the (normalized) ``indices``.
+        """
+        if self.offsets is not None:
+            return self.offsets.lookup(indices)
+        return self.starts[indices], self.ends[indices]
 
     def get_multiple(self, item):
-        indices = self.range[item]
-        return [self.__getitem__(idx) for idx in indices]
+        indices = self._physical(numpy._normalize_indices(item, len(self)))
+        if len(indices) == 0:
+            return []
+        starts, ends = self._ranges(indices)
+        shapes = self.shapes[indices]
+        buffer, positions = numpy._gather_ranges(self.memmap, starts, ends)
+        lengths = ends - starts
+        return [
+            self._finalize(buffer[position : position + length], shape)
+            for position, length, shape in zip(positions.tolist(), lengths.tolist(), shapes)
+        ]
+
+    def get_padded(
+        self,
+        indices,
+        pad_value=0,
+        max_len: Optional[int] = None,
+        out: Optional[np.ndarray] = None,
+        dtype=None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Collates the samples at ``indices`` into a single batch, padded along their first axis.
+        Every sample is copied from the memory map straight into its slot of the output (``wrapper_fn`` is not applied).
+
+        :param indices: Anything that ``get_multiple`` accepts.
+        :param pad_value: The value of the padding.
+        :param max_len: The length of the padded axis (defaults to ``out.shape[1]`` or to the length of the longest
+            sample). Longer samples are truncated.
+        :param out: An optional C-contiguous ``(batch, max_len, ...)`` array to write into, e.g. to reuse it
+            across steps.
+        :param dtype: The dtype of the output when ``out`` is not given (defaults to the dtype of the samples).
+        :return: The ``(batch, max_len, ...)`` array and the number of valid rows of every sample in it.
+        """
+        if self.starts is None:
+            raise IndexError(f"RaggedMmap is empty!")
+        indices = self._physical(numpy._normalize_indices(indices, len(self)))
+        starts, ends = self._ranges(indices)
+        starts = np.asarray(starts, dtype=np.int64)
+        if self.shapes_are_flat:
+            lengths = np.asarray(ends, dtype=np.int64) - starts
+            sample_shape = ()
+        else:
+            shapes = self.shapes[indices]
+            sample_shapes = {tuple(int(dim) for dim in shape[1:]) for shape in shapes}
+            if len(sample_shapes) > 1:
+                raise ValueError(f"The samples should have the same shape after the first axis, got {sample_shapes}!")
+            sample_shape = sample_shapes.pop() if sample_shapes else ()
+            lengths = np.array([int(shape[0]) for shape in shapes], dtype=np.int64)
+        if max_len is None:
+            max_len = out.shape[1] if out is not None else int(lengths.max(initial=0))
+        expected_shape = (len(indices), max_len, *sample_shape)
+        if out is None:
+            out = np.empty(expected_shape, dtype=self.memmap.dtype if dtype is None else dtype)
+        elif out.shape != expected_shape or not out.flags.c_contiguous:
+            raise ValueError(f"out should be a C-contiguous array of shape {expected_shape}, got {out.shape}!")
+        lengths = np.minimum(lengths, max_len)
+        row_size = int(np.prod(sample_shape, dtype=np.int64))
+        slots = out.reshape(len(indices), max_len * row_size)
+        # Indexing a plain ndarray is faster than indexing a ``np.memmap``.
+        source = np.asarray(self.memmap) if isinstance(self.memmap, np.ndarray) else self.memmap
+        for slot, start, n_elements in zip(slots, starts.tolist(), (lengths * row_size).tolist()):
+            slot[:n_elements] = source[start : start + n_elements]
+            slot[n_elements:] = pad_value
+        return out, lengths
+
+    def _read_plan(self, indices: np.ndarray):
+        """
+        Returns the byte ranges of the samples in the data file and a function, which turns the bytes
+        of the ``k``-th range into the sample (used by ``aio.AsyncReader``), or ``None`` if the data is compressed.
+        """
+        if isinstance(self.memmap, compression.CompressedArray):
+            return None
+        indices = self._physical(indices)
+        starts, ends = self._ranges(indices)
+        shapes = self.shapes[indices]
+        dtype = self.memmap.dtype
+
+        def decode(k, buffer):
+            return self._finalize(np.frombuffer(buffer, dtype=dtype), shapes[k])
+
+        return starts * dtype.itemsize, ends * dtype.itemsize, decode
+
+    def async_reader(self, max_concurrency: int = 8, coalesce_gap: int = 64 * 1024) -> "aio.AsyncReader":
+        """
+        Configures the reader behind ``aget`` and ``aget_many`` (see ``aio.AsyncReader``).
+
+        :param max_concurrency: The maximum number of index lookups and reads which run at the same time.
+        :param coalesce_gap: The maximum number of unused bytes between two samples, which are read together.
+        :return: The ``AsyncReader``.
+        """
+        if self._async_reader is not None:
+            self._async_reader.close()
+        self._async_reader = aio.AsyncReader(self, max_concurrency=max_concurrency, coalesce_gap=coalesce_gap)
+        return self._async_reader
+
+    async def aget(self, item):
+        """
+        The asynchronous counterpart of ``__getitem__``, which does not block the event loop on page faults.
+        """
+        if self._async_reader is None:
+            self.async_reader()
+        return await self._async_reader.aget(item)
+
+    async def aget_many(self, indices) -> list:
+        """
+        The asynchronous counterpart of ``get_multiple``. Concurrent requests for nearby samples are read together.
+        """
+        if self._async_reader is None:
+            self.async_reader()
+        return await self._async_reader.aget_many(indices)
 
     def set_multiple(self, item, value):
-        for i, idx in enumerate(self.range[item]):
-            self.set_single(idx, value[i])
+        indices = numpy._normalize_indices(item, len(self))
+        self._update(self._physical(indices), [value[i] for i in range(len(indices))])
 
     def set_single(self, idx, value):
-        start = self.starts[idx]
-        end = self.ends[idx]
-        value = np.asarray(value)
-        self.memmap[start:end] = value
+        self._update(self._physical(numpy._normalize_indices([idx], len(self))), [value])
+
+    def _update(self, indices: np.ndarray, values: Sequence[np.ndarray]) -> None:
+        """
+        Replaces samples, whose new values may have a different shape. A new value which fits into the slot
+        of the old one is written in place, the rest are appended to the end of the data, all at once,
+        and only the index rows of the updated samples are rewritten. The elements which are no longer used
+        are counted in ``dead_nbytes``. The cost is proportional to the number of updated elements.
+        """
+        if isinstance(self.memmap, compression.CompressedArray):
+            raise ValueError(f'"{self.out_dir}" is compressed and read-only, decompress it first!')
+        keep = _last_occurrences(indices)
+        indices = indices[keep]
+        slices = numpy._lists_of_ndarrays_to_bytes([values[i] for i in keep.tolist()], self.memmap.dtype)
+        starts, ends = self._ranges(indices)
+        lengths = np.asarray(slices.flattened_shapes, dtype=np.int64)
+        if np.any(lengths != ends - starts):
+            if self._store.packed:
+                raise ValueError(f'"{self.out_dir}" is packed and supports only same-length updates, unpack it first!')
+            if self.compact_offsets is not None:
+                raise ValueError(f'"{self.out_dir}" has a compact index, which supports only same-length updates!')
+        if self.shapes_are_flat and any(len(shape) > 1 for shape in slices.shapes):
+            raise ValueError(f'"{self.out_dir}" has only flat samples, cannot store samples of shapes {slices.shapes}!')
+        new_starts, new_ends, moved, dead = _plan_updates(starts, ends, lengths, len(self.memmap))
+        positions = np.asarray(slices.starts, dtype=np.int64)
+        for i in np.flatnonzero(~moved).tolist():
+            self.memmap[new_starts[i] : new_ends[i]] = slices.buffer[positions[i] : positions[i] + lengths[i]]
+        if moved.any():
+            moved_positions, moved_lengths = positions[moved].tolist(), lengths[moved].tolist()
+            tail = np.concatenate([slices.buffer[p : p + n] for p, n in zip(moved_positions, moved_lengths)])
+            self.memmap = self._extend_field("", tail)
+        if self.compact_offsets is None:
+            changed = (new_starts != starts) | (new_ends != ends)
+            numpy._write_rows(self.out_dir / self.starts_key, indices[changed], new_starts[changed])
+            numpy._write_rows(self.out_dir / self.ends_key, indices[changed], new_ends[changed])
+            numpy._write_rows(self.out_dir / self.flattened_shapes_key, indices[changed], lengths[changed])
+        self._update_shapes(indices, slices.shapes)
+        _add_dead_nbytes(self._store, dead * self.memmap.dtype.itemsize)
+        self.__dict__.pop("offsets", None)
+
+    def _update_shapes(self, indices: np.ndarray, shapes: Sequence[Tuple[int]]) -> None:
+        if self.shapes_are_flat:
+            rows = np.asarray(shapes, dtype=np.int64)
+            changed = np.any(self.shapes[indices] != rows, axis=1)
+            numpy._write_rows(self.out_dir / self.shapes_key, indices[changed], rows[changed])
+            return
+        if not isinstance(self.shapes, ShapesTable):
+            if any(tuple(old) != tuple(new) for old, new in zip(self.shapes[indices], shapes)):
+                raise ValueError(f'The shapes of "{self.out_dir}" are stored in the old nested layout, rebuild it!')
+            return
+        table = self.shapes.table
+        rows = _shapes_table(shapes, max_ndim=table.shape[1] - 1)
+        if rows.shape[1] == table.shape[1]:
+            changed = np.any(table[indices] != rows, axis=1)
+            numpy._write_rows(self.out_dir / self.shapes_key, indices[changed], rows[changed])
+            return
+        widened = self._widen_shapes_table(rows.shape[1])
+        widened[indices] = rows
+        self.shapes = self._rewrite_shapes_table(widened)
+
+    @property
+    def dead_nbytes(self) -> int:
+        """
+        The number of bytes of the data, which are no longer used by any sample after length-changing updates.
+        """
+        return read_dead_nbytes(self._store)
 
     def __getitem__(self, item):
         if self.starts is None:
@@ -101,40 +494,238 @@ class RaggedMmap:
     def __len__(self):
         if self.starts is None:
             return 0
+        if self._live is not None:
+            return len(self._live)
         return len(self.starts)
 
     def get_single(self, item):
+        if self._live is not None:
+            item = self._live[item]
+        if self.offsets is not None:
+            return self._get_single_in_memory(item)
         start = self.starts[item]
         end = self.ends[item]
         shape = self.shapes[item]
-        res = self.memmap[start:end]
+        return self._finalize(self.memmap[start:end], shape)
+
+    def _finalize(self, res, shape):
+        return self._wrap(self._reshape(res, shape))
+
+    def _reshape(self, res, shape):
         if self.shapes_are_flat and shape[0] == 0:
             if len(res) == 1:
                 res = res.item()
         else:
             res = res.reshape(shape)
+        return res
+
+    def _get_single_in_memory(self, item):
+        start = self.offsets.starts[item]
+        end = self.offsets.ends[item]
+        res = self._data[start:end]
+        if not self.shapes_are_flat:
+            res = res.reshape(self._shapes[item])
+        elif self._flat_shapes[item] == 0 and end - start == 1:
+            res = res.item()
+        return self._wrap(res)
+
+    def _wrap(self, res):
         if self.wrapper_fn is not None:
             if self.copy_before_wrapper_fn:
                 res = copy(res)
             res = self.wrapper_fn(res)
         return res
 
+    def enable_stats(self, callback=None, report_every: int = 1000, residency_every: int = 100) -> AccessStats:
+        """
+        Starts recording the reads (see ``stats.AccessStats``): the number of calls, samples and bytes,
+        the latency of every call split into the index lookup, the data access and ``wrapper_fn``,
+        and the page residency of the data. While the stats are disabled, the reads do not pay anything for them.
+
+        :param callback: Called with a snapshot of the statistics every ``report_every`` calls.
+        :param report_every: How often (in calls) ``callback`` is called.
+        :param residency_every: How often (in calls) the page residency is sampled with ``mincore``.
+        :return: The ``AccessStats``.
+        """
+        self._recorder = AccessStats(callback=callback, report_every=report_every, residency_every=residency_every)
+        # The instance attributes shadow the methods, so the reads are only timed while the stats are enabled.
+        self.get_single = self._get_single_timed
+        self.get_multiple = self._get_multiple_timed
+        return self._recorder
+
+    def disable_stats(self):
+        self.__dict__.pop("get_single", None)
+        self.__dict__.pop("get_multiple", None)
+        self._recorder = None
+
+    def stats(self) -> Optional[dict]:
+        """
+        :return: A snapshot of the statistics (see ``stats.AccessStats.snapshot``), or ``None`` if they are disabled.
+        """
+        return None if self._recorder is None else self._recorder.snapshot()
+
+    def _get_single_timed(self, item):
+        recorder = self._recorder
+        start_t = perf_counter_ns()
+        if self._live is not None:
+            item = self._live[item]
+        if self.offsets is not None:
+            start, end = self.offsets.starts[item], self.offsets.ends[item]
+            data = self._data
+        else:
+            start, end = self.starts[item], self.ends[item]
+            data = self.memmap
+        shape = self.shapes[item]
+        index_t = perf_counter_ns()
+        res = data[start:end]
+        if recorder.sample_residency() and isinstance(res, np.ndarray) and res.nbytes > 0:
+            recorder.record_residency(res.ctypes.data, res.nbytes)
+        res = self._reshape(res, shape)
+        data_t = perf_counter_ns()
+        res = self._wrap(res)
+        phases = (("index", index_t - start_t), ("data", data_t - index_t), ("wrapper_fn", perf_counter_ns() - data_t))
+        recorder.record("get_single", 1, int(end - start) * self.memmap.dtype.itemsize, phases)
+        return res
+
+    def _get_multiple_timed(self, item):
+        recorder = self._recorder
+        start_t = perf_counter_ns()
+        indices = self._physical(numpy._normalize_indices(item, len(self)))
+        if len(indices) == 0:
+            return []
+        starts, ends = self._ranges(indices)
+        shapes = self.shapes[indices]
+        index_t = perf_counter_ns()
+        if recorder.sample_residency() and isinstance(self.memmap, np.ndarray):
+            address, itemsize = self.memmap.ctypes.data, self.memmap.dtype.itemsize
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                if end > start:
+                    recorder.record_residency(address + start * itemsize, (end - start) * itemsize)
+        buffer, positions = numpy._gather_ranges(self.memmap, starts, ends)
+        lengths = ends - starts
+        samples = [
+            self._reshape(buffer[position : position + length], shape)
+            for position, length, shape in zip(positions.tolist(), lengths.tolist(), shapes)
+        ]
+        data_t = perf_counter_ns()
+        samples = [self._wrap(sample) for sample in samples]
+        phases = (("index", index_t - start_t), ("data", data_t - index_t), ("wrapper_fn", perf_counter_ns() - data_t))
+        recorder.record("get_multiple", len(samples), int(lengths.sum()) * self.memmap.dtype.itemsize, phases)
+        return samples
+
     def append(self, array: np.ndarray):
         self.extend([array])
 
     def extend(self, arrays: Sequence[np.ndarray]):
+        if self._store.packed:
+            raise ValueError(f'"{self.out_dir}" is packed and cannot be extended, unpack it first!')
         if self.starts is None:
             RaggedMmap.from_lists(self.out_dir, arrays)
             self._reload_fields()
             return
         numpy_bytes_slices = numpy._lists_of_ndarrays_to_bytes(arrays, self.memmap.dtype)
-        numpy.extend(self.memmap, numpy_bytes_slices.buffer)
-        end = self.ends[-1]
-        numpy.extend(self.starts, end + numpy_bytes_slices.starts)
-        numpy.extend(self.ends, end + numpy_bytes_slices.ends)
-        numpy.extend(self.flattened_shapes, numpy_bytes_slices.flattened_shapes)
-        self.shapes_extension_fn(self.shapes, numpy_bytes_slices.shapes)
+        # Updated samples may have been moved after the last one, so the new ones go after the end of the data.
+        end = len(self.memmap)
+        if isinstance(self.memmap, compression.CompressedArray):
+            self.memmap.extend(numpy_bytes_slices.buffer)
+        else:
+            self.memmap = self._extend_field("", numpy_bytes_slices.buffer)
+        if self.compact_offsets is not None:
+            self.compact_offsets.extend(end + np.asarray(numpy_bytes_slices.ends, dtype=np.int64))
+        else:
+            self.starts = self._extend_field(
+                self.starts_key, end + np.asarray(numpy_bytes_slices.starts, dtype=np.int64)
+            )
+            self.ends = self._extend_field(self.ends_key, end + np.asarray(numpy_bytes_slices.ends, dtype=np.int64))
+            self.flattened_shapes = self._extend_field(
+                self.flattened_shapes_key, np.asarray(numpy_bytes_slices.flattened_shapes, dtype=np.int64)
+            )
+        if self.shapes_are_flat:
+            self.shapes = self._extend_field(self.shapes_key, np.asarray(numpy_bytes_slices.shapes, dtype=np.int64))
+        elif isinstance(self.shapes, ShapesTable):
+            self.shapes = self._extend_shapes_table(numpy_bytes_slices.shapes)
+        else:
+            self.shapes.extend(numpy_bytes_slices.shapes)
+        self.__dict__.pop("offsets", None)
+        self.__dict__.pop("_live", None)
+
+    def delete(self, indices):
+        """
+        Deletes samples: they are marked in a persisted tombstone bitmap, and are skipped by ``len`` and by all reads,
+        i.e. the samples after them move up. Their data stays in the data file until ``compact``.
+
+        :param indices: The indices of the samples (anything that ``get_multiple`` accepts).
+        """
+        if self._store.packed:
+            raise ValueError(f'"{self.out_dir}" is packed and read-only, unpack it first!')
+        indices = self._physical(numpy._normalize_indices(indices, len(self)))
+        tombstones._mark_deleted(self.out_dir, indices, len(self.starts))
+        self.__dict__.pop("_live", None)
+        self.__dict__.pop("offsets", None)
+
+    def compact(self):
+        """
+        Rewrites the container without the deleted samples and the dead bytes of updates (see ``dead_nbytes``).
+        The live samples are copied in order, with large sequential copies, into a staging directory, which is then
+        swapped with the container atomically. Other readers, which open all of their files on first use, keep reading
+        the version they opened until they reopen the container.
+        """
+        if self._store.packed or isinstance(self.memmap, compression.CompressedArray):
+            raise ValueError(f'"{self.out_dir}" is packed or compressed, unpack or decompress it first!')
+        if self.starts is None:
+            return
+        live = self._physical(np.arange(len(self)))
+        starts, ends = self._ranges(live)
+        lengths = np.asarray(ends, dtype=np.int64) - np.asarray(starts, dtype=np.int64)
+        new_ends = np.cumsum(lengths)
+        staging_dir = tombstones._staging_dir(self.out_dir)
+        if len(live) > 0:
+            itemsize = self.memmap.dtype.itemsize
+            with open(self.out_dir / "data.ninja", "rb") as src, open(staging_dir / "data.ninja", "wb") as dst:
+                tombstones._copy_ranges(src, dst, starts * itemsize, ends * itemsize)
+            numpy._save_mmap_kwargs(staging_dir, self.memmap.dtype, (int(new_ends[-1]),), "C")
+            if self.compact_offsets is not None:
+                CompactOffsets.save(staging_dir / OFFSETS_KEY, np.concatenate([[0], new_ends]))
+            else:
+                numpy.from_ndarray(staging_dir / self.starts_key, new_ends - lengths)
+                numpy.from_ndarray(staging_dir / self.ends_key, new_ends)
+                numpy.from_ndarray(staging_dir / self.flattened_shapes_key, lengths)
+            if self.shapes_are_flat:
+                numpy.from_ndarray(staging_dir / self.shapes_key, self.shapes[live])
+            elif isinstance(self.shapes, ShapesTable):
+                numpy.from_ndarray(staging_dir / self.shapes_key, self.shapes.table[live])
+            else:
+                numpy.from_ndarray(staging_dir / self.shapes_key, _shapes_table(self.shapes[live]))
+            tombstones._copy_metadata(self.out_dir, staging_dir)
+        else:
+            tombstones._copy_metadata(self.out_dir, staging_dir, skip=("shapes_are_flat.ninja",))
         self._reload_fields()
+        tombstones._swap_directories(staging_dir, self.out_dir)
+
+    def _extend_shapes_table(self, shapes: Sequence[Sequence[int]]) -> "ShapesTable":
+        table = self.shapes.table
+        rows = _shapes_table(shapes, max_ndim=table.shape[1] - 1)
+        if rows.shape[1] == table.shape[1]:
+            return ShapesTable(self._extend_field(self.shapes_key, rows))
+        return self._rewrite_shapes_table(np.concatenate([self._widen_shapes_table(rows.shape[1]), rows]))
+
+    def _widen_shapes_table(self, width: int) -> np.ndarray:
+        """
+        Returns a copy of the shapes table with ``width`` columns, when new samples have more dimensions
+        than any of the old ones (the whole table has to be rewritten then).
+        """
+        table = self.shapes.table
+        widened = np.zeros((len(table), width), dtype=np.int64)
+        widened[:, : table.shape[1]] = table
+        return widened
+
+    def _rewrite_shapes_table(self, table: np.ndarray) -> "ShapesTable":
+        growable = self._growables.pop(self.shapes_key, None)
+        if growable is not None:
+            growable.close()
+        del self.shapes
+        numpy.from_ndarray(self.out_dir / self.shapes_key, table)
+        return ShapesTable(self._open_field(self.shapes_key))
 
     def __repr__(self):
         base_repr = super().__repr__()
@@ -152,21 +743,35 @@ class RaggedMmap:
         ends_key="ends",
         shapes_key="shapes",
         flattened_shapes_key="flattened_shapes",
+        in_memory_index=False,
+        compact_index=False,
     ):
+        """
+        Creates a ``RaggedMmap`` from a list of samples.
+
+        :param out_dir: The output directory.
+        :param lists: The samples.
+        :param dtype: The dtype of the samples. If not provided, the dtype of the first sample will be used.
+        :param in_memory_index: Whether to load the index into RAM on first use (see ``InMemoryOffsets``).
+        :param compact_index: If ``True``, the starts, the ends and the number of elements of the samples are stored
+            as a single array of ``n + 1`` offsets, in the narrowest encoding which fits (see ``CompactOffsets``),
+            instead of three ``int64`` arrays.
+        :return: The ``RaggedMmap``.
+        """
         out_dir = Path(out_dir)
         out_dir.mkdir(exist_ok=True)
         numpy_bytes_slices = numpy._lists_of_ndarrays_to_bytes(lists, dtype)
-        numpy.from_ndarray(out_dir / starts_key, np.array(numpy_bytes_slices.starts, dtype=np.int64))
-        numpy.from_ndarray(out_dir / ends_key, np.array(numpy_bytes_slices.ends, dtype=np.int64))
-        shapes_are_flat = all([len(shape) == 1 for shape in numpy_bytes_slices.shapes])
-        base._int_to_file(int(shapes_are_flat), out_dir / "shapes_are_flat.ninja")
-
-        if shapes_are_flat:
-            numpy.from_ndarray(out_dir / shapes_key, numpy_bytes_slices.shapes)
-        else:
-            RaggedMmap.from_lists(out_dir / shapes_key, numpy_bytes_slices.shapes)
-        numpy.from_ndarray(
-            out_dir / flattened_shapes_key, np.array(numpy_bytes_slices.flattened_shapes, dtype=np.int64)
+        _save_index(
+            out_dir,
+            numpy_bytes_slices.starts,
+            numpy_bytes_slices.ends,
+            numpy_bytes_slices.shapes,
+            numpy_bytes_slices.flattened_shapes,
+            starts_key=starts_key,
+            ends_key=ends_key,
+            shapes_key=shapes_key,
+            flattened_shapes_key=flattened_shapes_key,
+            compact_index=compact_index,
         )
         numpy.from_ndarray(out_dir, np.array(numpy_bytes_slices.buffer))
         base._str_to_file("ragged", out_dir / "type.ninja")
@@ -178,21 +783,87 @@ class RaggedMmap:
             ends_key=ends_key,
             shapes_key=shapes_key,
             flattened_shapes_key=flattened_shapes_key,
+            in_memory_index=in_memory_index,
         )
 
     @classmethod
-    def from_generator(cls, out_dir: Union[str, Path], sample_generator, batch_size: int, verbose=False, **kwargs):
-        return base.from_generator_base(
-            out_dir=out_dir,
-            sample_generator=sample_generator,
-            batch_size=batch_size,
-            verbose=verbose,
-            batch_ctor=cls.from_lists,
-            **kwargs,
-        )
+    def from_generator(
+        cls,
+        out_dir: Union[str, Path],
+        sample_generator,
+        batch_size: int,
+        verbose=False,
+        dtype=None,
+        compact_index=False,
+        **kwargs,
+    ):
+        """
+        Creates a ``RaggedMmap`` from a generator of samples.
+
+        The samples are streamed straight to the data file with vectored writes, while the index is collected
+        in preallocated arrays of ``batch_size`` elements, so memory usage does not depend on ``batch_size``.
+
+        :param out_dir: The output directory.
+        :param sample_generator: The generator of samples.
+        :param batch_size: How often the index is flushed to disk.
+        :param verbose: Whether to show a progress bar.
+        :param dtype: The dtype of the samples. If not provided, the dtype of the first sample will be used.
+        :param compact_index: Whether to store the index as a single array of offsets (see ``from_lists``).
+        :param kwargs: Additional keyword arguments of the ``RaggedMmap`` (e.g. ``in_memory_index`` or the keys).
+        :return: The ``RaggedMmap``. If the generator is empty, an empty ``RaggedMmap`` of ``dtype``.
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(exist_ok=True)
+        if verbose:
+            from tqdm.auto import tqdm
+
+            sample_generator = tqdm(sample_generator)
+        samples = iter(sample_generator)
+        first = next(samples, None)
+        if first is None:
+            if dtype is None:
+                raise ValueError("The generator is empty, pass a dtype to create an empty RaggedMmap!")
+            samples = iter(())
+        else:
+            first = np.asarray(first, dtype=dtype)
+            samples = itertools.chain([first], samples)
+        keys = {key: kwargs.pop(key) for key in _INDEX_KEYS if key in kwargs}
+        kwargs.setdefault("mode", "r+")
+        item_dtype = np.dtype(dtype) if first is None else first.dtype
+        with _RaggedStreamWriter(out_dir, batch_size, item_dtype, compact_index=compact_index, **keys) as writer:
+            for sample in samples:
+                writer.write(sample)
+        return cls(out_dir=out_dir, **keys, **kwargs)
 
     @classmethod
-    def from_indexable(cls, out_dir: Union[str, Path], indexable, batch_size: int, n_jobs=None, verbose=False, **kwargs):
+    def from_indexable(
+        cls,
+        out_dir: Union[str, Path],
+        indexable,
+        batch_size: int,
+        n_jobs=None,
+        verbose=False,
+        direct_write=False,
+        **kwargs,
+    ):
+        """
+        Creates a ``RaggedMmap`` from an indexable object, where ``indexable[i]`` becomes ``memmap[i]``.
+
+        :param out_dir: The output directory.
+        :param indexable: An object that supports ``__getitem__`` or a function that takes one integer argument.
+        :param batch_size: The number of samples which are processed together.
+        :param n_jobs: The number of jobs to iterate through indexable with. ``None`` means no parallelization.
+        :param verbose: Whether to show a progress bar.
+        :param direct_write: If ``True``, the output is built in two phases: first the workers report the shapes
+            and the dtypes of the samples, so that the output can be preallocated, and then every worker writes
+            its samples directly into the memory mapped output. The samples never travel through the parent process,
+            but every sample is computed twice, so ``indexable`` must be deterministic and have a length.
+        :param kwargs: Additional keyword arguments to be passed to ``from_lists``
+            (and ``queue_depth``, see ``base.from_indexable_base``).
+        :return: The ``RaggedMmap``.
+        """
+        if direct_write:
+            return cls._from_indexable_direct(out_dir, indexable, batch_size, n_jobs, verbose, **kwargs)
         return base.from_indexable_base(
             out_dir=out_dir,
             indexable=indexable,
@@ -202,3 +873,331 @@ class RaggedMmap:
             batch_ctor=cls.from_lists,
             **kwargs,
         )
+
+    @classmethod
+    def _from_indexable_direct(
+        cls,
+        out_dir: Union[str, Path],
+        indexable,
+        batch_size: int,
+        n_jobs=None,
+        verbose=False,
+        dtype=None,
+        mode="r+",
+        wrapper_fn=None,
+        starts_key="starts",
+        ends_key="ends",
+        shapes_key="shapes",
+        flattened_shapes_key="flattened_shapes",
+        in_memory_index=False,
+        compact_index=False,
+    ):
+        indexable, length, _ = ParallelBatchCollector.verify(indexable, batch_size)
+        if length is None:
+            raise ValueError("direct_write=True requires an indexable with a length!")
+        if length == 0:
+            return None
+        out_dir = Path(out_dir)
+        out_dir.mkdir(exist_ok=True)
+        chunks = [range(start, min(start + batch_size, length)) for start in range(0, length, batch_size)]
+        parallel = ParallelBatchCollector.begin(n_jobs)
+        try:
+            descriptions = [
+                description
+                for chunk_descriptions in _run_jobs(parallel, _describe_samples, [(indexable, c) for c in chunks])
+                for description in chunk_descriptions
+            ]
+            if dtype is None:
+                dtype = descriptions[0][1]
+            shapes = [shape if len(shape) > 0 else (0,) for shape, _ in descriptions]
+            flattened_shapes = np.array([int(np.prod(shape)) for shape, _ in descriptions], dtype=np.int64)
+            ends = np.cumsum(flattened_shapes)
+            starts = ends - flattened_shapes
+            _save_index(
+                out_dir,
+                starts,
+                ends,
+                shapes,
+                flattened_shapes,
+                starts_key=starts_key,
+                ends_key=ends_key,
+                shapes_key=shapes_key,
+                flattened_shapes_key=flattened_shapes_key,
+                compact_index=compact_index,
+            )
+            if ends[-1] == 0:
+                # Every sample is empty, so there is nothing to write (and an empty file cannot be mapped).
+                numpy._save_mmap_kwargs(out_dir, dtype, (0,), "C")
+                open(out_dir / "data.ninja", "wb").close()
+                chunks = []
+            else:
+                numpy._empty(out_dir, dtype, (int(ends[-1]),), "C").flush()
+            jobs = [(indexable, out_dir, c, starts[c.start : c.stop], ends[c.start : c.stop], dtype) for c in chunks]
+            if verbose:
+                from tqdm.auto import tqdm
+
+                jobs = tqdm(jobs)
+            _run_jobs(parallel, _write_samples, jobs)
+        finally:
+            if parallel is not None:
+                parallel.__exit__(None, None, None)
+        base._str_to_file("ragged", out_dir / "type.ninja")
+        return cls(
+            out_dir=out_dir,
+            wrapper_fn=wrapper_fn,
+            mode=mode,
+            starts_key=starts_key,
+            ends_key=ends_key,
+            shapes_key=shapes_key,
+            flattened_shapes_key=flattened_shapes_key,
+            in_memory_index=in_memory_index,
+        )
+
+
+class ShapesTable:
+    """
+    The shapes of samples with more than one dimension, stored as a dense ``(n, 1 + max_ndim)`` integer array.
+    The first column holds the number of dimensions of every sample, and the rest of the row holds its shape,
+    padded with zeros. Looking up a shape reads a single row, and looking up many shapes is a single gather.
+    """
+
+    def __init__(self, table: np.ndarray):
+        self.table = table
+
+    @property
+    def ndims(self) -> np.ndarray:
+        return self.table[:, 0]
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, item):
+        if np.isscalar(item):
+            row = self.table[item].tolist()
+            return tuple(row[1 : 1 + row[0]])
+        return [tuple(row[1 : 1 + row[0]]) for row in self.table[item].tolist()]
+
+
+def _shapes_table(shapes: Sequence[Sequence[int]], max_ndim: int = 0) -> np.ndarray:
+    """
+    Builds the rows of a ``ShapesTable``, which are at least ``1 + max_ndim`` wide.
+    """
+    ndims = np.fromiter(map(len, shapes), dtype=np.int64, count=len(shapes))
+    values = np.fromiter(itertools.chain.from_iterable(shapes), dtype=np.int64, count=int(ndims.sum()))
+    return _shapes_table_from_values(ndims, values, max_ndim)
+
+
+def _shapes_table_from_values(ndims: np.ndarray, values: np.ndarray, max_ndim: int = 0) -> np.ndarray:
+    """
+    Builds the rows of a ``ShapesTable`` from the number of dimensions and the concatenated shapes of the samples.
+    """
+    max_ndim = max(max_ndim, int(ndims.max(initial=0)))
+    table = np.zeros((len(ndims), 1 + max_ndim), dtype=np.int64)
+    table[:, 0] = ndims
+    # The mask selects the first ndim cells of every row, in the same (row-major) order as the concatenated shapes.
+    table[:, 1:][np.arange(max_ndim) < ndims[:, None]] = values
+    return table
+
+
+# The number of index entries processed at once when the ranges are computed from the lengths.
+_RANGES_CHUNK = 1 << 20
+
+
+def _stream_ranges(lengths: np.ndarray, starts: numpy.GrowableMmap, ends: numpy.GrowableMmap) -> None:
+    """
+    Appends the starts and the ends of consecutive ranges with the given lengths, a chunk at a time.
+    """
+    offset = 0
+    for i in range(0, len(lengths), _RANGES_CHUNK):
+        chunk = np.asarray(lengths[i : i + _RANGES_CHUNK])
+        chunk_ends = offset + np.cumsum(chunk)
+        starts.extend(chunk_ends - chunk)
+        ends.extend(chunk_ends)
+        offset = int(chunk_ends[-1])
+
+
+_INDEX_KEYS = ("starts_key", "ends_key", "shapes_key", "flattened_shapes_key")
+
+
+class _RaggedStreamWriter:
+    """
+    Streams samples into a new ``RaggedMmap`` directory.
+
+    The data and the shapes go straight to their data files through ``numpy._VectoredWriter``,
+    while the number of elements and of dimensions of every sample are collected in preallocated arrays
+    of ``batch_size`` elements, which are appended to ``GrowableMmap`` objects whenever they are full.
+    The starts and the ends are computed from the number of elements when the writer is closed.
+    Since the shapes of the samples are not known in advance, the shapes are streamed concatenated, which is
+    the layout of flat shapes, and are turned into a ``ShapesTable`` on close if any sample is not flat.
+    """
+
+    def __init__(
+        self,
+        out_dir: Path,
+        batch_size: int,
+        dtype: np.dtype,
+        starts_key="starts",
+        ends_key="ends",
+        shapes_key="shapes",
+        flattened_shapes_key="flattened_shapes",
+        compact_index=False,
+    ):
+        self.out_dir = out_dir
+        self.dtype = dtype
+        self.compact_index = compact_index
+        self.starts_key = starts_key
+        self.ends_key = ends_key
+        self.shapes_key = shapes_key
+        self.flattened_shapes_key = flattened_shapes_key
+        self.shapes_dir = numpy._create_if_not_exists(out_dir / shapes_key)
+        self.length = 0
+        self.n_elements = 0
+        self.max_ndim = 0
+        self.shapes_are_flat = True
+        self._data = numpy._VectoredWriter(out_dir / "data.ninja", truncate=True)
+        self._shapes = numpy._VectoredWriter(self.shapes_dir / "data.ninja", truncate=True)
+        self._flattened_shapes = numpy.GrowableMmap.empty(out_dir / flattened_shapes_key, np.int64)
+        self._ndims = numpy.GrowableMmap.empty(out_dir / "_ndims", np.int64)
+        self._flattened_shapes_batch = np.empty(batch_size, dtype=np.int64)
+        self._ndims_batch = np.empty(batch_size, dtype=np.int64)
+        self._n_buffered = 0
+
+    def write(self, sample) -> None:
+        arr = np.asarray(sample, dtype=self.dtype)
+        shape = arr.shape if len(arr.shape) > 0 else (0,)
+        self._data.write(arr)
+        self._shapes.write(np.array(shape, dtype=np.int64))
+        self._flattened_shapes_batch[self._n_buffered] = arr.size
+        self._ndims_batch[self._n_buffered] = len(shape)
+        self._n_buffered += 1
+        self.length += 1
+        self.n_elements += arr.size
+        self.max_ndim = max(self.max_ndim, len(shape))
+        self.shapes_are_flat = self.shapes_are_flat and len(shape) == 1
+        if self._n_buffered == len(self._flattened_shapes_batch):
+            self.flush()
+
+    def flush(self) -> None:
+        self._data.flush()
+        self._shapes.flush()
+        self._flattened_shapes.extend(self._flattened_shapes_batch[: self._n_buffered])
+        self._ndims.extend(self._ndims_batch[: self._n_buffered])
+        self._n_buffered = 0
+
+    def _abort(self) -> None:
+        for writer in (self._data, self._shapes):
+            os.close(writer.fd)
+        for growable in (self._flattened_shapes, self._ndims):
+            growable.close()
+
+    def close(self) -> None:
+        self.flush()
+        self._data.close()
+        self._shapes.close()
+        numpy._save_mmap_kwargs(self.out_dir, self.dtype, (self.n_elements,), "C")
+        if self.shapes_are_flat:
+            numpy._save_mmap_kwargs(self.shapes_dir, np.int64, (self.length, 1), "C")
+        else:
+            self._build_shapes_table()
+        self._ndims.close()
+        shutil.rmtree(self.out_dir / "_ndims")
+        if self.compact_index:
+            # The samples are contiguous, so the ends are enough (see ``_save_index``).
+            ends = np.cumsum(self._flattened_shapes.array, dtype=np.int64)
+            CompactOffsets.save(self.out_dir / OFFSETS_KEY, np.concatenate([[0], ends]))
+            self._flattened_shapes.close()
+            shutil.rmtree(self.out_dir / self.flattened_shapes_key)
+        else:
+            starts = numpy.GrowableMmap.empty(self.out_dir / self.starts_key, np.int64)
+            ends = numpy.GrowableMmap.empty(self.out_dir / self.ends_key, np.int64)
+            _stream_ranges(self._flattened_shapes.array, starts, ends)
+            for growable in (starts, ends, self._flattened_shapes):
+                growable.close(trim=True)
+        base._int_to_file(int(self.shapes_are_flat), self.out_dir / "shapes_are_flat.ninja")
+        base._str_to_file("ragged", self.out_dir / "type.ninja")
+
+    def _build_shapes_table(self) -> None:
+        values_file = self.out_dir / "_shape_values.ninja"
+        os.replace(self.shapes_dir / "data.ninja", values_file)
+        values = np.memmap(values_file, dtype=np.int64, mode="r")
+        table = numpy.GrowableMmap.empty(self.shapes_dir, np.int64, sample_shape=(1 + self.max_ndim,))
+        offset = 0
+        for i in range(0, self.length, _RANGES_CHUNK):
+            ndims = np.asarray(self._ndims.array[i : i + _RANGES_CHUNK])
+            n_values = int(ndims.sum())
+            table.extend(_shapes_table_from_values(ndims, values[offset : offset + n_values], self.max_ndim))
+            offset += n_values
+        table.close(trim=True)
+        del values
+        values_file.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+
+
+def _save_index(
+    out_dir: Path,
+    starts: Sequence[int],
+    ends: Sequence[int],
+    shapes: Sequence[Sequence[int]],
+    flattened_shapes: Sequence[int],
+    starts_key="starts",
+    ends_key="ends",
+    shapes_key="shapes",
+    flattened_shapes_key="flattened_shapes",
+    compact_index=False,
+) -> None:
+    """
+    Persists everything of a ``RaggedMmap`` except for the data itself.
+    """
+    if compact_index:
+        # The samples are contiguous, so the starts and the number of elements are implied by the ends.
+        CompactOffsets.save(out_dir / OFFSETS_KEY, np.concatenate([[0], np.asarray(ends, dtype=np.int64)]))
+    else:
+        numpy.from_ndarray(out_dir / starts_key, np.array(starts, dtype=np.int64))
+        numpy.from_ndarray(out_dir / ends_key, np.array(ends, dtype=np.int64))
+    shapes_are_flat = all([len(shape) == 1 for shape in shapes])
+    base._int_to_file(int(shapes_are_flat), out_dir / "shapes_are_flat.ninja")
+
+    if shapes_are_flat:
+        numpy.from_ndarray(out_dir / shapes_key, np.array(shapes))
+    else:
+        numpy.from_ndarray(out_dir / shapes_key, _shapes_table(shapes))
+    if not compact_index:
+        numpy.from_ndarray(out_dir / flattened_shapes_key, np.array(flattened_shapes, dtype=np.int64))
+
+
+def _run_jobs(parallel, fn, jobs):
+    if parallel is None:
+        return [fn(*args) for args in jobs]
+    return parallel(delayed(fn)(*args) for args in jobs)
+
+
+def _describe_samples(indexable, indices):
+    """
+    Returns the shape and the dtype of every sample in ``indices`` (the first phase of ``direct_write``).
+    """
+    descriptions = []
+    for idx in indices:
+        arr = np.asarray(indexable[idx])
+        descriptions.append((arr.shape, arr.dtype.str))
+    return descriptions
+
+
+def _write_samples(indexable, out_dir, indices, starts, ends, dtype):
+    """
+    Writes the samples in ``indices`` into the preallocated output (the second phase of ``direct_write``).
+    """
+    memmap = numpy.open_existing(out_dir, mode="r+")
+    for idx, start, end in zip(indices, starts.tolist(), ends.tolist()):
+        flattened = np.asarray(indexable[idx], dtype=dtype).ravel()
+        if len(flattened) != end - start:
+            raise ValueError(f"Sample {idx} changed its size between the two phases, is the indexable deterministic?")
+        memmap[start:end] = flattened
+    memmap.flush()
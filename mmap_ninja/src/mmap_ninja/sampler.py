@@ -0,0 +1,90 @@
+from typing import Tuple, Optional
+
+import numpy as np
+
+
+def _byte_ranges(container) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns where every sample of ``container`` starts and ends, in bytes from the start of its data file.
+    The deleted samples are skipped, so the ranges are indexed by the (logical) indices of the live samples.
+    """
+    if isinstance(container, np.ndarray):
+        sample_nbytes = container.dtype.itemsize * int(np.prod(container.shape[1:], dtype=np.int64))
+        starts = np.arange(len(container), dtype=np.int64) * sample_nbytes
+        return starts, starts + sample_nbytes
+    if len(container) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    memmap = getattr(container, "memmap", None)
+    itemsize = 1 if memmap is None else memmap.dtype.itemsize
+    starts = np.asarray(container.starts, dtype=np.int64) * itemsize
+    ends = np.asarray(container.ends, dtype=np.int64) * itemsize
+    live = getattr(container, "_live", None)
+    if live is not None:
+        starts, ends = starts[live], ends[live]
+    return starts, ends
+
+
+class BlockShuffleSampler:
+    """
+    Produces a shuffled order of the samples of a container, which keeps the reads from disk large and sequential.
+
+    The samples are grouped into blocks of samples which are stored next to each other and span roughly
+    ``block_nbytes`` bytes. Every epoch, the order of the blocks is shuffled, then the samples are shuffled
+    within windows of ``window_blocks`` consecutive (shuffled) blocks. Every sample appears exactly once per epoch.
+    The order is deterministic for a given ``seed`` and epoch.
+
+    Works with ``RaggedMmap``, ``StringsMmap`` and Numpy memmaps.
+    """
+
+    def __init__(self, container, block_nbytes: int = 4 * 1024 * 1024, window_blocks: int = 4, seed: int = 0):
+        """
+        :param container: The container to sample from.
+        :param block_nbytes: The approximate size of a block, in bytes.
+        :param window_blocks: The number of blocks which are shuffled together.
+        :param seed: The seed of the random number generator.
+        """
+        if block_nbytes < 1:
+            raise ValueError(f"block_nbytes should be positive, got {block_nbytes}!")
+        if window_blocks < 1:
+            raise ValueError(f"window_blocks should be positive, got {window_blocks}!")
+        self.block_nbytes = block_nbytes
+        self.window_blocks = window_blocks
+        self.seed = seed
+        self.epoch = 0
+        starts, ends = _byte_ranges(container)
+        # Sort by position, so that the blocks are contiguous on disk, even if the samples are not stored in order.
+        self._order = np.argsort(starts, kind="stable")
+        block_ids = starts[self._order] // block_nbytes
+        self._block_bounds = np.flatnonzero(np.diff(block_ids, prepend=-1, append=-1))
+        self.n_blocks = max(len(self._block_bounds) - 1, 0)
+
+    def set_epoch(self, epoch: int):
+        """
+        Sets the epoch, which is used (together with the seed) to produce the order in ``__iter__``.
+        """
+        self.epoch = epoch
+
+    def indices(self, epoch: Optional[int] = None) -> np.ndarray:
+        """
+        Returns the order of the samples for an epoch.
+
+        :param epoch: The epoch (defaults to the one passed to ``set_epoch``).
+        :return: A permutation of the sample indices.
+        """
+        epoch = self.epoch if epoch is None else epoch
+        rng = np.random.default_rng([self.seed, epoch])
+        block_sizes = np.diff(self._block_bounds)
+        block_order = rng.permutation(self.n_blocks)
+        # For every sample, the position of its block in the shuffled order.
+        block_rank = np.empty(self.n_blocks, dtype=np.int64)
+        block_rank[block_order] = np.arange(self.n_blocks)
+        sample_rank = np.repeat(block_rank, block_sizes)
+        window = sample_rank // self.window_blocks
+        order = np.lexsort((rng.random(len(sample_rank)), window))
+        return self._order[order]
+
+    def __iter__(self):
+        return iter(self.indices().tolist())
+
+    def __len__(self):
+        return len(self._order)
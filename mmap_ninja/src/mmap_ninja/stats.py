@@ -0,0 +1,237 @@
+import ctypes
+import ctypes.util
+import mmap
+import threading
+from collections import Counter
+from time import perf_counter_ns
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+# Latencies are counted in power-of-two buckets of nanoseconds: bucket ``i`` holds the calls which took
+# ``[2 ** i, 2 ** (i + 1))`` nanoseconds (bucket ``0`` also holds the ones below 1 ns).
+N_BUCKETS = 40
+
+
+def _load_mincore():
+    try:
+        mincore = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).mincore
+    except (OSError, AttributeError, TypeError):
+        return None
+    mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    mincore.restype = ctypes.c_int
+    return mincore
+
+
+_mincore = _load_mincore()
+
+
+def resident_pages(address: int, nbytes: int) -> Optional[Tuple[int, int]]:
+    """
+    Checks which pages of a memory range are in RAM, using ``mincore``.
+
+    :param address: The start of the range.
+    :param nbytes: The length of the range.
+    :return: The number of resident pages and the number of pages of the range,
+        or ``None`` if ``mincore`` is not available or fails.
+    """
+    if _mincore is None:
+        return None
+    first_page = address - address % mmap.PAGESIZE
+    n_pages = max((address + nbytes - first_page + mmap.PAGESIZE - 1) // mmap.PAGESIZE, 1)
+    vec = np.zeros(n_pages, dtype=np.uint8)
+    if _mincore(first_page, n_pages * mmap.PAGESIZE, vec.ctypes.data) != 0:
+        return None
+    return int(np.count_nonzero(vec & 1)), n_pages
+
+
+class Histogram:
+    """
+    A latency histogram with power-of-two buckets, which records a value in O(1).
+    """
+
+    def __init__(self):
+        self.buckets = [0] * N_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+
+    def record(self, ns: int) -> None:
+        self.buckets[min(max(ns.bit_length() - 1, 0), N_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += ns
+
+    def percentile(self, q: float) -> Optional[int]:
+        """
+        Returns the upper bound (in nanoseconds) of the bucket which contains the ``q``-th percentile.
+        """
+        if self.count == 0:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                return 2 ** (i + 1)
+        return 2**N_BUCKETS
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "total_ns": self.total_ns,
+            "mean_ns": self.total_ns / self.count if self.count else None,
+            "p50_ns": self.percentile(50),
+            "p99_ns": self.percentile(99),
+            # Only the non-empty buckets, keyed by their upper bound in nanoseconds.
+            "buckets": {2 ** (i + 1): n for i, n in enumerate(self.buckets) if n > 0},
+        }
+
+
+class AccessStats:
+    """
+    Collects the statistics of an instrumented container: the number of calls per method, of samples and of bytes,
+    a latency histogram per phase of a call (e.g. ``"index"``, ``"data"`` and ``"wrapper_fn"``), and how many
+    of the touched pages were already in RAM, sampled with ``mincore`` once every ``residency_every`` calls.
+
+    Every ``report_every`` calls, ``callback`` is called with a snapshot (see ``snapshot``).
+    """
+
+    def __init__(
+        self,
+        callback: Optional[Callable[[Dict], None]] = None,
+        report_every: int = 1000,
+        residency_every: int = 100,
+    ):
+        """
+        :param callback: Called with a snapshot of the statistics every ``report_every`` calls.
+        :param report_every: How often (in calls) ``callback`` is called.
+        :param residency_every: How often (in calls) the page residency of the touched data is sampled
+            (``0`` disables the sampling).
+        """
+        if report_every < 1:
+            raise ValueError(f"report_every should be at least 1, got {report_every}!")
+        if residency_every < 0:
+            raise ValueError(f"residency_every should not be negative, got {residency_every}!")
+        self.callback = callback
+        self.report_every = report_every
+        self.residency_every = residency_every
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = Counter()
+            self.n_samples = 0
+            self.n_bytes = 0
+            self.latencies: Dict[str, Histogram] = {}
+            self.resident_pages = 0
+            self.sampled_pages = 0
+            self._n_calls = 0
+
+    def sample_residency(self) -> bool:
+        """
+        Whether the current call should sample the page residency (called once per call, before ``record``).
+        """
+        return self.residency_every > 0 and self._n_calls % self.residency_every == 0
+
+    def record_residency(self, address: int, nbytes: int) -> None:
+        pages = resident_pages(address, nbytes)
+        if pages is not None:
+            with self._lock:
+                self.resident_pages += pages[0]
+                self.sampled_pages += pages[1]
+
+    def record(self, method: str, n_samples: int, n_bytes: int, phases: Tuple[Tuple[str, int], ...]) -> None:
+        """
+        Records one call.
+
+        :param method: The name of the method, e.g. ``"get_single"``.
+        :param n_samples: The number of samples returned by the call.
+        :param n_bytes: The number of bytes read from the container.
+        :param phases: The name and the duration (in nanoseconds) of every phase of the call.
+        """
+        with self._lock:
+            self.calls[method] += 1
+            self.n_samples += n_samples
+            self.n_bytes += n_bytes
+            total_ns = 0
+            for phase, ns in phases:
+                total_ns += ns
+                histogram = self.latencies.get(phase)
+                if histogram is None:
+                    histogram = self.latencies[phase] = Histogram()
+                histogram.record(ns)
+            if "total" not in self.latencies:
+                self.latencies["total"] = Histogram()
+            self.latencies["total"].record(total_ns)
+            self._n_calls += 1
+            report = self.callback is not None and self._n_calls % self.report_every == 0
+        if report:
+            self.callback(self.snapshot())
+
+    def snapshot(self) -> Dict:
+        """
+        :return: A dictionary with the calls per method, the number of samples and bytes, the latency histograms
+            per phase and the fraction of the sampled pages which were resident (``None`` if nothing was sampled).
+        """
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "n_samples": self.n_samples,
+                "n_bytes": self.n_bytes,
+                "latencies": {phase: histogram.snapshot() for phase, histogram in self.latencies.items()},
+                "resident_pages": self.resident_pages,
+                "sampled_pages": self.sampled_pages,
+                "residency": self.resident_pages / self.sampled_pages if self.sampled_pages else None,
+            }
+
+
+def _nbytes(sample) -> int:
+    if isinstance(sample, np.ndarray):
+        return sample.nbytes
+    if isinstance(sample, (bytes, str)):
+        return len(sample)
+    return 0
+
+
+class Instrumented:
+    """
+    Records the ``__getitem__`` calls of any container (e.g. a numpy memory map from ``np_open_existing``),
+    as a single ``"data"`` phase. Every other attribute is forwarded to the container.
+    ``RaggedMmap``, ``StringsMmap`` and ``Wrapped`` have ``enable_stats``, which also times the phases of a call.
+    """
+
+    def __init__(self, container, recorder: AccessStats):
+        self.container = container
+        self.recorder = recorder
+
+    def __getitem__(self, item):
+        recorder = self.recorder
+        start_t = perf_counter_ns()
+        res = self.container[item]
+        data_ns = perf_counter_ns() - start_t
+        if recorder.sample_residency() and isinstance(res, np.ndarray) and res.nbytes > 0:
+            recorder.record_residency(res.ctypes.data, res.nbytes)
+        n_samples = 1 if np.isscalar(item) else len(res)
+        recorder.record("__getitem__", n_samples, _nbytes(res), (("data", data_ns),))
+        return res
+
+    def __len__(self):
+        return len(self.container)
+
+    def __getattr__(self, name):
+        return getattr(self.container, name)
+
+    def stats(self) -> Dict:
+        return self.recorder.snapshot()
+
+
+def instrument(container, callback: Optional[Callable[[Dict], None]] = None, **kwargs) -> Instrumented:
+    """
+    Wraps a container, so that its ``__getitem__`` calls are recorded (see ``Instrumented`` and ``AccessStats``).
+
+    :param container: The container, e.g. a numpy memory map.
+    :param callback: Called with a snapshot of the statistics every ``report_every`` calls.
+    :param kwargs: Additional keyword arguments for ``AccessStats``.
+    :return: The instrumented container, whose ``stats()`` returns a snapshot of the statistics.
+    """
+    return Instrumented(container, AccessStats(callback=callback, **kwargs))
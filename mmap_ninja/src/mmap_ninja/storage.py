@@ -0,0 +1,300 @@
+"""
+Readers for the two on-disk layouts of ``mmap_ninja`` containers.
+
+The directory layout stores every array in its own directory, described by small ``*.ninja`` files.
+The packed layout stores everything in a single ``packed.ninja`` file: a fixed-size header, a JSON manifest
+with the contents of the small files and the location of every ``data.ninja``, followed by the data segments.
+Packed containers cannot grow, but in-place writes still work. Use ``pack`` and ``unpack`` to convert between the two.
+"""
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Union, Optional, Tuple, BinaryIO
+
+import numpy as np
+
+from mmap_ninja import base, numpy as np_ninja
+
+PACKED_FILE = "packed.ninja"
+PACKED_VERSION = 1
+_MAGIC = b"NINJAPAK"
+# magic, version, number of bytes of the manifest, offset of the first data segment
+_HEADER = struct.Struct("<8sIIQ")
+_READ_AHEAD = 64 * 1024
+_COPY_CHUNK = 16 * 1024 * 1024
+
+
+def _align(offset: int, alignment: int = mmap.ALLOCATIONGRANULARITY) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _join(key: str, name: str) -> str:
+    return f"{key}/{name}" if key else name
+
+
+class _EmptySegment(bytes):
+    """
+    The contents of an empty data segment, which cannot be memory-mapped: ``mmap`` refuses to map an empty file,
+    and maps until the end of the file when it is given a length of ``0``.
+    """
+
+    def close(self) -> None:
+        pass
+
+
+def map_segment(file: BinaryIO, offset: int, nbytes: int, access=mmap.ACCESS_DEFAULT):
+    """
+    Maps ``nbytes`` bytes of ``file``, starting at ``offset`` (see ``open_file``).
+
+    :return: The ``mmap.mmap``, or an empty ``bytes`` object (with a no-op ``close``) if ``nbytes`` is ``0``.
+    """
+    if nbytes == 0:
+        return _EmptySegment()
+    return mmap.mmap(file.fileno(), nbytes, offset=offset, access=access)
+
+
+class DirectoryStore:
+    """
+    Reads a container persisted in the original layout, where every array lives in its own directory.
+    """
+
+    packed = False
+
+    def __init__(self, out_dir: Union[str, Path]):
+        self.out_dir = Path(out_dir)
+
+    def exists(self, name: str) -> bool:
+        return (self.out_dir / name).exists()
+
+    def read_bytes(self, name: str) -> bytes:
+        with open(self.out_dir / name, "rb") as in_file:
+            return in_file.read()
+
+    def open_array(self, key: str = "", mode="r") -> np.memmap:
+        return np_ninja.open_existing(self.out_dir / key, mode=mode)
+
+    def open_file(self, key: str = "", mode="rb") -> Tuple[BinaryIO, int, int]:
+        """
+        Opens the ``data.ninja`` file of ``key``.
+
+        :return: The open file, the offset at which the data starts and its length.
+        """
+        file = open(self.out_dir / key / "data.ninja", mode)
+        return file, 0, os.fstat(file.fileno()).st_size
+
+    def child(self, key: str) -> "DirectoryStore":
+        return DirectoryStore(self.out_dir / key)
+
+
+class PackedStore:
+    """
+    Reads a container persisted in the packed, single-file layout.
+    """
+
+    packed = True
+
+    def __init__(self, path: Path, manifest: dict, data_offset: int, prefix: str = ""):
+        self.path = path
+        self.manifest = manifest
+        self.data_offset = data_offset
+        self.prefix = prefix
+        self.out_dir = path.parent / prefix if prefix else path.parent
+
+    @classmethod
+    def open(cls, out_dir: Union[str, Path]) -> Optional["PackedStore"]:
+        """
+        Reads the header and the manifest of ``out_dir / "packed.ninja"``.
+
+        :param out_dir: The directory of the container.
+        :return: The store, or ``None`` if the container is not packed.
+        """
+        path = Path(out_dir) / PACKED_FILE
+        try:
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        except FileNotFoundError:
+            return None
+        try:
+            head = os.read(fd, _READ_AHEAD)
+            if len(head) < _HEADER.size:
+                raise ValueError(f'"{path}" is too short to be a packed mmap_ninja file!')
+            magic, version, manifest_nbytes, data_offset = _HEADER.unpack_from(head)
+            if magic != _MAGIC:
+                raise ValueError(f'"{path}" is not a packed mmap_ninja file!')
+            if version > PACKED_VERSION:
+                raise ValueError(f'"{path}" has version {version}, but at most {PACKED_VERSION} is supported!')
+            manifest_end = _HEADER.size + manifest_nbytes
+            while len(head) < manifest_end:
+                chunk = os.read(fd, manifest_end - len(head))
+                if not chunk:
+                    raise ValueError(f'"{path}" is truncated!')
+                head += chunk
+        finally:
+            os.close(fd)
+        manifest = json.loads(head[_HEADER.size : manifest_end])
+        return cls(path, manifest, data_offset)
+
+    def _name(self, name: str) -> str:
+        return _join(self.prefix, name)
+
+    def exists(self, name: str) -> bool:
+        name = self._name(name)
+        return name in self.manifest["files"] or name in self.manifest["segments"]
+
+    def read_bytes(self, name: str) -> bytes:
+        try:
+            return bytes.fromhex(self.manifest["files"][self._name(name)])
+        except KeyError:
+            raise FileNotFoundError(f'"{name}" not found in "{self.path}"!') from None
+
+    def _segment(self, key: str) -> Tuple[int, int]:
+        offset, nbytes = self.manifest["segments"][self._name(_join(key, "data.ninja"))]
+        return self.data_offset + offset, nbytes
+
+    def open_array(self, key: str = "", mode="r") -> np.memmap:
+        """
+        Maps the array ``key``. It pickles as the path of the packed file and the key, not as its contents.
+        """
+        offset, _ = self._segment(key)
+        memmap = np.memmap(
+            str(self.path),
+            mode=mode,
+            offset=offset,
+            dtype=base._bytes_to_str(self.read_bytes(_join(key, "dtype.ninja"))),
+            shape=base._bytes_to_shape(self.read_bytes(_join(key, "shape.ninja"))),
+            order=base._bytes_to_str(self.read_bytes(_join(key, "order.ninja"))),
+        )
+        return np_ninja._reopenable(memmap, _open_packed_array, str(self.path.parent), self.prefix, key, mode=mode)
+
+    def open_file(self, key: str = "", mode="rb") -> Tuple[BinaryIO, int, int]:
+        offset, nbytes = self._segment(key)
+        return open(self.path, mode), offset, nbytes
+
+    def child(self, key: str) -> "PackedStore":
+        return PackedStore(self.path, self.manifest, self.data_offset, self._name(key))
+
+
+def _open_packed_array(out_dir: str, prefix: str, key: str, mode: str) -> np.memmap:
+    """
+    Reopens an array of a packed container (the inverse of pickling ``PackedStore.open_array``).
+    """
+    store = PackedStore.open(out_dir)
+    if store is None:
+        raise FileNotFoundError(f'"{out_dir}" is not a packed container!')
+    if prefix:
+        store = store.child(prefix)
+    return store.open_array(key, mode=mode)
+
+
+def open_store(out_dir: Union[str, Path, DirectoryStore, PackedStore]) -> Union[DirectoryStore, PackedStore]:
+    """
+    Returns the store for the layout in which ``out_dir`` is persisted.
+
+    :param out_dir: The directory of the container (or an already opened store, which is returned as is).
+    :return: A ``PackedStore`` if ``out_dir`` contains a ``packed.ninja`` file, otherwise a ``DirectoryStore``.
+    """
+    if isinstance(out_dir, (DirectoryStore, PackedStore)):
+        return out_dir
+    packed_store = PackedStore.open(out_dir)
+    if packed_store is not None:
+        return packed_store
+    return DirectoryStore(out_dir)
+
+
+def _data_nbytes(data_file: Path) -> int:
+    """
+    The number of valid bytes in a ``data.ninja`` file, which may be smaller than the file (see ``GrowableMmap``).
+    """
+    if not (data_file.parent / "dtype.ninja").exists():
+        return data_file.stat().st_size
+    kwargs = np_ninja._read_mmap_kwargs(data_file.parent)
+    return int(np.prod(kwargs["shape"], dtype=np.int64)) * np.dtype(kwargs["dtype"]).itemsize
+
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, nbytes: int) -> None:
+    while nbytes > 0:
+        chunk = src.read(min(nbytes, _COPY_CHUNK))
+        if not chunk:
+            raise ValueError("Unexpected end of file while copying!")
+        dst.write(chunk)
+        nbytes -= len(chunk)
+
+
+def pack(in_dir: Union[str, Path], out_dir: Optional[Union[str, Path]] = None) -> Path:
+    """
+    Converts a container from the directory layout to the packed, single-file layout.
+
+    :param in_dir: The directory of the container.
+    :param out_dir: Where to write the packed container. If ``None``, the container is converted in place.
+    :return: The path to the ``packed.ninja`` file.
+    """
+    in_dir = Path(in_dir)
+    if (in_dir / PACKED_FILE).exists():
+        raise ValueError(f'"{in_dir}" is already packed!')
+    if any(in_dir.rglob("compressed/codec.ninja")):
+        raise ValueError(f'"{in_dir}" is compressed and cannot be packed, decompress it first!')
+    out_dir = in_dir if out_dir is None else np_ninja._create_if_not_exists(out_dir)
+    paths = sorted(p for p in in_dir.rglob("*") if p.is_file())
+    files = {}
+    segments = {}
+    data_files = []
+    data_nbytes = 0
+    for path in paths:
+        name = path.relative_to(in_dir).as_posix()
+        if path.name != "data.ninja":
+            files[name] = path.read_bytes().hex()
+            continue
+        nbytes = _data_nbytes(path)
+        segments[name] = [data_nbytes, nbytes]
+        data_files.append((path, nbytes))
+        data_nbytes = _align(data_nbytes + nbytes)
+    manifest = json.dumps({"files": files, "segments": segments}).encode("utf-8")
+    data_offset = _align(_HEADER.size + len(manifest))
+
+    tmp_path = out_dir / f"{PACKED_FILE}.tmp"
+    with open(tmp_path, "wb") as out_file:
+        out_file.write(_HEADER.pack(_MAGIC, PACKED_VERSION, len(manifest), data_offset))
+        out_file.write(manifest)
+        for (path, nbytes), (offset, _) in zip(data_files, segments.values()):
+            out_file.seek(data_offset + offset)
+            with open(path, "rb") as in_file:
+                _copy_range(in_file, out_file, nbytes)
+        out_file.truncate(data_offset + data_nbytes)
+    os.replace(tmp_path, out_dir / PACKED_FILE)
+    if out_dir == in_dir:
+        # The packed file takes precedence from now on, so the loose files can be removed safely.
+        for path in paths:
+            path.unlink()
+        for path in sorted((p for p in in_dir.rglob("*") if p.is_dir()), reverse=True):
+            path.rmdir()
+    return out_dir / PACKED_FILE
+
+
+def unpack(in_dir: Union[str, Path], out_dir: Optional[Union[str, Path]] = None) -> Path:
+    """
+    Converts a container from the packed, single-file layout back to the directory layout.
+
+    :param in_dir: The directory of the packed container.
+    :param out_dir: Where to write the unpacked container. If ``None``, the container is converted in place.
+    :return: The directory of the unpacked container.
+    """
+    in_dir = Path(in_dir)
+    store = PackedStore.open(in_dir)
+    if store is None:
+        raise ValueError(f'"{in_dir}" is not packed!')
+    out_dir = in_dir if out_dir is None else np_ninja._create_if_not_exists(out_dir)
+    for name, content in store.manifest["files"].items():
+        path = out_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(bytes.fromhex(content))
+    with open(store.path, "rb") as in_file:
+        for name, (offset, nbytes) in store.manifest["segments"].items():
+            path = out_dir / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            in_file.seek(store.data_offset + offset)
+            with open(path, "wb") as out_file:
+                _copy_range(in_file, out_file, nbytes)
+    if out_dir == in_dir:
+        store.path.unlink()
+    return out_dir
@@ -1,11 +1,19 @@
 import mmap
+import re
+from functools import cached_property
 from pathlib import Path
-from typing import Sequence, Union
+from time import perf_counter_ns
+from typing import Callable, Iterable, Optional, Sequence, Union
 
 import numpy as np
 
-from mmap_ninja import base, numpy
+from mmap_ninja import aio, base, compression, numpy, storage, tombstones
 from mmap_ninja.base import _bytes_to_str, _str_to_bytes, _sequence_of_strings_to_bytes
+from mmap_ninja.hash_index import HashIndex, HASH_INDEX_KEY
+from mmap_ninja.offsets import InMemoryOffsets, CompactOffsets, OffsetsView, OFFSETS_KEY
+from mmap_ninja.offsets import _add_dead_nbytes, _last_occurrences, _plan_updates, read_dead_nbytes
+from mmap_ninja.parallel import ParallelBatchCollector, delayed
+from mmap_ninja.stats import AccessStats
 
 
 class StringsMmap:
@@ -15,34 +23,404 @@ class StringsMmap:
         mode="r+b",
         starts_key="starts",
         ends_key="ends",
+        in_memory_index=False,
     ):
-        out_dir = Path(out_dir)
-        out_dir.mkdir(exist_ok=True)
+        self._store = storage.open_store(out_dir)
+        out_dir = self._store.out_dir
+        if not self._store.packed:
+            out_dir.mkdir(exist_ok=True)
         data_file = out_dir / "data.ninja"
         self.data_file = Path(data_file)
         self.mode = mode
         self.out_dir = out_dir
         self.starts_key = starts_key
         self.ends_key = ends_key
+        self.in_memory_index = in_memory_index
 
-        self.starts = None
-        self.ends = None
-        self.range = None
-        self.file = None
-        self.buffer = None
+        self.advice = None
+        self._data_offset = 0
+        self._data_length = 0
+        self._growables = {}
+        self._async_reader = None
+        self._recorder = None
+        self._opening = False
+        base._register_for_fork(self)
 
-        if (self.out_dir / self.starts_key / "dtype.ninja").exists():
-            self._reload_fields()
+    def __getstate__(self):
+        # Only the arguments of the constructor are pickled, the files are reopened lazily after unpickling.
+        return dict(
+            out_dir=str(self.out_dir),
+            mode=self.mode,
+            starts_key=self.starts_key,
+            ends_key=self.ends_key,
+            in_memory_index=self.in_memory_index,
+            advice=self.advice,
+        )
+
+    def __setstate__(self, state):
+        state = dict(state)
+        advice = state.pop("advice")
+        self.__init__(**state)
+        if advice is not None:
+            self.advise(advice)
+
+    # The persisted arrays and the data file are opened lazily on first use (the arrays are ``None``
+    # while the StringsMmap is empty), so that opening a StringsMmap costs the same regardless of its length.
+    _lazy_fields = ("compact_offsets", "starts", "ends", "offsets", "buffer", "file", "hash_index", "_live")
+
+    def _open_all(self):
+        """
+        Opens all of the persisted fields together, on the first use of any of them (see ``base._snapshot_field``).
+        The in-memory index is loaded later, from the opened fields.
+        """
+        if self._opening:
+            return
+        self._opening = True
+        try:
+            for name in ("compact_offsets", "starts", "ends", "_live", "hash_index"):
+                getattr(self, name)
+            if self.starts is not None:
+                getattr(self, "buffer")
+        finally:
+            self._opening = False
+
+    def _open_field(self, key):
+        arr = self._store.open_array(key, mode="r")
+        if self.advice is not None:
+            numpy.advise(arr, self.advice)
+        return arr
+
+    @base._snapshot_field
+    def compact_offsets(self):
+        """
+        The single offsets array of a StringsMmap created with ``compact_index=True`` (``None`` otherwise).
+        """
+        if not self._store.exists(f"{OFFSETS_KEY}/dtype.ninja"):
+            return None
+        return CompactOffsets.open(self._store, OFFSETS_KEY)
+
+    @base._snapshot_field
+    def starts(self):
+        if self.compact_offsets is not None:
+            return OffsetsView(self.compact_offsets, "starts")
+        if not self._store.exists(f"{self.starts_key}/dtype.ninja"):
+            return None
+        return self._open_field(self.starts_key)
+
+    @base._snapshot_field
+    def ends(self):
+        if self.compact_offsets is not None:
+            return OffsetsView(self.compact_offsets, "ends")
+        if self.starts is None:
+            return None
+        return self._open_field(self.ends_key)
+
+    @cached_property
+    def offsets(self):
+        """
+        The in-memory index (only if ``in_memory_index=True``).
+        """
+        if not self.in_memory_index or self.starts is None:
+            return None
+        return InMemoryOffsets(self.starts, self.ends)
+
+    @base._snapshot_field
+    def hash_index(self) -> Optional[HashIndex]:
+        """
+        The exact-match index of the strings (``None`` unless it was built with ``build_hash_index``).
+        """
+        return HashIndex.open(self._store)
+
+    @base._snapshot_field
+    def _live(self) -> Optional[np.ndarray]:
+        """
+        The (physical) indices of the strings which are not deleted, or ``None`` if no string is deleted.
+        The public methods take the position of a string among the live ones, and map it with ``_physical``.
+        """
+        if self.starts is None:
+            return None
+        return tombstones._live_rows(self._store, len(self.starts))
+
+    def _physical(self, indices: np.ndarray) -> np.ndarray:
+        return indices if self._live is None else self._live[indices]
+
+    def _logical(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Maps physical indices back to positions among the live strings (``-1`` for deleted strings).
+        """
+        if self._live is None:
+            return indices
+        positions = np.searchsorted(self._live, indices)
+        found = self._live[np.minimum(positions, len(self._live) - 1)] == indices
+        return np.where(found, positions, -1)
+
+    @base._snapshot_field
+    def file(self):
+        file, self._data_offset, self._data_length = self._store.open_file(mode=self.mode)
+        return file
+
+    @base._snapshot_field
+    def buffer(self):
+        if not self._store.packed and compression.is_compressed(self.out_dir):
+            return compression.CompressedBuffer(self.out_dir)
+        access = mmap.ACCESS_READ if self.mode == 'rb' else mmap.ACCESS_DEFAULT
+        buffer = storage.map_segment(self.file, self._data_offset, self._data_length, access=access)
+        if self.advice is not None and isinstance(buffer, mmap.mmap):
+            numpy.advise(buffer, self.advice)
+        return buffer
+
+    def _release_buffer(self):
+        """
+        Unmaps the data before it is appended to. The file is reopened too, since its length is read when it is opened.
+        """
+        for name in ("buffer", "file"):
+            handle = self.__dict__.pop(name, None)
+            if handle is not None:
+                handle.close()
+
+    def advise(self, pattern: str):
+        """
+        Tells the kernel how the strings will be accessed (see ``numpy.advise``).
+        The advice applies to the data and to the index arrays, including the ones which are mapped later on.
+
+        :param pattern: One of ``"normal"``, ``"sequential"``, ``"random"``, ``"willneed"``, ``"dontneed"``
+            or ``"hugepage"``.
+        """
+        numpy._madvise_flag(pattern)
+        self.advice = pattern
+        for name in ("starts", "ends", "buffer"):
+            field = self.__dict__.get(name)
+            if field is not None:
+                numpy.advise(field, pattern)
+        for growable in self._growables.values():
+            growable.advise(pattern)
+
+    def willneed(self, indices):
+        """
+        Asks the kernel to prefetch the strings, which will be accessed soon.
+
+        :param indices: The indices of the strings (anything that ``__getitem__`` accepts, except for scalars).
+        """
+        indices = self._physical(numpy._normalize_indices(indices, len(self)))
+        flag = numpy._madvise_flag("willneed")
+        if len(indices) == 0 or flag is None or not isinstance(self.buffer, mmap.mmap):
+            return
+        starts, ends = self._ranges(indices)
+        numpy._madvise_ranges(self.buffer, starts, ends, flag)
+
+    def _ranges(self, indices: np.ndarray):
+        """
+        Vectorized lookup of the starts and the ends of the strings at the (normalized) ``indices``.
+        """
+        if self.offsets is not None:
+            return self.offsets.lookup(indices)
+        return self.starts[indices], self.ends[indices]
 
     def get_multiple(self, item):
-        indices = self.range[item]
+        indices = numpy._normalize_indices(item, len(self))
         return [self.__getitem__(idx) for idx in indices]
 
+    def _read_plan(self, indices: np.ndarray):
+        """
+        Returns the byte ranges of the strings in the data file and a function, which turns the bytes
+        of the ``k``-th range into the string (used by ``aio.AsyncReader``), or ``None`` if the data is compressed.
+        """
+        if not isinstance(self.buffer, mmap.mmap):
+            return None
+        starts, ends = self._ranges(self._physical(indices))
+        return starts, ends, lambda k, buffer: _bytes_to_str(buffer)
+
+    def async_reader(self, max_concurrency: int = 8, coalesce_gap: int = 64 * 1024) -> "aio.AsyncReader":
+        """
+        Configures the reader behind ``aget`` and ``aget_many`` (see ``aio.AsyncReader``).
+
+        :param max_concurrency: The maximum number of index lookups and reads which run at the same time.
+        :param coalesce_gap: The maximum number of unused bytes between two strings, which are read together.
+        :return: The ``AsyncReader``.
+        """
+        if self._async_reader is not None:
+            self._async_reader.close()
+        self._async_reader = aio.AsyncReader(self, max_concurrency=max_concurrency, coalesce_gap=coalesce_gap)
+        return self._async_reader
+
+    async def aget(self, item):
+        """
+        The asynchronous counterpart of ``__getitem__``, which does not block the event loop on page faults.
+        """
+        if self._async_reader is None:
+            self.async_reader()
+        return await self._async_reader.aget(item)
+
+    async def aget_many(self, indices) -> list:
+        """
+        The asynchronous counterpart of ``get_multiple``. Concurrent requests for nearby strings are read together.
+        """
+        if self._async_reader is None:
+            self.async_reader()
+        return await self._async_reader.aget_many(indices)
+
     def get_single(self, item):
+        if self._live is not None:
+            item = self._live[item]
+        if self.offsets is not None:
+            return _bytes_to_str(self.buffer[self.offsets.starts[item] : self.offsets.ends[item]])
         start = self.starts[item]
         end = self.ends[item]
         return _bytes_to_str(self.buffer[start:end])
 
+    def _get_bytes(self, idx: int) -> bytes:
+        return self.buffer[self.starts[idx] : self.ends[idx]]
+
+    def build_hash_index(self, n_jobs=None) -> HashIndex:
+        """
+        Builds (or rebuilds) a persisted hash index of the strings, which makes ``index_of``, ``contains``
+        and ``index_of_many`` take O(1) expected time instead of a scan. The index is kept up to date by ``extend``,
+        ``append``, ``__setitem__`` and ``delete``.
+
+        :param n_jobs: The number of jobs which hash the strings. ``None`` means no parallelization.
+        :return: The ``HashIndex``.
+        """
+        if self._store.packed:
+            raise ValueError(f'"{self.out_dir}" is packed, build the hash index before packing it!')
+        self.__dict__.pop("hash_index", None)
+        self.hash_index = HashIndex.build(self.out_dir / HASH_INDEX_KEY, self, n_jobs=n_jobs)
+        return self.hash_index
+
+    def index_of_many(self, strings: Sequence[str]) -> np.ndarray:
+        """
+        Finds the index of the first occurrence of every string, using the hash index.
+
+        :param strings: The strings to look up.
+        :return: An ``int64`` array with the index of every string, or ``-1`` if it is not in the ``StringsMmap``.
+        """
+        if self.hash_index is None:
+            raise ValueError(f'"{self.out_dir}" has no hash index, call build_hash_index first!')
+        found = self.hash_index.lookup([_str_to_bytes(string) for string in strings], self._get_bytes)
+        return self._logical(found)
+
+    def index_of(self, string: str) -> int:
+        """
+        Returns the index of the first occurrence of ``string``, like ``list.index``.
+        Raises a ``ValueError`` if it is not in the ``StringsMmap``.
+        """
+        idx = int(self.index_of_many([string])[0])
+        if idx < 0:
+            raise ValueError(f"{string!r} is not in the StringsMmap!")
+        return idx
+
+    def contains(self, string: str) -> bool:
+        return bool(self.index_of_many([string])[0] >= 0)
+
+    def find(self, pattern: Union[str, bytes, "re.Pattern"], n_jobs=None, chunk_nbytes: int = 64 * 1024 * 1024):
+        """
+        Finds the strings which contain ``pattern``, by scanning the raw bytes of the data file in large chunks,
+        without decoding the strings. Matches which span two neighbouring strings are discarded.
+
+        :param pattern: A substring (``str`` or ``bytes``), or a compiled ``bytes`` regular expression.
+            The regular expression is matched against the encoded strings, so ``^``, ``$`` and lookarounds,
+            which look past the boundaries of a string, are not supported.
+        :param n_jobs: The number of jobs which scan the chunks. ``None`` means no parallelization.
+        :param chunk_nbytes: The approximate number of bytes which are scanned by one job.
+        :return: The sorted indices of the matching strings.
+        """
+        if isinstance(pattern, str):
+            pattern = _str_to_bytes(pattern)
+        if isinstance(pattern, re.Pattern) and not isinstance(pattern.pattern, bytes):
+            raise ValueError("The strings are scanned as bytes, compile the regular expression from bytes!")
+        if not isinstance(pattern, (bytes, re.Pattern)):
+            raise ValueError(f"Expected a str, bytes or a compiled regular expression, got {type(pattern)}!")
+        if pattern == b"":
+            return np.arange(len(self), dtype=np.int64)
+        return self._scan(_find_range, pattern, n_jobs, chunk_nbytes)
+
+    def filter(self, predicate: Callable[[bytes], bool], n_jobs=None, chunk_nbytes: int = 64 * 1024 * 1024):
+        """
+        Finds the strings, whose raw (UTF-8 encoded) bytes satisfy ``predicate``, without decoding them.
+
+        :param predicate: Called with the bytes of every string. It should be picklable if ``n_jobs`` is set.
+        :param n_jobs: The number of jobs which scan the chunks. ``None`` means no parallelization.
+        :param chunk_nbytes: The approximate number of bytes which are scanned by one job.
+        :return: The sorted indices of the matching strings.
+        """
+        return self._scan(_filter_range, predicate, n_jobs, chunk_nbytes)
+
+    def _scan(self, fn, arg, n_jobs, chunk_nbytes: int) -> np.ndarray:
+        """
+        Runs ``fn(self, first, last, arg)`` over ranges of strings of about ``chunk_nbytes`` bytes each
+        (in parallel, with ``joblib``, since ``re`` and ``mmap.find`` hold the GIL) and concatenates the indices.
+        The deleted strings are scanned, too, and dropped from the result.
+        """
+        if chunk_nbytes < 1:
+            raise ValueError(f"chunk_nbytes should be at least 1, got {chunk_nbytes}!")
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+        n = len(self.starts)
+        n_chunks = min(max(-(-int(self.ends[-1] - self.starts[0]) // chunk_nbytes), 1), n)
+        bounds = np.linspace(0, n, n_chunks + 1).astype(np.int64).tolist()
+        jobs = [(self, first, last, arg) for first, last in zip(bounds[:-1], bounds[1:])]
+        parallel = ParallelBatchCollector.begin(n_jobs)
+        try:
+            if parallel is None:
+                results = [fn(*job) for job in jobs]
+            else:
+                results = parallel(delayed(fn)(*job) for job in jobs)
+        finally:
+            if parallel is not None:
+                parallel.__exit__(None, None, None)
+        found = self._logical(np.concatenate(results))
+        return found[found >= 0]
+
+    def enable_stats(self, callback=None, report_every: int = 1000, residency_every: int = 100) -> AccessStats:
+        """
+        Starts recording the reads (see ``stats.AccessStats``): the number of calls, strings and bytes,
+        the latency of every call split into the index lookup, the data access and the decoding,
+        and the page residency of the data. While the stats are disabled, the reads do not pay anything for them.
+
+        :param callback: Called with a snapshot of the statistics every ``report_every`` calls.
+        :param report_every: How often (in calls) ``callback`` is called.
+        :param residency_every: How often (in calls) the page residency is sampled with ``mincore``.
+        :return: The ``AccessStats``.
+        """
+        self._recorder = AccessStats(callback=callback, report_every=report_every, residency_every=residency_every)
+        # The instance attributes shadow the methods, so the reads are only timed while the stats are enabled.
+        self.get_single = self._get_single_timed
+        self.get_multiple = self._get_multiple_timed
+        return self._recorder
+
+    def disable_stats(self):
+        self.__dict__.pop("get_single", None)
+        self.__dict__.pop("get_multiple", None)
+        self._recorder = None
+
+    def stats(self) -> Optional[dict]:
+        """
+        :return: A snapshot of the statistics (see ``stats.AccessStats.snapshot``), or ``None`` if they are disabled.
+        """
+        return None if self._recorder is None else self._recorder.snapshot()
+
+    def _get_single_timed(self, item):
+        return self._get_multiple_timed([item], method="get_single")[0]
+
+    def _get_multiple_timed(self, item, method="get_multiple"):
+        recorder = self._recorder
+        start_t = perf_counter_ns()
+        indices = self._physical(numpy._normalize_indices(item, len(self)))
+        starts, ends = self._ranges(indices)
+        starts, ends = starts.tolist(), ends.tolist()
+        index_t = perf_counter_ns()
+        buffer = self.buffer
+        if recorder.sample_residency() and isinstance(buffer, mmap.mmap):
+            address = np.frombuffer(buffer, dtype=np.uint8).ctypes.data
+            for start, end in zip(starts, ends):
+                if end > start:
+                    recorder.record_residency(address + start, end - start)
+        raw = [buffer[start:end] for start, end in zip(starts, ends)]
+        data_t = perf_counter_ns()
+        strings = [_bytes_to_str(string) for string in raw]
+        phases = (("index", index_t - start_t), ("data", data_t - index_t), ("decode", perf_counter_ns() - data_t))
+        recorder.record(method, len(strings), sum(len(string) for string in raw), phases)
+        return strings
+
     def __getitem__(self, item):
         if self.starts is None:
             if np.isscalar(item):
@@ -60,47 +438,175 @@ class StringsMmap:
     def __len__(self):
         if self.starts is None:
             return 0
+        if self._live is not None:
+            return len(self._live)
         return len(self.starts)
 
     def set_multiple(self, key, value):
-        for i, idx in enumerate(self.range[key]):
-            new_value: str = value[i]
-            self.set_single(idx, new_value)
+        indices = numpy._normalize_indices(key, len(self))
+        self._update(self._physical(indices), [_str_to_bytes(value[i]) for i in range(len(indices))])
 
     def set_single(self, idx, new_value):
-        start = self.starts[idx]
-        end = self.ends[idx]
-        self.buffer[start:end] = _str_to_bytes(new_value)
+        self._update(self._physical(numpy._normalize_indices([idx], len(self))), [_str_to_bytes(new_value)])
+
+    def _update(self, indices: np.ndarray, encoded: Sequence[bytes]) -> None:
+        """
+        Replaces strings, whose new values may have a different length. A new value which fits into the slot
+        of the old one is written in place, the rest are appended to the end of the data, all with one write,
+        and only the starts and ends of the updated strings are rewritten. The bytes which are no longer used
+        are counted in ``dead_nbytes``. The cost is proportional to the number of updated bytes.
+        """
+        if isinstance(self.buffer, compression.CompressedBuffer):
+            raise ValueError(f'"{self.out_dir}" is compressed and read-only, decompress it first!')
+        if self.hash_index is not None and self.hash_index.out_dir is None:
+            raise ValueError(f'"{self.out_dir}" is packed and its hash index is read-only, unpack it first!')
+        keep = _last_occurrences(indices)
+        indices, encoded = indices[keep], [encoded[i] for i in keep.tolist()]
+        starts, ends = self._ranges(indices)
+        lengths = np.array([len(string) for string in encoded], dtype=np.int64)
+        if np.any(lengths != ends - starts):
+            if self._store.packed:
+                raise ValueError(f'"{self.out_dir}" is packed and supports only same-length updates, unpack it first!')
+            if self.compact_offsets is not None:
+                raise ValueError(f'"{self.out_dir}" has a compact index, which supports only same-length updates!')
+        new_starts, new_ends, moved, dead_nbytes = _plan_updates(starts, ends, lengths, len(self.buffer))
+        for i in np.flatnonzero(~moved & (lengths > 0)).tolist():
+            self.buffer[new_starts[i] : new_ends[i]] = encoded[i]
+        if moved.any():
+            self._release_buffer()
+            with open(self.data_file, "ab") as data_file:
+                data_file.writelines(encoded[i] for i in np.flatnonzero(moved).tolist())
+        if self.compact_offsets is None:
+            changed = (new_starts != starts) | (new_ends != ends)
+            numpy._write_rows(self.out_dir / self.starts_key, indices[changed], new_starts[changed])
+            numpy._write_rows(self.out_dir / self.ends_key, indices[changed], new_ends[changed])
+        _add_dead_nbytes(self._store, dead_nbytes)
+        self.__dict__.pop("offsets", None)
+        if self.hash_index is not None:
+            self.hash_index.update(indices, encoded)
+
+    @property
+    def dead_nbytes(self) -> int:
+        """
+        The number of bytes of the data, which are no longer used by any string after length-changing updates.
+        """
+        return read_dead_nbytes(self._store)
 
     def close(self):
-        self.buffer.close()
-        self.file.close()
+        if self._async_reader is not None:
+            self._async_reader.close()
+            self._async_reader = None
+        self._release_buffer()
+        # The unused capacity of the index arrays, which grow geometrically, is released.
+        for growable in self._growables.values():
+            growable.close(trim=True)
+        self._growables = {}
+        compact_offsets = self.__dict__.get("compact_offsets")
+        if compact_offsets is not None:
+            compact_offsets.close(trim=True)
+        hash_index = self.__dict__.get("hash_index")
+        if hash_index is not None:
+            hash_index.close()
 
-    def extend(self, list_of_strings: Sequence[str], verbose=False):
+    def extend(self, list_of_strings: Iterable[str], verbose=False):
+        if self._store.packed:
+            raise ValueError(f'"{self.out_dir}" is packed and cannot be extended, unpack it first!')
         if self.starts is None:
-            StringsMmap.from_strings(self.out_dir, list_of_strings, verbose=verbose)
+            hash_index = self.hash_index is not None
+            StringsMmap.from_strings(self.out_dir, list_of_strings, verbose=verbose, hash_index=hash_index)
             self._reload_fields()
             return
         bytes_slices = _sequence_of_strings_to_bytes(list_of_strings, verbose=verbose)
-        end = self.ends[-1]
-        start_offsets = end + bytes_slices.starts
-        end_offsets = end + bytes_slices.ends
-        numpy.extend(self.starts, start_offsets)
-        numpy.extend(self.ends, end_offsets)
-        self.close()
-        out_dir = self.data_file.parent
-        with open(out_dir / "data.ninja", "ab") as data_file:
-            data_file.write(bytes_slices.buffer)
-            data_file.flush()
+        # Updated strings may have been moved after the last one, so the new ones go after the end of the data.
+        end = len(self.buffer)
+        if isinstance(self.buffer, compression.CompressedBuffer):
+            self.buffer.extend([np.frombuffer(chunk, dtype=np.uint8) for chunk in bytes_slices.chunks])
+        else:
+            self._release_buffer()
+            with open(self.data_file, "ab") as data_file:
+                data_file.writelines(bytes_slices.chunks)
+                data_file.flush()
+        if self.compact_offsets is not None:
+            self.compact_offsets.extend(end + bytes_slices.ends)
+        else:
+            self.starts = self._extend_field(self.starts_key, end + bytes_slices.starts)
+            self.ends = self._extend_field(self.ends_key, end + bytes_slices.ends)
+        self.__dict__.pop("offsets", None)
+        self.__dict__.pop("_live", None)
+        if self.hash_index is not None:
+            self.hash_index.insert(list(bytes_slices.encoded()), self._live)
+
+    def delete(self, indices):
+        """
+        Deletes strings: they are marked in a persisted tombstone bitmap, and are skipped by ``len`` and by all reads,
+        i.e. the strings after them move up. Their bytes stay in the data file until ``compact``.
+
+        :param indices: The indices of the strings (anything that ``get_multiple`` accepts).
+        """
+        if self._store.packed:
+            raise ValueError(f'"{self.out_dir}" is packed and read-only, unpack it first!')
+        indices = self._physical(numpy._normalize_indices(indices, len(self)))
+        tombstones._mark_deleted(self.out_dir, indices, len(self.starts))
+        self.__dict__.pop("_live", None)
+        if self.hash_index is not None:
+            # Only the slots of the deleted strings are cleared, the table is rebuilt by ``compact``.
+            self.hash_index.remove(indices)
+
+    def compact(self):
+        """
+        Rewrites the container without the deleted strings and the dead bytes of updates (see ``dead_nbytes``).
+        The live strings are copied in order, with large sequential copies, into a staging directory, which is then
+        swapped with the container atomically. The hash index, if any, is rebuilt. Other readers, which open all
+        of their files on first use, keep reading the version they opened until they reopen the container.
+        """
+        if self._store.packed or isinstance(self.buffer, compression.CompressedBuffer):
+            raise ValueError(f'"{self.out_dir}" is packed or compressed, unpack or decompress it first!')
+        if self.starts is None:
+            return
+        live = self._physical(np.arange(len(self)))
+        starts, ends = self._ranges(live)
+        lengths = np.asarray(ends, dtype=np.int64) - np.asarray(starts, dtype=np.int64)
+        new_ends = np.cumsum(lengths)
+        has_hash_index = self.hash_index is not None
+        staging_dir = tombstones._staging_dir(self.out_dir)
+        if len(live) > 0:
+            with open(self.data_file, "rb") as src, open(staging_dir / "data.ninja", "wb") as dst:
+                tombstones._copy_ranges(src, dst, starts, ends)
+            if self.compact_offsets is not None:
+                CompactOffsets.save(staging_dir / OFFSETS_KEY, np.concatenate([[0], new_ends]))
+            else:
+                numpy.from_ndarray(staging_dir / self.starts_key, new_ends - lengths)
+                numpy.from_ndarray(staging_dir / self.ends_key, new_ends)
+        tombstones._copy_metadata(self.out_dir, staging_dir)
         self._reload_fields()
+        tombstones._swap_directories(staging_dir, self.out_dir)
+        if has_hash_index:
+            self.build_hash_index()
+
+    def _extend_field(self, key, arr):
+        """
+        Appends to the persisted starts or ends and returns a view of the valid part.
+        The ``GrowableMmap`` objects are kept open, so that repeated extends do not reopen every array.
+        """
+        growable = self._growables.get(key)
+        if growable is None:
+            growable = numpy.GrowableMmap(self.out_dir / key, mode="r")
+            if self.advice is not None:
+                growable.advise(self.advice)
+            self._growables[key] = growable
+        growable.extend(arr)
+        return growable.array
 
     def _reload_fields(self):
-        self.starts = numpy.open_existing(self.out_dir / self.starts_key, mode="r")
-        self.ends = numpy.open_existing(self.out_dir / self.ends_key, mode="r")
-        self.range = np.arange(len(self.starts), dtype=np.int64)
-        self.file = open(self.data_file, mode=self.mode)
-        access = mmap.ACCESS_READ if self.mode == 'rb' else mmap.ACCESS_DEFAULT
-        self.buffer = mmap.mmap(self.file.fileno(), 0, access=access)
+        self.close()
+        for name in self._lazy_fields:
+            self.__dict__.pop(name, None)
+
+    def _reset_after_fork(self):
+        # The thread pool of the async reader does not survive a fork, and the mappings and the open file
+        # are reopened lazily, so that the child does not share them (and the file offset) with the parent.
+        self._async_reader = None
+        self._reload_fields()
 
     def append(self, string: str):
         self.extend([string])
@@ -113,23 +619,85 @@ class StringsMmap:
     def from_strings(
         cls,
         out_dir: Union[str, Path],
-        strings: Sequence[str],
+        strings: Union[Iterable[str], np.ndarray],
         mode="r+b",
         starts_key="starts",
         ends_key="ends",
         verbose=False,
+        in_memory_index=False,
+        compact_index=False,
+        hash_index=False,
     ):
+        """
+        Creates a ``StringsMmap`` from a sequence of strings.
+
+        :param out_dir: The output directory.
+        :param strings: A sequence of strings, a numpy array of strings (of dtype ``str`` or ``object``),
+            or any other iterable of strings (e.g. a generator).
+        :param verbose: Whether to show a progress bar.
+        :param in_memory_index: Whether to load the index into RAM on first use (see ``InMemoryOffsets``).
+        :param compact_index: If ``True``, the starts and the ends are stored as a single array of ``n + 1`` offsets,
+            in the narrowest encoding which fits (see ``CompactOffsets``), instead of two ``int64`` arrays.
+        :param hash_index: Whether to build the hash index, which is used by ``index_of`` (see ``build_hash_index``).
+        :return: The ``StringsMmap``.
+        """
         out_dir = Path(out_dir)
         out_dir.mkdir(exist_ok=True)
-        if len(strings) == 0:
-            return cls(out_dir, mode=mode, starts_key=starts_key, ends_key=ends_key)
         bytes_slices = _sequence_of_strings_to_bytes(strings, verbose=verbose)
+        if len(bytes_slices.ends) > 0:
+            with open(out_dir / "data.ninja", "wb") as f:
+                f.writelines(bytes_slices.chunks)
+            base._str_to_file("string", out_dir / "type.ninja")
+            if compact_index:
+                CompactOffsets.save(out_dir / OFFSETS_KEY, np.concatenate([[0], bytes_slices.ends]))
+            else:
+                numpy.from_ndarray(out_dir / starts_key, bytes_slices.starts)
+                numpy.from_ndarray(out_dir / ends_key, bytes_slices.ends)
+        strings_mmap = cls(
+            out_dir, mode=mode, starts_key=starts_key, ends_key=ends_key, in_memory_index=in_memory_index
+        )
+        if hash_index:
+            strings_mmap.build_hash_index()
+        return strings_mmap
+
+    @classmethod
+    def from_offsets(
+        cls,
+        out_dir: Union[str, Path],
+        offsets: np.ndarray,
+        buffer,
+        mode="r+b",
+        starts_key="starts",
+        ends_key="ends",
+        in_memory_index=False,
+    ):
+        """
+        Creates a ``StringsMmap`` from already encoded strings, in the layout of Arrow string arrays:
+        the ``i``-th string is ``buffer[offsets[i]:offsets[i + 1]]``, encoded as UTF-8.
+
+        :param out_dir: The output directory.
+        :param offsets: The ``n + 1`` offsets of the strings in ``buffer``.
+        :param buffer: Any object which supports the buffer protocol (``bytes``, a numpy array, an Arrow buffer...).
+        :return: The ``StringsMmap``.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if offsets.ndim != 1 or len(offsets) == 0:
+            raise ValueError(f"Expected a non-empty 1-dimensional array of offsets, got shape {offsets.shape}!")
+        if np.any(np.diff(offsets) < 0):
+            raise ValueError("The offsets should be non-decreasing!")
+        data = memoryview(buffer).cast("B")
+        if offsets[0] < 0 or offsets[-1] > len(data):
+            raise ValueError(f"The offsets should be in [0, {len(data)}]!")
+        out_dir = Path(out_dir)
+        out_dir.mkdir(exist_ok=True)
+        if len(offsets) == 1:
+            return cls(out_dir, mode=mode, starts_key=starts_key, ends_key=ends_key, in_memory_index=in_memory_index)
         with open(out_dir / "data.ninja", "wb") as f:
-            f.write(bytes_slices.buffer)
+            f.write(data[offsets[0] : offsets[-1]])
         base._str_to_file("string", out_dir / "type.ninja")
-        numpy.from_ndarray(out_dir / starts_key, np.array(bytes_slices.starts, dtype=np.int64))
-        numpy.from_ndarray(out_dir / ends_key, np.array(bytes_slices.ends, dtype=np.int64))
-        return cls(out_dir, mode=mode, starts_key=starts_key, ends_key=ends_key)
+        numpy.from_ndarray(out_dir / starts_key, offsets[:-1] - offsets[0])
+        numpy.from_ndarray(out_dir / ends_key, offsets[1:] - offsets[0])
+        return cls(out_dir, mode=mode, starts_key=starts_key, ends_key=ends_key, in_memory_index=in_memory_index)
 
     @classmethod
     def from_generator(cls, out_dir: Union[str, Path], sample_generator, batch_size: int, verbose=False, **kwargs):
@@ -141,3 +709,88 @@ class StringsMmap:
             batch_ctor=cls.from_strings,
             **kwargs,
         )
+
+
+def _haystack(strings: StringsMmap, lo: int, hi: int):
+    """
+    Returns an object with the bytes ``lo:hi`` of the data, which supports ``find`` and ``re``,
+    and the position of its first byte in the data.
+    """
+    buffer = strings.buffer
+    if isinstance(buffer, mmap.mmap):
+        return buffer, 0
+    return buffer[lo:hi], lo
+
+
+def _sorted_runs(strings: StringsMmap, first: int, last: int):
+    """
+    Sorts the strings ``first:last`` by their position in the data and splits them into runs of adjacent strings
+    (updates may have moved strings out of order and left dead bytes between them).
+
+    :return: The order of the strings, their sorted starts and ends, and the ``(first, last)`` positions of every run.
+    """
+    starts, ends = (np.asarray(arr) for arr in strings._ranges(np.arange(first, last)))
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    breaks = (np.flatnonzero(starts[1:] != ends[:-1]) + 1).tolist()
+    return order, starts, ends, list(zip([0, *breaks], [*breaks, len(starts)]))
+
+
+def _find_range(strings: StringsMmap, first: int, last: int, pattern) -> np.ndarray:
+    """
+    Returns the indices of the strings ``first:last`` which contain ``pattern`` (a job of ``StringsMmap.find``).
+    """
+    order, starts, ends, runs = _sorted_runs(strings, first, last)
+    found = [
+        run_first + _find_run(strings, starts[run_first:run_last], ends[run_first:run_last], pattern)
+        for run_first, run_last in runs
+    ]
+    return first + np.sort(order[np.concatenate(found)])
+
+
+def _find_run(strings: StringsMmap, starts: np.ndarray, ends: np.ndarray, pattern) -> np.ndarray:
+    """
+    Returns the positions of the strings which contain ``pattern`` in a run of adjacent strings.
+    """
+    lo, hi = int(starts[0]), int(ends[-1])
+    haystack, base_pos = _haystack(strings, lo, hi)
+    is_regex = isinstance(pattern, re.Pattern)
+    found = []
+    pos = lo
+    while pos < hi:
+        if is_regex:
+            match = pattern.search(haystack, pos - base_pos, hi - base_pos)
+            if match is None:
+                break
+            start, end = match.start() + base_pos, match.end() + base_pos
+        else:
+            start = haystack.find(pattern, pos - base_pos, hi - base_pos)
+            if start < 0:
+                break
+            start += base_pos
+            end = start + len(pattern)
+        # The last string which starts at or before the match (the empty strings before it are skipped).
+        k = int(np.searchsorted(starts, start, side="right")) - 1
+        string_end = int(ends[k])
+        if end <= string_end:
+            found.append(k)
+        elif is_regex and pattern.search(haystack, start - base_pos, string_end - base_pos) is not None:
+            # A shorter match, which stays within the string, hides behind the one which spans two strings.
+            found.append(k)
+        # Once the string is matched (or no match, which starts in it, fits into it), continue with the next one.
+        pos = max(string_end, start + 1)
+    return np.array(found, dtype=np.int64)
+
+
+def _filter_range(strings: StringsMmap, first: int, last: int, predicate) -> np.ndarray:
+    """
+    Returns the indices of the strings ``first:last`` whose bytes satisfy ``predicate`` (a job of ``filter``).
+    """
+    order, starts, ends, runs = _sorted_runs(strings, first, last)
+    mask = np.zeros(len(order), dtype=bool)
+    for run_first, run_last in runs:
+        haystack, base_pos = _haystack(strings, int(starts[run_first]), int(ends[run_last - 1]))
+        run_starts = (starts[run_first:run_last] - base_pos).tolist()
+        run_ends = (ends[run_first:run_last] - base_pos).tolist()
+        mask[run_first:run_last] = [bool(predicate(haystack[start:end])) for start, end in zip(run_starts, run_ends)]
+    return first + np.sort(order[mask]).astype(np.int64)
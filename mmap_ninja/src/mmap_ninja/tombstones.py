@@ -0,0 +1,206 @@
+"""
+Row deletion and compaction.
+
+Deleted rows are marked in a persisted bitmap (``tombstones``, one bit per row, in ``numpy.unpackbits``
+``bitorder="little"`` order), which ``RaggedMmap`` and ``StringsMmap`` consult to skip the deleted rows.
+``compact`` rewrites the live rows into a staging directory and swaps it with the container atomically.
+"""
+import ctypes
+import ctypes.util
+import os
+import shutil
+from pathlib import Path
+from typing import BinaryIO, Optional, Sequence, Union
+
+import numpy as np
+
+from mmap_ninja import numpy as np_ninja
+from mmap_ninja.storage import DirectoryStore
+
+TOMBSTONES_KEY = "tombstones"
+_COPY_CHUNK = 16 * 1024 * 1024
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+
+
+def _live_rows(store, n: int) -> Optional[np.ndarray]:
+    """
+    :param store: The store of the container.
+    :param n: The number of rows, including the deleted ones.
+    :return: The indices of the rows which are not deleted, or ``None`` if no row is deleted.
+    """
+    if not store.exists(f"{TOMBSTONES_KEY}/dtype.ninja"):
+        return None
+    bitmap = store.open_array(TOMBSTONES_KEY)
+    # Rows which were appended after the last deletion are not covered by the bitmap, and are live.
+    deleted = np.unpackbits(np.asarray(bitmap), count=min(n, 8 * len(bitmap)), bitorder="little")
+    if not deleted.any():
+        return None
+    return np.concatenate([np.flatnonzero(deleted == 0), np.arange(len(deleted), n)])
+
+
+def _mark_deleted(out_dir: Path, indices: np.ndarray, n: int) -> None:
+    """
+    Sets the bits of the (physical) ``indices`` in the tombstone bitmap of the container in ``out_dir``.
+    Only the bytes of the touched bits are written, unless the bitmap has to grow.
+    """
+    if len(indices) == 0:
+        return
+    key_dir = out_dir / TOMBSTONES_KEY
+    n_bytes = (n + 7) // 8
+    if not (key_dir / "dtype.ninja").exists() or np_ninja._read_mmap_kwargs(key_dir)["shape"][0] < n_bytes:
+        bitmap = np.zeros(n_bytes, dtype=np.uint8)
+        if (key_dir / "dtype.ninja").exists():
+            old = np.array(np_ninja.open_existing(key_dir))
+            bitmap[: len(old)] = old
+        np_ninja.from_ndarray(key_dir, bitmap)
+    bitmap = np_ninja.open_existing(key_dir, mode="r+")
+    indices = np.asarray(indices, dtype=np.int64)
+    np.bitwise_or.at(bitmap, indices >> 3, (1 << (indices & 7)).astype(np.uint8))
+    bitmap.flush()
+
+
+def live_rows(out_dir: Union[str, Path]) -> np.ndarray:
+    """
+    Returns the indices of the rows of a numpy memory map, which are not deleted (see ``delete_rows``).
+    A plain ``np.memmap`` cannot skip rows by itself, so use ``arr[live_rows(out_dir)]``, or ``compact_array``.
+
+    :param out_dir: The directory of the memory map.
+    :return: The indices of the live rows.
+    """
+    n = np_ninja._read_mmap_kwargs(Path(out_dir))["shape"][0]
+    live = _live_rows(DirectoryStore(out_dir), n)
+    return np.arange(n, dtype=np.int64) if live is None else live
+
+
+def delete_rows(out_dir: Union[str, Path], indices) -> None:
+    """
+    Marks rows of a numpy memory map as deleted. The rows stay in the data file until ``compact_array``.
+
+    :param out_dir: The directory of the memory map.
+    :param indices: The indices of the rows (anything that ``np.memmap.__getitem__`` accepts, except for scalars).
+    """
+    out_dir = Path(out_dir)
+    n = np_ninja._read_mmap_kwargs(out_dir)["shape"][0]
+    _mark_deleted(out_dir, np_ninja._normalize_indices(indices, n), n)
+
+
+def compact_array(out_dir: Union[str, Path]) -> None:
+    """
+    Rewrites a numpy memory map without its deleted rows (see ``compact``).
+
+    :param out_dir: The directory of the memory map.
+    """
+    out_dir = Path(out_dir)
+    kwargs = np_ninja._read_mmap_kwargs(out_dir)
+    shape = kwargs["shape"]
+    if kwargs["order"] == "F" and len(shape) > 1:
+        raise ValueError(f"Cannot compact a Fortran-ordered array with shape {shape} along its first axis!")
+    live = _live_rows(DirectoryStore(out_dir), shape[0])
+    if live is None:
+        return
+    row_nbytes = np_ninja._sample_nbytes(kwargs["dtype"], shape[1:])
+    staging_dir = _staging_dir(out_dir)
+    with open(out_dir / "data.ninja", "rb") as src, open(staging_dir / "data.ninja", "wb") as dst:
+        _copy_ranges(src, dst, live * row_nbytes, (live + 1) * row_nbytes)
+    np_ninja._save_mmap_kwargs(staging_dir, kwargs["dtype"], (len(live), *shape[1:]), kwargs["order"])
+    _copy_metadata(out_dir, staging_dir)
+    _swap_directories(staging_dir, out_dir)
+
+
+def _staging_dir(out_dir: Path) -> Path:
+    """
+    Creates an empty directory next to ``out_dir`` (on the same filesystem, so that it can be swapped with it).
+    """
+    staging_dir = out_dir.parent / f".{out_dir.name}.compacting"
+    if staging_dir.exists():
+        shutil.rmtree(staging_dir)
+    staging_dir.mkdir()
+    return staging_dir
+
+
+def _copy_metadata(src_dir: Path, dst_dir: Path, skip: Sequence[str] = ()) -> None:
+    """
+    Copies the small files of a container (e.g. ``type.ninja``), which are not rewritten by the compaction.
+    """
+    rewritten = {"data.ninja", "dtype.ninja", "shape.ninja", "order.ninja", "dead_nbytes.ninja", *skip}
+    for path in src_dir.iterdir():
+        if path.is_file() and path.name not in rewritten:
+            shutil.copy2(path, dst_dir / path.name)
+
+
+def _copy_ranges(src: BinaryIO, dst: BinaryIO, starts: np.ndarray, ends: np.ndarray) -> None:
+    """
+    Appends the byte ranges ``starts[i]:ends[i]`` of ``src`` to ``dst``, in order. Adjacent ranges are copied
+    together, with ``os.copy_file_range`` (or ``os.sendfile``) where possible, so that the kernel copies the data
+    without moving it through user space.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        return
+    breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+    run_starts = starts[np.concatenate([[0], breaks])]
+    run_ends = ends[np.concatenate([breaks - 1, [len(ends) - 1]])]
+    dst.flush()
+    for start, end in zip(run_starts.tolist(), run_ends.tolist()):
+        _copy_file_range(src.fileno(), dst.fileno(), start, end - start)
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, offset: int, nbytes: int) -> None:
+    """
+    Copies ``nbytes`` bytes of ``src_fd``, starting at ``offset``, to the current position of ``dst_fd``.
+    """
+    while nbytes > 0:
+        count = min(nbytes, _COPY_CHUNK)
+        n_copied = 0
+        try:
+            if hasattr(os, "copy_file_range"):
+                n_copied = os.copy_file_range(src_fd, dst_fd, count, offset)
+            elif hasattr(os, "sendfile"):
+                n_copied = os.sendfile(dst_fd, src_fd, offset, count)
+        except OSError:
+            # E.g. the filesystems do not support it, fall back to copying through user space.
+            n_copied = 0
+        if n_copied == 0:
+            data = os.pread(src_fd, count, offset)
+            if not data:
+                raise ValueError("Unexpected end of file while copying!")
+            n_copied = os.write(dst_fd, data)
+        offset += n_copied
+        nbytes -= n_copied
+
+
+def _load_renameat2():
+    try:
+        renameat2 = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).renameat2
+    except (OSError, AttributeError, TypeError):
+        return None
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    renameat2.restype = ctypes.c_int
+    return renameat2
+
+
+_renameat2 = _load_renameat2()
+
+
+def _swap_directories(staging_dir: Path, out_dir: Path) -> None:
+    """
+    Replaces ``out_dir`` with ``staging_dir`` and removes the old version.
+
+    On Linux, both directories are exchanged with a single atomic ``renameat2(RENAME_EXCHANGE)``, so ``out_dir``
+    always contains a complete version. Elsewhere, the old version is renamed out of the way first.
+    The files which are already open or mapped stay valid after the removal, so readers keep reading
+    the old version until they reopen the container.
+    """
+    if _renameat2 is not None:
+        src, dst = os.fsencode(staging_dir), os.fsencode(out_dir)
+        if _renameat2(_AT_FDCWD, src, _AT_FDCWD, dst, _RENAME_EXCHANGE) == 0:
+            shutil.rmtree(staging_dir)
+            return
+    old_dir = out_dir.parent / f".{out_dir.name}.old"
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    os.rename(out_dir, old_dir)
+    os.rename(staging_dir, out_dir)
+    shutil.rmtree(old_dir)
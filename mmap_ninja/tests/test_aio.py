@@ -0,0 +1,109 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from mmap_ninja import aio, compression, storage
+from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja.string import StringsMmap
+
+
+def assert_samples_equal(actual, expected):
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert type(a) == type(e)
+        assert np.array_equal(a, e)
+
+
+def test_coalesce():
+    starts, ends = [0, 10, 100, 100, 1000], [10, 20, 100, 200, 1010]
+    assert aio._coalesce(starts, ends, 0) == [(0, 2), (2, 4), (4, 5)]
+    assert aio._coalesce(starts, ends, 80) == [(0, 4), (4, 5)]
+    assert aio._coalesce(starts[:2], [10, 15], 0) == [(0, 2)]
+    assert aio._coalesce([0, 5], [10, 15], 1000) == [(0, 1), (1, 2)]
+    assert aio._coalesce([], [], 10) == []
+
+
+@pytest.mark.parametrize("in_memory_index", [False, True])
+def test_ragged(tmp_path, in_memory_index):
+    samples = [np.arange(i * 6).reshape(-1, 2, 3) for i in range(1, 30)]
+    flat = [np.arange(i, dtype=np.float32) for i in range(10)] + [np.float32(3)]
+    memmap = RaggedMmap.from_lists(tmp_path / "nd", samples, in_memory_index=in_memory_index)
+    flat_memmap = RaggedMmap.from_lists(tmp_path / "flat", flat, in_memory_index=in_memory_index)
+
+    async def main():
+        assert np.array_equal(await memmap.aget(3), samples[3])
+        assert np.array_equal(await memmap.aget(-1), samples[-1])
+        assert_samples_equal(await memmap.aget_many([5, 0, 5]), [samples[5], samples[0], samples[5]])
+        assert_samples_equal(await memmap.aget(slice(2, 8)), samples[2:8])
+        assert await memmap.aget_many([]) == []
+        assert_samples_equal(await flat_memmap.aget_many(slice(None)), flat_memmap[:])
+        assert await flat_memmap.aget(-1) == flat[-1]
+        with pytest.raises(IndexError):
+            await memmap.aget(len(samples))
+
+    asyncio.run(main())
+
+
+def test_concurrent_requests_are_coalesced(tmp_path):
+    samples = [np.full(100, i, dtype=np.int64) for i in range(100)]
+    memmap = RaggedMmap.from_lists(tmp_path / "ragged", samples)
+    reader = memmap.async_reader(max_concurrency=2, coalesce_gap=2 * 800)
+
+    async def main():
+        results = await asyncio.gather(*[memmap.aget(i) for i in [50, 10, 12, 11, 14, 90]])
+        assert [result[0] for result in results] == [50, 10, 12, 11, 14, 90]
+        assert reader.n_reads == 3
+        results = await asyncio.gather(memmap.aget(1), memmap.aget_many([3, 1]))
+        assert results[0][0] == 1 and [sample[0] for sample in results[1]] == [3, 1]
+        assert reader.n_reads == 4
+
+    asyncio.run(main())
+    with pytest.raises(ValueError):
+        memmap.async_reader(max_concurrency=0)
+
+
+def test_wrapper_fn(tmp_path):
+    samples = [np.arange(i) for i in range(1, 5)]
+    RaggedMmap.from_lists(tmp_path / "ragged", samples)
+    memmap = RaggedMmap(tmp_path / "ragged", wrapper_fn=list)
+    assert asyncio.run(memmap.aget_many([0, 3])) == [[0], [0, 1, 2, 3]]
+
+
+def test_strings(tmp_path):
+    strs = [f"{i} ünicode {'x' * i}" for i in range(50)]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strs)
+
+    async def main():
+        assert await memmap.aget(7) == strs[7]
+        assert await memmap.aget_many([-1, 3]) == [strs[-1], strs[3]]
+        assert await asyncio.gather(*[memmap.aget(i) for i in range(50)]) == strs
+
+    asyncio.run(main())
+    memmap.close()
+
+
+def test_packed_and_compressed(tmp_path):
+    samples = [np.arange(i * 4).reshape(-1, 4) for i in range(1, 20)]
+    RaggedMmap.from_lists(tmp_path / "ragged", samples)
+    storage.pack(tmp_path / "ragged", tmp_path / "packed")
+    packed = RaggedMmap(tmp_path / "packed")
+    assert_samples_equal(asyncio.run(packed.aget_many(slice(None))), samples)
+    compression.compress(tmp_path / "ragged", codec="zlib", block_nbytes=64)
+    compressed = RaggedMmap(tmp_path / "ragged")
+    assert_samples_equal(asyncio.run(compressed.aget_many([4, 2])), [samples[4], samples[2]])
+    assert compressed._async_reader.n_reads == 0
+
+
+def test_preadv_partial_reads(tmp_path, monkeypatch):
+    path = tmp_path / "data"
+    path.write_bytes(bytes(range(100)))
+    # Simulate short reads, which return at most 7 bytes at a time.
+    preadv = aio.os.preadv
+    monkeypatch.setattr(aio.os, "preadv", lambda fd, buffers, offset: preadv(fd, [buffers[0][:7]], offset))
+    buffers = [bytearray(10), bytearray(0), bytearray(20)]
+    with open(path, "rb") as f:
+        aio._preadv(f.fileno(), buffers, 5)
+        assert bytes(buffers[0] + buffers[2]) == bytes(range(5, 35))
+        with pytest.raises(EOFError):
+            aio._preadv(f.fileno(), [bytearray(10)], 95)
@@ -1,6 +1,8 @@
 import numpy as np
+import pytest
 
-from mmap_ninja import base, Wrapped
+from mmap_ninja import base, Wrapped, RaggedMmap
+from mmap_ninja.parallel import ParallelBatchCollector, make_indexable
 
 
 def test_int_conversions():
@@ -59,3 +61,33 @@ def test_wrapper_skip_copy():
     assert wrapped[1] == -2
     assert wrapped[2] == -3
     assert len(wrapped) == 3
+
+
+@pytest.mark.parametrize("n_jobs", [None, 2])
+def test_pipelined_batches(n_jobs):
+    collector = ParallelBatchCollector(list(range(10)), 3, n_jobs=n_jobs, queue_depth=2)
+    assert list(collector.batches()) == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+
+
+def test_pipelined_batches_early_stop_and_errors():
+    batches = ParallelBatchCollector(make_indexable(lambda i: i), 2, queue_depth=1).batches()
+    assert next(batches) == [0, 1]
+    batches.close()
+
+    def fail(i):
+        if i == 3:
+            raise ValueError(i)
+        return i
+
+    batches = ParallelBatchCollector(make_indexable(fail, length=6), 2, queue_depth=3).batches()
+    assert next(batches) == [0, 1]
+    with pytest.raises(ValueError):
+        next(batches)
+
+
+def test_from_indexable_pipelined(tmp_path):
+    samples = [np.arange(i) for i in range(1, 30)]
+    memmap = RaggedMmap.from_indexable(tmp_path / "pipelined", samples, 4, queue_depth=2)
+    assert len(memmap) == len(samples)
+    for i, sample in enumerate(samples):
+        assert np.array_equal(memmap[i], sample)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from mmap_ninja import compression, storage
+from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja.string import StringsMmap
+
+
+def make_samples(n):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 4, size=(length, 3)).astype(np.float32) for length in rng.integers(1, 50, size=n)]
+
+
+@pytest.mark.parametrize("codec", list(compression.CODECS))
+@pytest.mark.parametrize("in_memory_index", [False, True])
+def test_compressed_ragged(tmp_path, codec, in_memory_index):
+    samples = make_samples(200)
+    RaggedMmap.from_lists(tmp_path / "ragged", samples)
+    compression.compress(tmp_path / "ragged", codec=codec, block_nbytes=1000)
+    assert compression.is_compressed(tmp_path / "ragged")
+    assert not (tmp_path / "ragged" / "data.ninja").exists()
+
+    memmap = RaggedMmap(tmp_path / "ragged", in_memory_index=in_memory_index)
+    assert isinstance(memmap.memmap, compression.CompressedArray)
+    assert memmap.memmap.compressed_nbytes < memmap.memmap.nbytes
+    for i, sample in enumerate(samples):
+        assert np.array_equal(memmap[i], sample)
+    for i, sample in zip([5, 0, 199, 5], memmap[[5, 0, 199, 5]]):
+        assert np.array_equal(sample, samples[i])
+    with pytest.raises(ValueError):
+        memmap[0] = samples[0]
+
+    memmap.extend([np.ones((2, 3)), np.zeros((1000, 3))])
+    samples.extend([np.ones((2, 3)), np.zeros((1000, 3))])
+    reopened = RaggedMmap(tmp_path / "ragged")
+    for i, sample in enumerate(samples):
+        assert np.array_equal(reopened[i], sample)
+
+    compression.decompress(tmp_path / "ragged")
+    assert not compression.is_compressed(tmp_path / "ragged")
+    decompressed = RaggedMmap(tmp_path / "ragged")
+    assert isinstance(decompressed.memmap, np.memmap)
+    for i, sample in enumerate(samples):
+        assert np.array_equal(decompressed[i], sample)
+
+
+def test_compressed_strings(tmp_path):
+    strs = [f"sample number {i} " * (i % 7) for i in range(500)]
+    StringsMmap.from_strings(tmp_path / "strings", strs)
+    compression.compress(tmp_path / "strings", codec="lzma", block_nbytes=512)
+    memmap = StringsMmap(tmp_path / "strings")
+    assert memmap[:] == strs
+    memmap.willneed([0, 1])
+    memmap.extend(["ünïcödé", "more"])
+    assert StringsMmap(tmp_path / "strings")[-3:] == [strs[-1], "ünïcödé", "more"]
+    compression.decompress(tmp_path / "strings")
+    assert StringsMmap(tmp_path / "strings")[:] == strs + ["ünïcödé", "more"]
+
+
+def test_block_cache_budget(tmp_path):
+    RaggedMmap.from_lists(tmp_path / "ragged", [np.arange(1000, dtype=np.int64)] * 10)
+    compression.compress(tmp_path / "ragged", block_nbytes=8000)
+    arr = compression.CompressedArray(tmp_path / "ragged", cache_nbytes=16000)
+    assert arr.n_blocks == 10
+    assert arr.block_size == 1000
+    assert np.array_equal(arr[500:2500], np.concatenate([np.arange(500, 1000), np.arange(1000), np.arange(500)]))
+    assert arr[-1] == 999
+    for i in range(10):
+        arr[i * 1000]
+    assert len(arr._cache) == 2
+    assert arr._cached_nbytes == 16000
+    with pytest.raises(IndexError):
+        arr[10_000]
+    with pytest.raises(IndexError):
+        arr[::2]
+
+
+def test_compression_errors(tmp_path):
+    RaggedMmap.from_lists(tmp_path / "ragged", [np.arange(3)])
+    with pytest.raises(ValueError):
+        compression.compress(tmp_path / "ragged", codec="nope")
+    with pytest.raises(ValueError):
+        compression.decompress(tmp_path / "ragged")
+    compression.compress(tmp_path / "ragged")
+    with pytest.raises(ValueError):
+        compression.compress(tmp_path / "ragged")
+    with pytest.raises(ValueError):
+        storage.pack(tmp_path / "ragged")
@@ -0,0 +1,77 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from mmap_ninja import dictionary, generic
+from mmap_ninja.dictionary import DictionaryStringsMmap
+
+
+def test_base_case(tmp_path):
+    countries = ["BG", "DE", "ünicode", "", "DE", "BG", "DE"] * 10
+    memmap = DictionaryStringsMmap.from_strings(tmp_path / "countries", countries, batch_size=4)
+    assert len(memmap) == len(countries)
+    assert memmap[:] == countries
+    assert memmap[2] == "ünicode"
+    assert memmap[[6, 0, 6]] == ["DE", "BG", "DE"]
+    assert memmap[[]] == []
+    assert memmap.values[:] == ["BG", "DE", "ünicode", ""]
+    assert memmap.codes.dtype == np.int32
+    assert memmap.codes[:7].tolist() == [0, 1, 2, 3, 1, 0, 1]
+
+    # The unused capacity of the codes is released after the build.
+    assert (tmp_path / "countries" / "codes" / "data.ninja").stat().st_size == 4 * len(countries)
+
+    memmap.close()
+    reopened = generic.open_existing(tmp_path / "countries")
+    assert isinstance(reopened, DictionaryStringsMmap)
+    assert reopened[:] == countries
+    assert pickle.loads(pickle.dumps(reopened))[:] == countries
+
+
+def test_code_level_operations(tmp_path):
+    labels = ["cat", "dog", "cat", "bird", "cat"]
+    memmap = DictionaryStringsMmap.from_strings(tmp_path / "labels", labels)
+    assert memmap.value_counts().tolist() == [3, 1, 1]
+    assert memmap.value_counts_dict() == {"cat": 3, "dog": 1, "bird": 1}
+    assert memmap.code_of("dog") == 1
+    assert memmap.code_of("fish") == -1
+    assert memmap.equals("cat").tolist() == [0, 2, 4]
+    assert memmap.equals("fish").tolist() == []
+    assert memmap.isin(["bird", "dog", "fish"]).tolist() == [1, 3]
+
+
+def test_extend(tmp_path):
+    memmap = DictionaryStringsMmap.from_strings(tmp_path / "labels", [])
+    assert len(memmap) == 0
+    assert memmap[:] == []
+    assert memmap.value_counts().tolist() == []
+    memmap.extend(["a", "b"])
+    memmap.append("a")
+    memmap.extend([f"{i % 100}" for i in range(1000)])
+    assert len(memmap.values) == 102
+    assert memmap.value_counts()[:3].tolist() == [2, 1, 10]
+    memmap.close()
+    reopened = DictionaryStringsMmap(tmp_path / "labels")
+    assert len(reopened) == 1003
+    assert reopened[2] == "a" and reopened[-1] == "99"
+    reopened.extend(["b", "new"])
+    assert reopened.codes[-2:].tolist() == [1, 102]
+
+
+@pytest.mark.parametrize("n", [1, 10, 101])
+def test_from_generator(tmp_path, n):
+    memmap = DictionaryStringsMmap.from_generator(tmp_path / "labels", (str(i % 7) for i in range(n)), batch_size=10)
+    assert memmap[:] == [str(i % 7) for i in range(n)]
+    assert len(memmap.values) == min(n, 7)
+
+
+def test_too_many_distinct_strings(tmp_path, monkeypatch):
+    monkeypatch.setattr(dictionary, "_MAX_DISTINCT", 3)
+    memmap = DictionaryStringsMmap.from_strings(tmp_path / "labels", ["a", "b", "a"])
+    with pytest.raises(ValueError):
+        memmap.extend(["c", "d", "a"])
+    assert memmap.values[:] == ["a", "b"]
+    assert len(memmap) == 3
+    memmap.extend(["c", "a"])
+    assert memmap[:] == ["a", "b", "a", "c", "a"]
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from mmap_ninja import hash_index, storage
+from mmap_ninja.string import StringsMmap
+
+
+def test_index_of(tmp_path):
+    strs = [f"{i % 50} ünicode" for i in range(100)] + [""]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strs, hash_index=True)
+    assert memmap.index_of("7 ünicode") == 7
+    assert memmap.index_of("") == 100
+    assert memmap.contains("49 ünicode")
+    assert not memmap.contains("50 ünicode")
+    with pytest.raises(ValueError):
+        memmap.index_of("missing")
+    assert memmap.index_of_many(["3 ünicode", "missing", "3 ünicode"]).tolist() == [3, -1, 3]
+    assert memmap.index_of_many([]).tolist() == []
+
+    # The index is persisted.
+    memmap.close()
+    reopened = StringsMmap(tmp_path / "strings")
+    assert reopened.index_of("42 ünicode") == 42
+    assert len(reopened.hash_index) == len(strs)
+
+
+def test_collisions(tmp_path, monkeypatch):
+    # Every string hashes to one of two values, so the lookups have to probe and compare the bytes.
+    monkeypatch.setattr(
+        hash_index, "_hash_bytes", lambda encoded: np.array([len(s) % 2 for s in encoded], dtype=np.uint64)
+    )
+    strs = [str(i) for i in range(200)]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strs + strs, hash_index=True)
+    assert memmap.index_of_many(strs + ["200"]).tolist() == list(range(200)) + [-1]
+    memmap.extend(["x", "5", "yy"])
+    assert memmap.index_of_many(["x", "5", "yy"]).tolist() == [400, 5, 402]
+
+
+@pytest.mark.parametrize("compact_index", [False, True])
+def test_extend_and_append(tmp_path, compact_index):
+    memmap = StringsMmap.from_strings(tmp_path / "strings", ["a", "b"], compact_index=compact_index, hash_index=True)
+    capacity = len(memmap.hash_index.table)
+    memmap.append("c")
+    assert len(memmap.hash_index.table) == capacity
+    strs = [f"string {i}" for i in range(1000)]
+    memmap.extend(strs)
+    assert len(memmap.hash_index.table) > capacity
+    assert memmap.index_of("c") == 2
+    assert memmap.index_of_many(strs).tolist() == list(range(3, 1003))
+    memmap.close()
+    assert StringsMmap(tmp_path / "strings").index_of("string 999") == 1002
+
+
+def test_updates(tmp_path):
+    memmap = StringsMmap.from_strings(tmp_path / "strings", ["a", "b", "c", "b"], hash_index=True)
+    memmap.append("d")
+    memmap[1] = "a much longer value"
+    memmap[[0, 4]] = ["e", "a"]
+    assert memmap.index_of_many(["a much longer value", "b", "e", "a", "d"]).tolist() == [1, 3, 0, 4, -1]
+    memmap.close()
+    reopened = StringsMmap(tmp_path / "strings")
+    assert reopened.index_of("a much longer value") == 1
+    assert not reopened.contains("d")
+
+
+def test_updates_touch_only_their_slots(tmp_path):
+    strs = [f"string {i}" for i in range(1000)]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strs, hash_index=True)
+    table = memmap.hash_index.table
+    before = np.array(table)
+    memmap[[10, 500]] = ["new", "string 7"]
+    # The table is updated in place, and only the slots of the old and the new values (and of the strings which
+    # were shifted back into them) change.
+    assert memmap.hash_index.table.filename == table.filename
+    after = np.array(memmap.hash_index.table)
+    assert 0 < np.count_nonzero(after != before) <= 8
+    assert sorted(after[after >= 0].tolist()) == list(range(1000))
+    assert memmap.index_of_many(["new", "string 7", "string 10", "string 500"]).tolist() == [10, 7, -1, -1]
+
+
+def test_random_updates(tmp_path, monkeypatch):
+    # Few distinct hashes make long runs, so that removals have to shift strings back, also across the end.
+    monkeypatch.setattr(
+        hash_index, "_hash_bytes", lambda encoded: np.array([len(s) * 7 % 13 for s in encoded], dtype=np.uint64)
+    )
+    rng = np.random.default_rng(0)
+    strs = [str(v) for v in rng.integers(0, 30, size=6)]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strs, hash_index=True)
+    for _ in range(200):
+        idx = int(rng.integers(0, len(strs)))
+        strs[idx] = str(rng.integers(0, 300))
+        memmap[idx] = strs[idx]
+        queries = sorted(set(strs)) + ["missing"]
+        assert memmap.index_of_many(queries).tolist() == [strs.index(s) if s in strs else -1 for s in queries]
+
+
+def test_build(tmp_path):
+    strs = [f"{i}" * (i % 7) for i in range(300)]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strs)
+    assert memmap.hash_index is None
+    with pytest.raises(ValueError):
+        memmap.index_of("1")
+    memmap.build_hash_index(n_jobs=2)
+    assert memmap.index_of_many(strs).tolist() == [strs.index(s) for s in strs]
+
+    empty = StringsMmap.from_strings(tmp_path / "empty", [], hash_index=True)
+    assert not empty.contains("a")
+    empty.extend(["a", "b"])
+    assert empty.index_of("b") == 1
+
+
+def test_packed(tmp_path):
+    StringsMmap.from_strings(tmp_path / "strings", ["a", "b", "c"], hash_index=True)
+    storage.pack(tmp_path / "strings")
+    packed = StringsMmap(tmp_path / "strings")
+    assert packed.index_of("c") == 2
+    with pytest.raises(ValueError):
+        packed.build_hash_index()
+    with pytest.raises(ValueError):
+        packed[0] = "x"
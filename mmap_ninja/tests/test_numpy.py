@@ -2,6 +2,7 @@ import os
 import stat
 
 import numpy as np
+import pytest
 from mmap_ninja import generic, numpy as np_ninja
 
 
@@ -84,3 +85,91 @@ def test_read_only(tmp_path):
     memmap = np_ninja.open_existing(out_path, mode="r")
     for i, el in enumerate(arr):
         assert el == memmap[i]
+
+
+def test_growable(tmp_path):
+    np_ninja.from_ndarray(tmp_path / "growable", np.arange(3))
+    growable = np_ninja.GrowableMmap(tmp_path / "growable", min_capacity=4)
+    assert len(growable) == 3
+    assert growable.capacity == 3
+    for i in range(3, 20):
+        growable.append(i)
+    assert np.array_equal(growable.array, np.arange(20))
+    assert growable.capacity == 24
+    growable.extend(np.arange(20, 30))
+    assert growable[-1] == 29
+    assert growable.capacity == 48
+
+    memmap = np_ninja.open_existing(tmp_path / "growable")
+    assert np.array_equal(memmap, np.arange(30))
+    growable.close()
+    np_ninja.extend_dir(tmp_path / "growable", np.arange(30, 32))
+    assert np.array_equal(np_ninja.open_existing(tmp_path / "growable"), np.arange(32))
+
+    growable = np_ninja.GrowableMmap(tmp_path / "growable")
+    growable.close(trim=True)
+    assert (tmp_path / "growable" / "data.ninja").stat().st_size == 32 * np.dtype(np.int64).itemsize
+
+
+def test_growable_keeps_views_valid(tmp_path):
+    growable = np_ninja.GrowableMmap.empty(tmp_path / "growable", np.float32, sample_shape=(2, 3), mode="r")
+    assert growable.array.shape == (0, 2, 3)
+    growable.append(np.ones((2, 3)))
+    first = growable.array
+    growable.extend(np.zeros((5000, 2, 3)))
+    assert np.array_equal(first[0], np.ones((2, 3)))
+    assert growable.array.shape == (5001, 2, 3)
+    assert np_ninja.open_existing(tmp_path / "growable").shape == (5001, 2, 3)
+    with pytest.raises(AssertionError):
+        growable.append(np.ones(3))
+
+
+@pytest.mark.parametrize("pattern", list(np_ninja.ACCESS_PATTERNS))
+def test_advise(tmp_path, pattern):
+    memmap = np_ninja.from_ndarray(tmp_path / "advised", np.arange(100_000).reshape(-1, 10))
+    np_ninja.advise(memmap, pattern)
+    np_ninja.willneed(memmap, [0, 5, -1])
+    np_ninja.willneed(memmap[10:], slice(0, 20))
+    assert memmap[-1, -1] == 99_999
+    with pytest.raises(ValueError):
+        np_ninja.advise(memmap, "sometimes")
+
+
+def test_growable_reapplies_advice(tmp_path, monkeypatch):
+    calls = []
+    advise = np_ninja.advise
+    monkeypatch.setattr(np_ninja, "advise", lambda arr, pattern: calls.append(pattern) or advise(arr, pattern))
+    growable = np_ninja.GrowableMmap.empty(tmp_path / "growable", np.int64, min_capacity=4)
+    growable.extend(np.arange(3))
+    growable.advise("random")
+    growable.extend(np.arange(3, 10))
+    assert calls == ["random", "random"]
+    assert np.array_equal(growable.array, np.arange(10))
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 1000])
+def test_from_generator_streaming(tmp_path, batch_size):
+    samples = [np.full((2, 3), i, dtype=np.int32) for i in range(50)]
+    memmap = np_ninja.from_generator(tmp_path / "streamed", iter(samples), batch_size=batch_size)
+    assert memmap.shape == (50, 2, 3)
+    assert memmap.dtype == np.int32
+    assert np.array_equal(memmap, np.stack(samples))
+    assert (tmp_path / "streamed" / "data.ninja").stat().st_size == memmap.nbytes
+    assert np_ninja.from_generator(tmp_path / "empty", iter([]), batch_size=batch_size) is None
+    with pytest.raises(AssertionError):
+        np_ninja.from_generator(tmp_path / "mismatch", iter([np.ones(2), np.ones(3)]), batch_size=batch_size)
+    widened = np_ninja.from_generator(tmp_path / "widened", iter([np.ones(2), np.arange(2)]), batch_size=batch_size)
+    assert widened.dtype == np.float64
+    with pytest.raises(ValueError):
+        np_ninja.from_generator(tmp_path / "cast", iter([np.arange(2), np.full(2, 0.5)]), batch_size=batch_size)
+
+
+def test_vectored_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(np_ninja, "_WRITE_CHUNK", 100)
+    path = tmp_path / "data.bin"
+    with np_ninja._VectoredWriter(path, truncate=True) as writer:
+        for i in range(100):
+            writer.write(np.arange(i, dtype=np.int16))
+            writer.write(np.asfortranarray(np.ones((2, 2), dtype=np.int16)))
+    expected = np.concatenate([np.concatenate([np.arange(i), np.ones(4)]) for i in range(100)]).astype(np.int16)
+    assert np.array_equal(np.fromfile(path, dtype=np.int16), expected)
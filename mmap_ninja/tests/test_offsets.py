@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from mmap_ninja import offsets as offsets_module
+from mmap_ninja.offsets import CompactOffsets, OffsetsView
+from mmap_ninja.storage import DirectoryStore
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    # Blocks of 4 offsets and "uint32" deltas which have to be below 1000, to exercise every encoding.
+    monkeypatch.setattr(offsets_module, "_BLOCK_SHIFT", 2)
+    monkeypatch.setattr(offsets_module, "_UINT32_LIMIT", 1000)
+
+
+def open_offsets(tmp_path):
+    return CompactOffsets.open(DirectoryStore(tmp_path))
+
+
+@pytest.mark.parametrize(
+    "lengths, values_dtype, has_bases",
+    [([3, 5, 0, 7], np.uint32, False), ([300] * 10, np.uint32, True), ([300, 2000, 1], np.int64, False)],
+)
+def test_encodings(tmp_path, small_limits, lengths, values_dtype, has_bases):
+    expected = np.concatenate([[0], np.cumsum(lengths)])
+    CompactOffsets.save(tmp_path / "offsets", expected)
+    offsets = open_offsets(tmp_path)
+    assert offsets.values.dtype == values_dtype
+    assert (offsets.bases is not None) == has_bases
+    assert np.array_equal(np.asarray(offsets), expected)
+    assert offsets[-1] == expected[-1]
+    assert [offsets[i] for i in range(len(expected))] == expected.tolist()
+
+
+def test_extend_changes_encoding(tmp_path, small_limits):
+    expected = np.array([0, 10, 20])
+    CompactOffsets.save(tmp_path / "offsets", expected)
+    offsets = open_offsets(tmp_path)
+    for lengths in [[5] * 3, [400] * 6, [100] * 9, [5000]]:
+        expected = np.concatenate([expected, expected[-1] + np.cumsum(lengths)])
+        offsets.extend(expected[-len(lengths) :])
+        assert np.array_equal(np.asarray(offsets), expected)
+        assert np.array_equal(np.asarray(open_offsets(tmp_path)), expected)
+    assert offsets.values.dtype == np.int64
+
+
+def test_extend_block_deltas_in_place(tmp_path, monkeypatch):
+    expected = 2**33 + 3 * np.arange(200_001, dtype=np.int64)
+    CompactOffsets.save(tmp_path / "offsets", expected)
+    offsets = open_offsets(tmp_path)
+    bases = np.array(offsets.bases)
+    assert offsets.values.dtype == np.uint32 and len(bases) == 4
+
+    def encode_again(*args):
+        raise AssertionError("The offsets should be extended in place!")
+
+    monkeypatch.setattr(CompactOffsets, "save", encode_again)
+    for n_new in [5, 2**16, 1]:
+        new = expected[-1] + 3 * np.arange(1, n_new + 1)
+        expected = np.concatenate([expected, new])
+        offsets.extend(new)
+        assert np.array_equal(np.asarray(offsets), expected)
+    reopened = open_offsets(tmp_path)
+    assert np.array_equal(np.asarray(reopened), expected)
+    assert reopened.values.dtype == np.uint32
+    assert np.array_equal(reopened.bases[: len(bases)], bases)
+    assert len(reopened.bases) == (len(expected) - 1 >> 16) + 1
+
+
+def test_offsets_view(tmp_path):
+    lengths = np.array([3, 0, 5, 2, 7])
+    expected = np.concatenate([[0], np.cumsum(lengths)])
+    CompactOffsets.save(tmp_path / "offsets", expected)
+    offsets = open_offsets(tmp_path)
+    starts, ends, view_lengths = [OffsetsView(offsets, kind) for kind in ("starts", "ends", "lengths")]
+    mask = np.array([True, False, True, False, True])
+    for item in [0, -1, slice(None), slice(1, 4), slice(None, None, -2), [4, 0, 4], mask]:
+        assert np.array_equal(starts[item], expected[:-1][item])
+        assert np.array_equal(ends[item], expected[1:][item])
+        assert np.array_equal(view_lengths[item], lengths[item])
+    assert len(starts) == 5
+    assert list(ends) == expected[1:].tolist()
+    with pytest.raises(IndexError):
+        starts[5]
+    with pytest.raises(IndexError):
+        ends[[0, -6]]
+
+
+def test_in_memory_offsets_of_moved_samples():
+    contiguous = offsets_module.InMemoryOffsets(np.array([0, 2, 5]), np.array([2, 5, 6]))
+    assert contiguous.offsets.tolist() == [0, 2, 5, 6]
+    moved = offsets_module.InMemoryOffsets(np.array([0, 6, 2]), np.array([1, 9, 5]))
+    assert moved.offsets is None
+    assert len(moved) == 3
+    assert (moved.starts[1], moved.ends[1]) == (6, 9)
+    starts, ends = moved.lookup(np.array([2, 0]))
+    assert starts.tolist() == [2, 0] and ends.tolist() == [5, 1]
@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from mmap_ninja import generic, storage
+from mmap_ninja import numpy as np_ninja
+from mmap_ninja.base import Wrapped
+from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja.string import StringsMmap
+
+
+def make_containers(tmp_path):
+    samples = [np.arange(i * 100).reshape(-1, 10) for i in range(1, 200)]
+    ragged = RaggedMmap.from_lists(tmp_path / "ragged", samples, in_memory_index=True)
+    ragged.advise("random")
+    strings = StringsMmap.from_strings(tmp_path / "strings", [str(i) * 100 for i in range(1000)])
+    np_ninja.from_ndarray(tmp_path / "numpy", np.arange(100_000))
+    memmap = np_ninja.open_existing(tmp_path / "numpy")
+    # Touch every container, so that their files are open and mapped when they are pickled.
+    assert ragged[5].shape == (60, 10) and strings[3] == "3" * 100 and memmap[-1] == 99_999
+    return ragged, strings, memmap, Wrapped(ragged, wrapper_fn=list)
+
+
+def test_payload_is_small(tmp_path):
+    for container in make_containers(tmp_path):
+        payload = pickle.dumps(container)
+        assert len(payload) < 500
+        unpickled = pickle.loads(payload)
+        assert len(unpickled) == len(container)
+        for idx in [0, 7, -1]:
+            assert np.array_equal(np.asarray(unpickled[idx]), np.asarray(container[idx]))
+    ragged = pickle.loads(pickle.dumps(make_containers(tmp_path)[0]))
+    assert ragged.advice == "random" and ragged.in_memory_index
+
+
+def test_packed_payload_is_small(tmp_path):
+    np_ninja.from_ndarray(tmp_path / "numpy", np.arange(100_000))
+    storage.pack(tmp_path / "numpy")
+    (tmp_path / "nested").mkdir()
+    np_ninja.from_ndarray(tmp_path / "nested" / "inner", np.arange(50))
+    storage.pack(tmp_path / "nested")
+    for memmap, expected in [
+        (generic.open_existing(tmp_path / "numpy"), np.arange(100_000)),
+        (np_ninja.open_existing(tmp_path / "numpy"), np.arange(100_000)),
+        (storage.open_store(tmp_path / "nested").child("inner").open_array(), np.arange(50)),
+    ]:
+        payload = pickle.dumps(memmap)
+        assert len(payload) < 500
+        assert np.array_equal(pickle.loads(payload), expected)
+
+
+def test_views_pickle_their_contents(tmp_path):
+    np_ninja.from_ndarray(tmp_path / "numpy", np.arange(100))
+    memmap = np_ninja.open_existing(tmp_path / "numpy", mode="r+")
+    view = memmap[10:20]
+    assert np.array_equal(pickle.loads(pickle.dumps(view)), np.arange(10, 20))
+    assert np.array_equal(pickle.loads(pickle.dumps(memmap + 1)), np.arange(1, 101))
+
+
+def read_in_worker(container):
+    return [np.asarray(container[idx]).tolist() for idx in [1, -1]]
+
+
+def test_multiprocessing(tmp_path):
+    containers = make_containers(tmp_path)
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        results = pool.map(read_in_worker, containers)
+    assert results == [read_in_worker(container) for container in containers]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_handles_are_reopened_after_fork(tmp_path):
+    ragged, strings, _, _ = make_containers(tmp_path)
+    assert "buffer" in vars(strings) and "memmap" in vars(ragged)
+    pid = os.fork()
+    if pid == 0:
+        ok = "buffer" not in vars(strings) and "memmap" not in vars(ragged)
+        ok = ok and strings[3] == "3" * 100 and ragged[5].shape == (60, 10)
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert "buffer" in vars(strings)
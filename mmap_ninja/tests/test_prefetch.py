@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from mmap_ninja import numpy as np_ninja
+from mmap_ninja.prefetch import prefetch, Prefetcher
+from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja.string import StringsMmap
+
+
+def test_prefetch_ragged(tmp_path):
+    samples = [np.arange(i) for i in range(1, 200)]
+    mmap = RaggedMmap.from_lists(tmp_path / "ragged", samples)
+    order = np.random.default_rng(0).permutation(len(samples))
+    with prefetch(RaggedMmap(tmp_path / "ragged"), order, lookahead=8) as it:
+        assert len(it) == len(samples)
+        for idx, sample in zip(order, it):
+            assert np.array_equal(sample, samples[idx])
+            assert not isinstance(sample, np.memmap)
+        assert it.stats.hits + it.stats.stalls == len(samples)
+    assert len(mmap) == len(samples)
+
+
+def test_prefetch_strings(tmp_path):
+    strs = [f"sample {i}" for i in range(100)]
+    StringsMmap.from_strings(tmp_path / "strings", strs)
+    order = list(range(99, -1, -3))
+    assert list(prefetch(StringsMmap(tmp_path / "strings"), order, lookahead=4, n_workers=3)) == [
+        strs[i] for i in order
+    ]
+
+
+def test_prefetch_numpy(tmp_path):
+    arr = np.arange(1000).reshape(100, 10)
+    memmap = np_ninja.from_ndarray(tmp_path / "numpy", arr)
+    it = Prefetcher(memmap, range(100), lookahead=1)
+    assert np.array_equal(np.stack(list(it)), arr)
+    assert list(it) == []
+    assert list(prefetch(memmap, [])) == []
+    with pytest.raises(ValueError):
+        prefetch(memmap, [0], lookahead=0)
+
+
+def test_prefetch_propagates_errors(tmp_path):
+    memmap = np_ninja.from_ndarray(tmp_path / "numpy", np.arange(10))
+    with prefetch(memmap, [0, 100]) as it:
+        assert next(it) == 0
+        with pytest.raises(IndexError):
+            next(it)
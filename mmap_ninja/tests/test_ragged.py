@@ -1,11 +1,12 @@
 import os
+import shutil
 import stat
 
 import numpy as np
 import pytest
 
-from mmap_ninja import generic
-from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja import generic, numpy
+from mmap_ninja.ragged import RaggedMmap, ShapesTable
 from joblib import delayed, Parallel
 
 
@@ -66,6 +67,31 @@ def test_get_multiple_case(tmp_path):
         assert np.allclose(result[i], simple[i])
 
 
+def test_get_multiple_matches_get_single(tmp_path):
+    rng = np.random.default_rng(0)
+    simple = [rng.integers(-100, 100, size=rng.integers(0, 10)) for _ in range(50)]
+    mmap = RaggedMmap.from_lists(tmp_path / "simple", simple)
+    indices = np.concatenate([rng.integers(0, 50, size=64), [3, 3, 4, 5, 49, 0]])
+    result = mmap[indices]
+    assert len(result) == len(indices)
+    for idx, sample in zip(indices, result):
+        assert np.array_equal(sample, simple[idx])
+        assert np.array_equal(sample, mmap.get_single(idx))
+    assert mmap[[]] == []
+
+
+def test_get_multiple_nd_and_scalars(tmp_path):
+    simple = [np.array([[11, 13], [-1, 17]]), np.array([2, 3]), np.array([[90], [12]])]
+    mmap = RaggedMmap.from_lists(tmp_path / "nd", simple)
+    result = mmap[[2, 0, 2]]
+    assert np.array_equal(result[0], simple[2])
+    assert np.array_equal(result[1], simple[0])
+    assert np.array_equal(result[2], simple[2])
+
+    scalars = RaggedMmap.from_lists(tmp_path / "scalars", [1, 2, 3])
+    assert scalars[::-1] == [3, 2, 1]
+
+
 def test_wrapper(tmp_path):
     simple = [np.array([11, 13, -1, 17]), np.array([2, 3, 4, 19]), np.array([90, 12])]
     mmap = RaggedMmap.from_lists(tmp_path / "simple", simple, wrapper_fn=lambda x: np.array(x, dtype=np.int8))
@@ -231,3 +257,285 @@ def test_wrapper_fn_without_copy(tmp_path, np_array_with_different_number_of_axe
     mmap = RaggedMmap(tmp_path / "base", wrapper_fn=lambda x: x, copy_before_wrapper_fn=False)
     for i in range(2):
         sample = mmap[i]
+
+
+@pytest.mark.parametrize("in_memory_index", [False, True])
+def test_in_memory_index(tmp_path, in_memory_index):
+    simple = [np.array([11, 13, -1, 17]), np.array([2, 3]), np.array([]), np.array([90, 12])]
+    RaggedMmap.from_lists(tmp_path / "flat", simple)
+    mmap = RaggedMmap(tmp_path / "flat", in_memory_index=in_memory_index)
+    assert (mmap.offsets is not None) == in_memory_index
+    for i in range(-len(simple), len(simple)):
+        assert np.array_equal(mmap[i], simple[i])
+    assert all(np.array_equal(a, b) for a, b in zip(mmap[::-1], simple[::-1]))
+    mmap.extend([np.array([5, 6, 7])])
+    assert np.array_equal(mmap[-1], [5, 6, 7])
+
+    nd = [np.array([[11, 13], [-1, 17]]), np.array([2, 3]), np.array([[90], [12]])]
+    mmap = RaggedMmap.from_lists(tmp_path / "nd", nd, in_memory_index=in_memory_index)
+    for i in range(len(nd)):
+        assert np.array_equal(mmap[i], nd[i])
+
+    scalars = RaggedMmap.from_lists(tmp_path / "scalars", [1, 2, 3], in_memory_index=in_memory_index)
+    assert [scalars[i] for i in range(3)] == [1, 2, 3]
+    with pytest.raises(IndexError):
+        scalars[3]
+
+
+def test_many_small_extends(tmp_path):
+    mmap = RaggedMmap(tmp_path / "streamed")
+    samples = [np.arange(i % 7) for i in range(500)]
+    for sample in samples:
+        mmap.append(sample)
+    assert len(mmap) == 500
+    reopened = RaggedMmap(tmp_path / "streamed")
+    assert len(reopened) == 500
+    for i, sample in enumerate(samples):
+        assert np.array_equal(mmap[i], sample)
+        assert np.array_equal(reopened[i], sample)
+
+
+def test_fields_are_loaded_lazily(tmp_path):
+    simple = [np.array([[11, 13], [-1, 17]]), np.array([2, 3]), np.array([[90], [12]])]
+    RaggedMmap.from_lists(tmp_path / "lazy", simple)
+    mmap = RaggedMmap(tmp_path / "lazy")
+    assert not any(name in vars(mmap) for name in RaggedMmap._lazy_fields)
+    assert len(mmap) == 3
+    # The first use opens all of the persisted fields together, but not the in-memory index.
+    assert "memmap" in vars(mmap) and "shapes" in vars(mmap) and "offsets" not in vars(mmap)
+    assert np.array_equal(mmap[0], simple[0])
+
+
+def test_index_normalization(tmp_path):
+    simple = [np.array([i]) for i in range(5)]
+    mmap = RaggedMmap.from_lists(tmp_path / "indices", simple)
+    assert [x[0] for x in mmap[-2:]] == [3, 4]
+    assert [x[0] for x in mmap[[-1, 0]]] == [4, 0]
+    assert [x[0] for x in mmap[np.array([True, False, True, False, False])]] == [0, 2]
+    assert [x[0] for x in mmap[np.arange(5, dtype=np.uint8)[::2]]] == [0, 2, 4]
+    with pytest.raises(IndexError):
+        mmap[[5]]
+    with pytest.raises(IndexError):
+        mmap[[-6]]
+    with pytest.raises(IndexError):
+        mmap[np.array([True, False])]
+    with pytest.raises(IndexError):
+        mmap[[0.5]]
+
+
+def test_advise(tmp_path, monkeypatch):
+    calls = []
+    advise = numpy.advise
+    monkeypatch.setattr(numpy, "advise", lambda arr, pattern: calls.append(pattern) or advise(arr, pattern))
+    simple = [np.array([[11, 13], [-1, 17]]), np.array([2, 3]), np.array([[90], [12]])]
+    RaggedMmap.from_lists(tmp_path / "advised", simple)
+    mmap = RaggedMmap(tmp_path / "advised")
+    mmap.advise("random")
+    assert calls == []
+    assert np.array_equal(mmap[0], simple[0])
+    assert len(calls) > 0
+    assert mmap.shapes.table.shape == (3, 3)
+    mmap.willneed([2, 0])
+    mmap.willneed(slice(None))
+    mmap.extend([np.array([1])])
+    assert all(growable.advice == "random" for growable in mmap._growables.values())
+    assert np.array_equal(mmap[3], np.array([1]))
+    with pytest.raises(ValueError):
+        mmap.advise("sometimes")
+
+
+@pytest.mark.parametrize("n_jobs", [None, 2])
+def test_from_indexable_direct_write(tmp_path, n_jobs):
+    samples = [np.arange(i * 6).reshape(-1, 2, 3) for i in range(20)]
+    flat = [np.arange(i) if i % 3 else np.float32(i) for i in range(20)]
+    flat_memmap = RaggedMmap.from_indexable(tmp_path / "flat", flat, batch_size=4, n_jobs=n_jobs, direct_write=True)
+    assert [np.array_equal(flat_memmap[i], sample) for i, sample in enumerate(flat)] == [True] * 20
+    memmap = RaggedMmap.from_indexable(
+        tmp_path / "direct", samples, batch_size=3, n_jobs=n_jobs, direct_write=True, dtype=np.float32
+    )
+    assert len(memmap) == 20
+    assert memmap.memmap.dtype == np.float32
+    for i, sample in enumerate(samples):
+        assert np.array_equal(memmap[i], sample)
+    expected = RaggedMmap.from_lists(tmp_path / "lists", samples, dtype=np.float32)
+    assert np.array_equal(memmap.starts, expected.starts)
+    assert np.array_equal(memmap.flattened_shapes, expected.flattened_shapes)
+    assert RaggedMmap.from_indexable(tmp_path / "empty", [], batch_size=3, direct_write=True) is None
+    with pytest.raises(ValueError):
+        RaggedMmap.from_indexable(tmp_path / "no_len", lambda i: samples[i], batch_size=3, direct_write=True)
+    compact = RaggedMmap.from_indexable(
+        tmp_path / "compact", samples, batch_size=3, n_jobs=n_jobs, direct_write=True, compact_index=True
+    )
+    assert compact.compact_offsets is not None
+    assert all(np.array_equal(compact[i], sample) for i, sample in enumerate(samples))
+    all_empty = [np.empty((0, 3)), np.empty(0)]
+    empty_samples = RaggedMmap.from_indexable(tmp_path / "all_empty", all_empty, batch_size=1, direct_write=True)
+    assert [sample.shape for sample in empty_samples[:]] == [(0, 3), (0,)]
+    empty_samples.append(np.arange(2.0))
+    assert RaggedMmap(tmp_path / "all_empty")[2].tolist() == [0.0, 1.0]
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 1000])
+def test_from_generator_streaming(tmp_path, batch_size):
+    nd = [np.arange(i * 6).reshape(-1, 2, 3) for i in range(1, 20)] + [np.arange(4)]
+    flat = [np.arange(i) for i in range(1, 20)] + [np.float64(7)]
+    for name, samples in [("nd", nd), ("flat", flat)]:
+        streamed = RaggedMmap.from_generator(tmp_path / f"{name}_gen", iter(samples), batch_size=batch_size)
+        expected = RaggedMmap.from_lists(tmp_path / f"{name}_lists", samples)
+        assert len(streamed) == len(samples)
+        for i, sample in enumerate(samples):
+            assert np.array_equal(streamed[i], sample)
+        for key in ["starts", "ends", "flattened_shapes", "shapes"]:
+            streamed_files = sorted(os.listdir(tmp_path / f"{name}_gen" / key))
+            assert streamed_files == sorted(os.listdir(tmp_path / f"{name}_lists" / key))
+        assert streamed.shapes_are_flat == expected.shapes_are_flat
+        assert np.array_equal(streamed.starts, expected.starts)
+        assert np.array_equal(streamed.ends, expected.ends)
+        assert np.array_equal(streamed.memmap, expected.memmap)
+        assert (tmp_path / f"{name}_gen" / "starts" / "data.ninja").stat().st_size == 8 * len(samples)
+    with pytest.raises(ValueError):
+        RaggedMmap.from_generator(tmp_path / "empty", iter([]), batch_size=batch_size)
+    empty = RaggedMmap.from_generator(tmp_path / "empty", iter([]), batch_size=batch_size, dtype=np.int32)
+    assert len(empty) == 0
+    empty.extend([np.arange(3)])
+    assert RaggedMmap(tmp_path / "empty")[0].tolist() == [0, 1, 2]
+
+
+def test_from_generator_kwargs(tmp_path):
+    samples = [np.arange(i * 6).reshape(-1, 2, 3) for i in range(1, 10)]
+    memmap = RaggedMmap.from_generator(
+        tmp_path / "compact", iter(samples), batch_size=4, compact_index=True, in_memory_index=True, starts_key="s"
+    )
+    assert memmap.in_memory_index
+    assert memmap.compact_offsets is not None
+    assert not (tmp_path / "compact" / "flattened_shapes").exists()
+    for actual, expected in zip(memmap[:], samples):
+        assert np.array_equal(actual, expected)
+    memmap = RaggedMmap.from_generator(tmp_path / "keys", iter(samples), batch_size=4, starts_key="s")
+    assert memmap.starts_key == "s" and (tmp_path / "keys" / "s").exists()
+    assert np.array_equal(memmap[3], samples[3])
+
+
+def test_compact_index(tmp_path):
+    samples = [np.arange(i * 6).reshape(-1, 2, 3) for i in range(20)]
+    memmap = RaggedMmap.from_lists(tmp_path / "compact", samples, compact_index=True)
+    assert not (tmp_path / "compact" / "starts").exists()
+    assert not (tmp_path / "compact" / "flattened_shapes").exists()
+    assert memmap.compact_offsets.values.dtype == np.uint32
+    assert memmap.compact_offsets.nbytes == 21 * 4
+    expected = RaggedMmap.from_lists(tmp_path / "expected", samples)
+    assert np.array_equal(memmap.starts, expected.starts)
+    assert np.array_equal(memmap.flattened_shapes[3:7], expected.flattened_shapes[3:7])
+    for in_memory_index in [False, True]:
+        reopened = RaggedMmap(tmp_path / "compact", in_memory_index=in_memory_index)
+        for i, sample in enumerate(samples):
+            assert np.array_equal(reopened[i], sample)
+        for i, sample in zip([-1, 3, 3], reopened[[-1, 3, 3]]):
+            assert np.array_equal(sample, samples[i])
+    for _ in range(3):
+        memmap.extend([np.ones((1, 2, 3))])
+    assert len(memmap) == 23
+    assert np.array_equal(RaggedMmap(tmp_path / "compact")[-1], np.ones((1, 2, 3)))
+
+
+def test_shapes_table(tmp_path):
+    samples = [np.ones((2, 3)), np.ones((4, 1, 2)), np.ones((5, 1))]
+    memmap = RaggedMmap.from_lists(tmp_path / "table", samples)
+    assert isinstance(memmap.shapes, ShapesTable)
+    assert np.array_equal(memmap.shapes.table, [[2, 2, 3, 0], [3, 4, 1, 2], [2, 5, 1, 0]])
+    assert memmap.shapes[1] == (4, 1, 2)
+    assert memmap.shapes[[2, 0]] == [(5, 1), (2, 3)]
+    assert np.array_equal(memmap.shapes.ndims, [2, 3, 2])
+    memmap.extend([np.ones((1, 2)), np.ones((1, 1, 1, 3))])
+    memmap.append(np.ones((3, 3)))
+    samples += [np.ones((1, 2)), np.ones((1, 1, 1, 3)), np.ones((3, 3))]
+    for in_memory_index in [False, True]:
+        reopened = RaggedMmap(tmp_path / "table", in_memory_index=in_memory_index)
+        assert reopened.shapes.table.shape == (6, 5)
+        assert [sample.shape for sample in reopened[:]] == [sample.shape for sample in samples]
+        assert [reopened[i].shape for i in range(6)] == [sample.shape for sample in samples]
+
+
+def test_nested_shapes_are_still_readable(tmp_path):
+    samples = [np.arange(6).reshape(2, 3), np.arange(8).reshape(2, 2, 2)]
+    RaggedMmap.from_lists(tmp_path / "legacy", samples)
+    shutil.rmtree(tmp_path / "legacy" / "shapes")
+    RaggedMmap.from_lists(tmp_path / "legacy" / "shapes", [np.array(sample.shape) for sample in samples])
+    for in_memory_index in [False, True]:
+        memmap = RaggedMmap(tmp_path / "legacy", in_memory_index=in_memory_index)
+        assert isinstance(memmap.shapes, RaggedMmap)
+        assert [np.array_equal(memmap[i], sample) for i, sample in enumerate(samples)] == [True, True]
+        assert [np.array_equal(x, sample) for x, sample in zip(memmap[:], samples)] == [True, True]
+
+
+@pytest.mark.parametrize("in_memory_index", [False, True])
+def test_get_padded(tmp_path, in_memory_index):
+    tokens = [np.arange(1, n + 1, dtype=np.int32) for n in [3, 1, 5, 0, 2]]
+    memmap = RaggedMmap.from_lists(tmp_path / "tokens", tokens, in_memory_index=in_memory_index)
+    batch, lengths = memmap.get_padded([2, 0, 3], pad_value=-1)
+    assert batch.dtype == np.int32
+    assert np.array_equal(batch, [[1, 2, 3, 4, 5], [1, 2, 3, -1, -1], [-1] * 5])
+    assert np.array_equal(lengths, [5, 3, 0])
+    batch, lengths = memmap.get_padded(slice(0, 3), max_len=2, dtype=np.float64)
+    assert np.array_equal(batch, [[1, 2], [1, 0], [1, 2]])
+    assert np.array_equal(lengths, [2, 1, 2])
+
+    audio = [np.arange(n * 2).reshape(n, 2) for n in [4, 2, 3]]
+    memmap = RaggedMmap.from_lists(tmp_path / "audio", audio, in_memory_index=in_memory_index)
+    out = np.full((2, 4, 2), 7)
+    for indices in [[1, 2], [0, 1]]:
+        batch, lengths = memmap.get_padded(indices, out=out)
+        assert batch is out
+        for row, idx, length in zip(batch, indices, lengths):
+            assert length == len(audio[idx])
+            assert np.array_equal(row[:length], audio[idx])
+            assert (row[length:] == 0).all()
+    with pytest.raises(ValueError):
+        memmap.get_padded([0, 1, 2], out=out)
+    memmap.append(np.zeros((2, 3)))
+    with pytest.raises(ValueError):
+        memmap.get_padded([0, 3])
+
+
+@pytest.mark.parametrize("in_memory_index", [False, True])
+def test_variable_length_updates(tmp_path, in_memory_index):
+    samples = [np.arange(6).reshape(2, 3), np.ones((4, 3)), np.zeros((1, 3)), np.full((3, 3), 7.0)]
+    memmap = RaggedMmap.from_lists(tmp_path / "ragged", samples, mode="r+", in_memory_index=in_memory_index)
+    memmap[1] = np.full((1, 3), 2.0)
+    memmap[[2, 0]] = [np.arange(12).reshape(2, 2, 3), np.ones((2, 3))]
+    samples[1], samples[2], samples[0] = np.full((1, 3), 2.0), np.arange(12).reshape(2, 2, 3), np.ones((2, 3))
+    for actual, expected in zip(memmap[:], samples):
+        assert np.array_equal(actual, expected)
+    assert memmap.dead_nbytes == (9 + 3) * 8
+    memmap.extend([np.ones((1, 3))])
+    samples.append(np.ones((1, 3)))
+    reopened = RaggedMmap(tmp_path / "ragged", in_memory_index=in_memory_index)
+    for actual, expected in zip(reopened[:], samples):
+        assert np.array_equal(actual, expected)
+    assert reopened.dead_nbytes == 12 * 8
+
+
+def test_variable_length_updates_of_flat_samples(tmp_path):
+    memmap = RaggedMmap.from_lists(tmp_path / "flat", [np.arange(3), np.arange(5)], mode="r+")
+    memmap[0] = np.arange(10)
+    memmap[1] = np.arange(2)
+    assert [sample.tolist() for sample in memmap[:]] == [list(range(10)), [0, 1]]
+    with pytest.raises(ValueError):
+        memmap[0] = np.ones((2, 2))
+    compact = RaggedMmap.from_lists(tmp_path / "compact", [np.arange(3)], mode="r+", compact_index=True)
+    compact[0] = np.arange(3) + 1
+    assert compact[0].tolist() == [1, 2, 3]
+    with pytest.raises(ValueError):
+        compact[0] = np.arange(4)
+
+
+def test_close_releases_unused_capacity(tmp_path):
+    memmap = RaggedMmap.from_lists(tmp_path / "ragged", [np.arange(3)])
+    memmap.extend([np.arange(5), np.arange(2)])
+    assert (tmp_path / "ragged" / "data.ninja").stat().st_size > 10 * 8
+    memmap.close()
+    assert (tmp_path / "ragged" / "data.ninja").stat().st_size == 10 * 8
+    assert (tmp_path / "ragged" / "starts" / "data.ninja").stat().st_size == 3 * 8
+    assert memmap[2].tolist() == [0, 1]
+    memmap.append(np.arange(4))
+    assert RaggedMmap(tmp_path / "ragged")[3].tolist() == [0, 1, 2, 3]
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from mmap_ninja import numpy as np_ninja
+from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja.sampler import BlockShuffleSampler
+from mmap_ninja.string import StringsMmap
+
+
+def test_block_shuffle_ragged(tmp_path):
+    rng = np.random.default_rng(0)
+    samples = [np.ones(length, dtype=np.float32) for length in rng.integers(1, 100, size=1000)]
+    mmap = RaggedMmap.from_lists(tmp_path / "ragged", samples)
+    sampler = BlockShuffleSampler(mmap, block_nbytes=4096, window_blocks=2, seed=3)
+    assert len(sampler) == 1000
+    assert sampler.n_blocks == int(np.ceil(mmap.ends[-1] * 4 / 4096))
+    first = sampler.indices()
+    assert np.array_equal(np.sort(first), np.arange(1000))
+    assert np.array_equal(first, BlockShuffleSampler(mmap, block_nbytes=4096, window_blocks=2, seed=3).indices())
+    assert not np.array_equal(first, sampler.indices(epoch=1))
+    sampler.set_epoch(1)
+    assert list(sampler) == sampler.indices(epoch=1).tolist()
+
+    # With windows of one block, the samples of every block are consumed together.
+    block_of = (np.asarray(mmap.starts) * 4) // 4096
+    order = BlockShuffleSampler(mmap, block_nbytes=4096, window_blocks=1).indices()
+    assert np.count_nonzero(np.diff(block_of[order])) == sampler.n_blocks - 1
+    assert not np.array_equal(block_of[order], np.sort(block_of))
+
+
+def test_block_shuffle_numpy_and_strings(tmp_path):
+    memmap = np_ninja.from_ndarray(tmp_path / "numpy", np.zeros((100, 16), dtype=np.int64))
+    sampler = BlockShuffleSampler(memmap, block_nbytes=1024, window_blocks=1)
+    assert sampler.n_blocks == 13
+    order = sampler.indices()
+    assert np.array_equal(np.sort(order), np.arange(100))
+    assert len(np.unique(order[:8] // 8)) == 1
+
+    strings = StringsMmap.from_strings(tmp_path / "strings", ["a" * 100] * 50)
+    assert BlockShuffleSampler(strings, block_nbytes=1000).n_blocks == 5
+    assert len(BlockShuffleSampler(StringsMmap(tmp_path / "empty")).indices()) == 0
+    with pytest.raises(ValueError):
+        BlockShuffleSampler(memmap, block_nbytes=0)
+
+
+def test_block_shuffle_skips_deleted_samples(tmp_path):
+    samples = [np.full(i + 1, i) for i in range(10)]
+    mmap = RaggedMmap.from_lists(tmp_path / "ragged", samples, mode="r+")
+    mmap.delete([0, 1, 2])
+    sampler = BlockShuffleSampler(mmap, block_nbytes=16, seed=1)
+    assert len(sampler) == 7
+    indices = sampler.indices()
+    assert np.array_equal(np.sort(indices), np.arange(7))
+    assert sorted(int(mmap[i][0]) for i in indices) == list(range(3, 10))
+    strings = StringsMmap.from_strings(tmp_path / "strings", [str(i) for i in range(10)])
+    strings.delete([9])
+    assert np.array_equal(np.sort(BlockShuffleSampler(strings, block_nbytes=2).indices()), np.arange(9))
@@ -0,0 +1,97 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from mmap_ninja import numpy as np_ninja, stats
+from mmap_ninja.base import Wrapped
+from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja.string import StringsMmap
+
+
+def test_histogram():
+    histogram = stats.Histogram()
+    for ns in [0, 1, 3, 900, 1000, 1023, 10**15]:
+        histogram.record(ns)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 7
+    assert snapshot["buckets"] == {2: 2, 4: 1, 1024: 3, 2**40: 1}
+    assert snapshot["p50_ns"] == 1024
+    assert snapshot["p99_ns"] == 2**40
+    assert stats.Histogram().snapshot()["p50_ns"] is None
+
+
+def test_access_stats_callback():
+    snapshots = []
+    recorder = stats.AccessStats(callback=snapshots.append, report_every=2)
+    for _ in range(5):
+        recorder.record("get_single", 1, 8, (("index", 10), ("data", 20)))
+    assert len(snapshots) == 2
+    assert snapshots[-1]["calls"] == {"get_single": 4}
+    snapshot = recorder.snapshot()
+    assert snapshot["n_samples"] == 5 and snapshot["n_bytes"] == 40
+    assert snapshot["latencies"]["total"]["total_ns"] == 150
+    recorder.reset()
+    assert recorder.snapshot()["calls"] == {}
+    with pytest.raises(ValueError):
+        stats.AccessStats(report_every=0)
+
+
+def test_resident_pages():
+    arr = np.ones(10_000, dtype=np.uint8)
+    resident, total = stats.resident_pages(arr.ctypes.data, arr.nbytes)
+    assert 3 <= total <= 4
+    assert resident == total
+
+
+def test_ragged(tmp_path):
+    samples = [np.arange(i * 6).reshape(-1, 2, 3) for i in range(1, 20)]
+    memmap = RaggedMmap.from_lists(tmp_path / "ragged", samples, wrapper_fn=np.sum)
+    assert memmap.stats() is None
+    memmap.enable_stats(residency_every=1)
+    assert memmap[3] == samples[3].sum()
+    assert memmap[[0, 5]] == [samples[0].sum(), samples[5].sum()]
+    snapshot = memmap.stats()
+    assert snapshot["calls"] == {"get_single": 1, "get_multiple": 1}
+    assert snapshot["n_samples"] == 3
+    assert snapshot["n_bytes"] == sum(samples[i].nbytes for i in [3, 0, 5])
+    assert set(snapshot["latencies"]) == {"index", "data", "wrapper_fn", "total"}
+    assert snapshot["sampled_pages"] > 0 and 0 <= snapshot["residency"] <= 1
+    memmap.disable_stats()
+    assert "get_single" not in vars(memmap) and memmap.stats() is None
+    assert memmap[3] == samples[3].sum()
+
+    in_memory = RaggedMmap(tmp_path / "ragged", in_memory_index=True)
+    in_memory.enable_stats()
+    assert np.array_equal(in_memory[-1], samples[-1])
+    assert in_memory.stats()["n_bytes"] == samples[-1].nbytes
+
+
+def test_strings(tmp_path):
+    strs = ["a", "bb", "ünicode"]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strs)
+    memmap.enable_stats(residency_every=1)
+    assert memmap[2] == strs[2]
+    assert memmap[:] == strs
+    snapshot = memmap.stats()
+    assert snapshot["calls"] == {"get_single": 1, "get_multiple": 1}
+    assert snapshot["n_samples"] == 4
+    assert snapshot["n_bytes"] == 8 + 11
+    assert "decode" in snapshot["latencies"]
+    memmap.close()
+
+
+def test_wrapped_and_instrument(tmp_path):
+    np_ninja.from_ndarray(tmp_path / "numpy", np.arange(100).reshape(10, 10))
+    memmap = np_ninja.open_existing(tmp_path / "numpy")
+    instrumented = stats.instrument(memmap, residency_every=1)
+    assert np.array_equal(instrumented[2:4], memmap[2:4])
+    assert instrumented.shape == (10, 10) and len(instrumented) == 10
+    assert instrumented.stats()["n_samples"] == 2
+    assert instrumented.stats()["n_bytes"] == 2 * memmap[0].nbytes
+
+    wrapped = Wrapped(memmap, wrapper_fn=list)
+    wrapped.enable_stats()
+    assert wrapped[1] == list(range(10, 20))
+    assert set(wrapped.stats()["latencies"]) == {"data", "wrapper_fn", "total"}
+    assert pickle.loads(pickle.dumps(wrapped)).stats() is None
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from mmap_ninja import generic, numpy as np_ninja, storage
+from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja.string import StringsMmap
+
+
+def test_pack_numpy(tmp_path):
+    arr = np.arange(12).reshape(4, 3)
+    np_ninja.from_ndarray(tmp_path / "numpy", arr)
+    storage.pack(tmp_path / "numpy")
+    assert [p.name for p in (tmp_path / "numpy").iterdir()] == [storage.PACKED_FILE]
+    assert np.array_equal(np_ninja.open_existing(tmp_path / "numpy"), arr)
+    assert np.array_equal(generic.open_existing(tmp_path / "numpy"), arr)
+
+
+@pytest.mark.parametrize("in_memory_index", [False, True])
+def test_pack_ragged(tmp_path, in_memory_index):
+    simple = [np.array([[11, 13], [-1, 17]]), np.array([2, 3]), np.array([[90], [12]])]
+    RaggedMmap.from_lists(tmp_path / "ragged", simple)
+    storage.pack(tmp_path / "ragged")
+    ragged = RaggedMmap(tmp_path / "ragged", in_memory_index=in_memory_index)
+    assert len(ragged) == len(simple)
+    for i, arr in enumerate(simple):
+        assert np.array_equal(ragged[i], arr)
+    assert np.array_equal(ragged[[2, 0]][0], simple[2])
+    assert isinstance(generic.open_existing(tmp_path / "ragged"), RaggedMmap)
+    with pytest.raises(ValueError):
+        ragged.append(np.array([1]))
+
+
+def test_pack_strings(tmp_path):
+    list_of_strings = ["Torba", "Boiler", "a", "zele pitka", "", "popo"]
+    StringsMmap.from_strings(tmp_path / "strings", list_of_strings)
+    storage.pack(tmp_path / "strings", tmp_path / "packed")
+    memmap = generic.open_existing(tmp_path / "packed")
+    assert [memmap[i] for i in range(len(list_of_strings))] == list_of_strings
+    memmap[0] = "Korba"
+    memmap.close()
+    assert StringsMmap(tmp_path / "packed", mode="rb")[0] == "Korba"
+    assert StringsMmap(tmp_path / "strings")[0] == "Torba"
+
+
+def test_pack_empty_data(tmp_path):
+    (tmp_path / "container").mkdir()
+    StringsMmap.from_strings(tmp_path / "container" / "strings", ["", ""])
+    np_ninja.from_ndarray(tmp_path / "container" / "tail", np.arange(100))
+    storage.pack(tmp_path / "container")
+    memmap = StringsMmap(storage.open_store(tmp_path / "container").child("strings"))
+    # An empty segment must not map the rest of the packed file.
+    assert len(memmap.buffer) == 0
+    assert memmap[:] == ["", ""]
+
+
+def test_pack_skips_unused_capacity(tmp_path):
+    np_ninja.from_ndarray(tmp_path / "growable", np.arange(3))
+    growable = np_ninja.GrowableMmap(tmp_path / "growable", min_capacity=100_000)
+    growable.append(3)
+    growable.close()
+    storage.pack(tmp_path / "growable")
+    assert (tmp_path / "growable" / storage.PACKED_FILE).stat().st_size < 100_000 * 8
+    assert np.array_equal(np_ninja.open_existing(tmp_path / "growable"), np.arange(4))
+
+
+def test_unpack(tmp_path):
+    simple = [np.array([[11, 13], [-1, 17]]), np.array([2, 3]), np.array([[90], [12]])]
+    RaggedMmap.from_lists(tmp_path / "ragged", simple)
+    storage.pack(tmp_path / "ragged")
+    with pytest.raises(ValueError):
+        storage.pack(tmp_path / "ragged")
+    storage.unpack(tmp_path / "ragged")
+    assert not (tmp_path / "ragged" / storage.PACKED_FILE).exists()
+    ragged = RaggedMmap(tmp_path / "ragged")
+    ragged.append(np.array([1, 2]))
+    for i, arr in enumerate(simple + [np.array([1, 2])]):
+        assert np.array_equal(ragged[i], arr)
+
+
+def test_open_store(tmp_path):
+    np_ninja.from_ndarray(tmp_path / "numpy", np.arange(3))
+    store = storage.open_store(tmp_path / "numpy")
+    assert not store.packed
+    assert storage.open_store(store) is store
+    storage.pack(tmp_path / "numpy")
+    store = storage.open_store(tmp_path / "numpy")
+    assert store.packed
+    assert store.exists("type.ninja")
+    with pytest.raises(FileNotFoundError):
+        store.read_bytes("missing.ninja")
+    (tmp_path / "numpy" / storage.PACKED_FILE).write_bytes(b"not a packed file at all")
+    with pytest.raises(ValueError):
+        storage.open_store(tmp_path / "numpy")
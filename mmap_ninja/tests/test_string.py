@@ -1,10 +1,12 @@
 import json
 import os
+import re
 import stat
 
+import numpy as np
 import pytest
 
-from mmap_ninja import generic
+from mmap_ninja import base, compression, generic
 from mmap_ninja.string import StringsMmap
 
 
@@ -44,6 +46,10 @@ def test_extend(tmp_path):
     assert memmap[-1] == "uga dunga"
     assert memmap[-2] == "new2"
     assert memmap[-3] == "new"
+    assert (tmp_path / "strings_memmap" / "ends" / "data.ninja").stat().st_size > 9 * 8
+    memmap.close()
+    assert (tmp_path / "strings_memmap" / "ends" / "data.ninja").stat().st_size == 9 * 8
+    assert memmap[-1] == "uga dunga"
 
 
 def test_append(tmp_path):
@@ -65,6 +71,7 @@ def test_from_generator(tmp_path, n):
     memmap = StringsMmap.from_generator(tmp_path / "strings_memmap", generate_strs(n), 4, verbose=True)
     for i in range(n):
         assert str(i) == memmap[i]
+    assert (tmp_path / "strings_memmap" / "starts" / "data.ninja").stat().st_size == 8 * n
     generic.open_existing(tmp_path / "strings_memmap")
 
 
@@ -114,3 +121,193 @@ def test_empty_strings_mmap(tmp_path):
     assert len(strings_mmap) == 1
     assert strings_mmap[0] == "icak"
 
+
+def test_in_memory_index(tmp_path):
+    list_of_strings = ["Torba", "Boiler", "a", "zele pitka", "", "popo"]
+    StringsMmap.from_strings(tmp_path / "strings_memmap", list_of_strings)
+    memmap = StringsMmap(tmp_path / "strings_memmap", in_memory_index=True)
+    assert memmap.offsets is not None
+    for i, string in enumerate(list_of_strings):
+        assert string == memmap[i]
+    assert memmap[-1] == "popo"
+    memmap.extend(["new"])
+    assert memmap[-1] == "new"
+    assert len(memmap.offsets) == len(list_of_strings) + 1
+
+
+def test_many_small_extends(tmp_path):
+    memmap = StringsMmap(tmp_path / "strings_memmap")
+    for i in range(300):
+        memmap.append(str(i))
+    reopened = StringsMmap(tmp_path / "strings_memmap")
+    assert len(reopened) == 300
+    assert [memmap[i] for i in range(300)] == [reopened[i] for i in range(300)] == [str(i) for i in range(300)]
+
+
+def test_fields_are_loaded_lazily(tmp_path):
+    list_of_strings = ["Torba", "Boiler", "a", "zele pitka", "", "popo"]
+    StringsMmap.from_strings(tmp_path / "strings_memmap", list_of_strings)
+    memmap = StringsMmap(tmp_path / "strings_memmap")
+    assert not any(name in vars(memmap) for name in StringsMmap._lazy_fields)
+    assert len(memmap) == 6
+    # The first use opens all of the persisted fields together, but not the in-memory index.
+    assert "buffer" in vars(memmap) and "ends" in vars(memmap) and "offsets" not in vars(memmap)
+    assert memmap[[-1, 0]] == ["popo", "Torba"]
+    memmap.close()
+    assert memmap[1] == "Boiler"
+
+
+def test_advise(tmp_path):
+    strs = list(generate_strs(1000))
+    StringsMmap.from_strings(tmp_path / "advised", strs)
+    memmap = StringsMmap(tmp_path / "advised")
+    memmap.advise("sequential")
+    memmap.willneed(range(0, 1000, 7))
+    assert memmap[999] == strs[999]
+    memmap.advise("random")
+    memmap.willneed([-1, 0])
+    assert memmap[0] == strs[0]
+    memmap.extend(["extra"])
+    assert memmap[-1] == "extra"
+    assert memmap.advice == "random"
+    with pytest.raises(ValueError):
+        memmap.advise("sometimes")
+
+
+def test_bulk_encoding(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "_ENCODE_CHUNK", 3)
+    strs = ["ascii", "", "ünïcödé", "日本語", "a", "b", "c", ""]
+    bytes_slices = base._sequence_of_strings_to_bytes(strs)
+    assert bytes_slices.buffer == "".join(strs).encode("utf-8")
+    assert bytes_slices.ends.tolist() == np.cumsum([len(s.encode("utf-8")) for s in strs]).tolist()
+    for name, strings in [("list", strs), ("unicode", np.array(strs)), ("object", np.array(strs, dtype=object))]:
+        memmap = StringsMmap.from_strings(tmp_path / name, strings)
+        assert list(memmap) == strs
+        memmap.extend(np.array(["more", "ö"]))
+        assert memmap[-2:] == ["more", "ö"]
+    assert [bytes(e) for e in bytes_slices.encoded()] == [s.encode("utf-8") for s in strs]
+
+
+def test_encoding_iterables(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "_ENCODE_CHUNK", 3)
+    strs = [f"{i} ö" for i in range(10)]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", (s for s in strs), verbose=True)
+    assert list(memmap) == strs
+    memmap.extend(iter(["x", "y"]))
+    memmap.extend(s for s in [])
+    assert list(memmap) == strs + ["x", "y"]
+    assert len(StringsMmap.from_strings(tmp_path / "empty", iter([]))) == 0
+
+
+def test_chunked_extend_of_compressed_and_hashed(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "_ENCODE_CHUNK", 3)
+    strs = [f"{i % 7}-{'ü' * (i % 5)}" for i in range(20)]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strs[:5], hash_index=True)
+    memmap.extend(strs[5:12])
+    assert [memmap.index_of(s) for s in strs[:12]] == [strs.index(s) for s in strs[:12]]
+    memmap.close()
+    compression.compress(tmp_path / "strings", codec="zlib", block_nbytes=8)
+    compressed = StringsMmap(tmp_path / "strings")
+    compressed.extend(s for s in strs[12:])
+    assert list(compressed) == strs
+    assert [compressed.index_of(s) for s in strs] == [strs.index(s) for s in strs]
+
+
+def test_from_offsets(tmp_path):
+    strs = ["hello", "", "wörld", "!"]
+    encoded = [s.encode("utf-8") for s in strs]
+    offsets = 3 + np.cumsum([0] + [len(e) for e in encoded])
+    buffer = np.frombuffer(b"xyz" + b"".join(encoded) + b"tail", dtype=np.uint8)
+    memmap = StringsMmap.from_offsets(tmp_path / "arrow", offsets, buffer)
+    assert list(memmap) == strs
+    assert (tmp_path / "arrow" / "data.ninja").read_bytes() == b"".join(encoded)
+    assert len(StringsMmap.from_offsets(tmp_path / "empty", [0], b"")) == 0
+    with pytest.raises(ValueError):
+        StringsMmap.from_offsets(tmp_path / "bad", [0, 2, 1], b"abc")
+    with pytest.raises(ValueError):
+        StringsMmap.from_offsets(tmp_path / "bad", [0, 4], b"abc")
+
+
+def test_compact_index(tmp_path):
+    strs = list(generate_strs(100))
+    memmap = StringsMmap.from_strings(tmp_path / "compact", strs, compact_index=True)
+    assert not (tmp_path / "compact" / "starts").exists()
+    assert memmap[:] == strs
+    assert StringsMmap(tmp_path / "compact", in_memory_index=True)[[5, -1]] == [strs[5], strs[-1]]
+    memmap.extend(["one", "two"])
+    memmap.append("three")
+    assert StringsMmap(tmp_path / "compact")[-3:] == ["one", "two", "three"]
+
+
+@pytest.mark.parametrize("compact_index", [False, True])
+def test_find_and_filter(tmp_path, compact_index):
+    strs = ["xa", "aa", "", "ab", "cd", "ünicode", "", "bab", "a"] * 20
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strs, compact_index=compact_index)
+
+    def expected(predicate):
+        return [i for i, s in enumerate(strs) if predicate(s)]
+
+    for chunk_nbytes in [1, 7, 1 << 20]:
+        assert memmap.find("aa", chunk_nbytes=chunk_nbytes).tolist() == expected(lambda s: "aa" in s)
+        assert memmap.find(b"bc", chunk_nbytes=chunk_nbytes).tolist() == []
+        assert memmap.find("ni", chunk_nbytes=chunk_nbytes).tolist() == expected(lambda s: "ni" in s)
+        # The greedy match "abb" spans "ab" and "bab", but "ab" matches on its own.
+        regex = re.compile(rb"ab+")
+        assert memmap.find(regex, chunk_nbytes=chunk_nbytes).tolist() == expected(lambda s: "ab" in s)
+        lengths = memmap.filter(lambda b: len(b) == 2, chunk_nbytes=chunk_nbytes)
+        assert lengths.tolist() == expected(lambda s: len(s.encode()) == 2)
+    assert memmap.find("").tolist() == list(range(len(strs)))
+    assert memmap.find("a", n_jobs=2, chunk_nbytes=16).tolist() == expected(lambda s: "a" in s)
+    with pytest.raises(ValueError):
+        memmap.find(re.compile("a"))
+    assert StringsMmap.from_strings(tmp_path / "empty", []).find("a").tolist() == []
+
+    compression.compress(tmp_path / "strings", codec="zlib", block_nbytes=16)
+    compressed = StringsMmap(tmp_path / "strings")
+    assert compressed.find("aa", chunk_nbytes=10).tolist() == expected(lambda s: "aa" in s)
+
+
+@pytest.mark.parametrize("in_memory_index", [False, True])
+def test_variable_length_updates(tmp_path, in_memory_index):
+    strs = ["zero", "one", "two", "three", "four"]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strs, in_memory_index=in_memory_index)
+    data_nbytes = os.path.getsize(tmp_path / "strings" / "data.ninja")
+    memmap[1] = "1"
+    memmap[[3, 0, 3]] = ["a much longer three", "ünicöde zero", "3"]
+    strs[1], strs[0], strs[3] = "1", "ünicöde zero", "3"
+    assert memmap[:] == strs
+    assert memmap.dead_nbytes == 2 + 4 + 4
+    # Only the zero, which did not fit into its slot, was appended.
+    assert os.path.getsize(tmp_path / "strings" / "data.ninja") == data_nbytes + len("ünicöde zero".encode())
+    memmap.extend(["five"])
+    memmap.append("")
+    memmap[2] = "two, but longer"
+    strs += ["five", ""]
+    strs[2] = "two, but longer"
+    assert memmap[:] == strs
+    assert memmap.find("zero").tolist() == [0]
+    assert memmap.find("o").tolist() == [0, 2, 4]
+    assert memmap.filter(lambda b: len(b) == 1).tolist() == [1, 3]
+    memmap.close()
+    reopened = StringsMmap(tmp_path / "strings", in_memory_index=in_memory_index)
+    assert reopened[:] == strs
+    assert reopened.dead_nbytes == 2 + 4 + 4 + 3
+
+
+def test_update_restrictions(tmp_path):
+    memmap = StringsMmap.from_strings(tmp_path / "compact", ["abc", "def"], compact_index=True)
+    memmap[0] = "xyz"
+    assert memmap[:] == ["xyz", "def"]
+    with pytest.raises(ValueError):
+        memmap[0] = "longer"
+
+
+def test_empty_data(tmp_path):
+    memmap = StringsMmap.from_strings(tmp_path / "empty_strings", ["", ""])
+    assert memmap[:] == ["", ""]
+    assert len(memmap.buffer) == 0
+    assert memmap.find("a").tolist() == []
+    memmap[0] = ""
+    memmap[1] = "abc"
+    memmap.append("d")
+    assert StringsMmap(tmp_path / "empty_strings")[:] == ["", "abc", "d"]
@@ -0,0 +1,144 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from mmap_ninja import numpy as np_ninja
+from mmap_ninja import storage
+from mmap_ninja import tombstones
+from mmap_ninja.prefetch import prefetch
+from mmap_ninja.ragged import RaggedMmap
+from mmap_ninja.string import StringsMmap
+
+
+@pytest.mark.parametrize("in_memory_index", [False, True])
+def test_delete_and_compact_ragged(tmp_path, in_memory_index):
+    samples = [np.arange(i * 3).reshape(i, 3) for i in range(1, 7)]
+    memmap = RaggedMmap.from_lists(tmp_path / "ragged", samples, mode="r+", in_memory_index=in_memory_index)
+    memmap.delete([1, 4])
+    del samples[4], samples[1]
+    assert len(memmap) == 4
+    assert np.array_equal(memmap[1], samples[1])
+    assert np.array_equal(memmap[-1], samples[-1])
+    for actual, expected in zip(memmap[[3, 0]], [samples[3], samples[0]]):
+        assert np.array_equal(actual, expected)
+    memmap[0] = np.ones((8, 3))
+    samples[0] = np.ones((8, 3))
+    memmap.extend([np.zeros((2, 3))])
+    samples.append(np.zeros((2, 3)))
+    memmap.delete([2])
+    del samples[2]
+
+    reopened = RaggedMmap(tmp_path / "ragged", in_memory_index=in_memory_index)
+    assert len(reopened) == len(samples)
+    # The range planning of the async reader and the prefetcher go through the logical indices, too.
+    for actual, expected in zip(asyncio.run(reopened.aget_many([3, 1])), [samples[3], samples[1]]):
+        assert np.array_equal(actual, expected)
+    for actual, expected in zip(prefetch(reopened, [3, 0], lookahead=2), [samples[3], samples[0]]):
+        assert np.array_equal(actual, expected)
+    for actual, expected in zip(reopened[:], samples):
+        assert np.array_equal(actual, expected)
+    # A reader which has not read any sample yet must not mix the old and the new version either.
+    partial = RaggedMmap(tmp_path / "ragged", in_memory_index=in_memory_index)
+    assert len(partial) == len(samples)
+    old_samples = list(samples)
+    memmap.delete([0, 1])
+    del samples[:2]
+
+    data_file = tmp_path / "ragged" / "data.ninja"
+    nbytes = data_file.stat().st_size
+    memmap.compact()
+    assert data_file.stat().st_size == sum(sample.nbytes for sample in samples) < nbytes
+    assert memmap.dead_nbytes == 0
+    assert not (tmp_path / "ragged" / tombstones.TOMBSTONES_KEY).exists()
+    # The readers which opened the old version keep reading it.
+    readers = [(memmap, samples), (partial, old_samples), (RaggedMmap(tmp_path / "ragged"), samples)]
+    for container, expected_samples in readers:
+        assert len(container) == len(expected_samples)
+        for i, expected in enumerate(expected_samples):
+            assert np.array_equal(container[i], expected)
+
+    memmap.delete(list(range(len(memmap))))
+    assert len(memmap) == 0
+    memmap.compact()
+    assert len(RaggedMmap(tmp_path / "ragged")) == 0
+
+
+def test_delete_and_compact_strings(tmp_path):
+    strings = ["foo", "bar", "foobar", "baz", "bar", "qux"]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strings, hash_index=True)
+    memmap.delete([1, 3])
+    live = ["foo", "foobar", "bar", "qux"]
+    assert len(memmap) == 4
+    assert memmap[:] == live
+    assert memmap[2] == "bar"
+    assert memmap.find("bar").tolist() == [1, 2]
+    assert memmap.filter(lambda string: string.startswith(b"q")).tolist() == [3]
+    assert memmap.index_of("bar") == 2
+    assert not memmap.contains("baz")
+    memmap[1] = "a longer string"
+    memmap.extend(["baz"])
+    live[1] = "a longer string"
+    live.append("baz")
+    assert memmap.index_of("baz") == 4
+    assert StringsMmap(tmp_path / "strings")[:] == live
+    # A reader which has not read any string yet keeps reading the version it opened.
+    partial = StringsMmap(tmp_path / "strings")
+    assert len(partial) == len(live)
+    old_live = list(live)
+    memmap.delete([0, 1, 2])
+    del live[:3]
+
+    memmap.compact()
+    assert (tmp_path / "strings" / "data.ninja").stat().st_size == sum(len(string) for string in live)
+    assert memmap[:] == live
+    assert memmap.dead_nbytes == 0
+    assert memmap.index_of_many(["qux", "baz", "bar"]).tolist() == [0, 1, -1]
+    assert [partial[i] for i in range(len(old_live))] == old_live
+    assert partial.index_of("baz") == 4
+    storage.pack(tmp_path / "strings", tmp_path / "packed")
+    with pytest.raises(ValueError):
+        StringsMmap(tmp_path / "packed").delete([0])
+
+
+def test_delete_touches_only_its_hash_slots(tmp_path):
+    strings = [f"string {i % 500}" for i in range(1000)]
+    memmap = StringsMmap.from_strings(tmp_path / "strings", strings, hash_index=True)
+    table = memmap.hash_index.table
+    before = np.array(table)
+    memmap.delete([7, 100, 100])
+    assert memmap.hash_index.table.filename == table.filename
+    after = np.array(memmap.hash_index.table)
+    assert 0 < np.count_nonzero(after != before) <= 8
+    assert np.count_nonzero(after >= 0) == 998
+    # The equal strings after the deleted ones are found instead.
+    assert memmap.index_of_many(["string 7", "string 100", "string 8"]).tolist() == [505, 598, 7]
+
+
+def test_delete_rows_and_compact_array(tmp_path):
+    arr = np.arange(20).reshape(10, 2)
+    np_ninja.from_ndarray(tmp_path / "arr", arr)
+    assert tombstones.live_rows(tmp_path / "arr").tolist() == list(range(10))
+    tombstones.delete_rows(tmp_path / "arr", [0, 9])
+    tombstones.delete_rows(tmp_path / "arr", slice(4, 6))
+    live = tombstones.live_rows(tmp_path / "arr")
+    assert live.tolist() == [1, 2, 3, 6, 7, 8]
+    old = np_ninja.open_existing(tmp_path / "arr")
+    tombstones.compact_array(tmp_path / "arr")
+    assert np.array_equal(np_ninja.open_existing(tmp_path / "arr"), arr[live])
+    assert np.array_equal(old, arr)
+    assert tombstones.live_rows(tmp_path / "arr").tolist() == list(range(6))
+
+
+@pytest.mark.parametrize("kernel_copy", [True, False])
+def test_copy_ranges(tmp_path, monkeypatch, kernel_copy):
+    if not kernel_copy:
+        for name in ["copy_file_range", "sendfile"]:
+            monkeypatch.delattr(os, name, raising=False)
+    monkeypatch.setattr(tombstones, "_COPY_CHUNK", 3)
+    (tmp_path / "src").write_bytes(b"0123456789")
+    with open(tmp_path / "src", "rb") as src, open(tmp_path / "dst", "wb") as dst:
+        dst.write(b"x")
+        tombstones._copy_ranges(src, dst, np.array([0, 2, 7]), np.array([2, 6, 10]))
+    assert (tmp_path / "dst").read_bytes() == b"x012345789"